@@ -0,0 +1,209 @@
+"""
+Sources of Victron BLE advertisements for the collector.
+
+All sources look like a BleakScanner to main.py: they are created with a
+detection callback and have async start()/stop(). The callback receives
+objects with the attributes the collector uses (device.address,
+device.name, advertisement_data.manufacturer_data, advertisement_data.rssi).
+
+    live     BleakScanner, as before
+    capture  live, and every Victron advertisement is appended to CAPTURE_FILE
+    replay   adverts from REPLAY_FILE fed back at REPLAY_SPEED x real time,
+             or as fast as possible with REPLAY_SPEED=0 (no Bluetooth adapter needed)
+
+Replayed advertisements carry the time they were captured (captured_at, epoch
+seconds; shifted forward on each pass of a looping replay). The collector
+stamps and samples them on that clock, so a replay at N x records N times as
+many readings per second, with the timestamps they were captured at.
+
+Capture files are NDJSON, one advertisement per line:
+
+    {"t":"2025-05-26T10:00:00.123456+00:00","address":"DF:C9:B0:6E:3F:EF",
+     "name":"SmartSolar HQ2231ABCDE","rssi":-71,"data":"100053a001..."}
+
+where data is the 0x02E1 manufacturer payload in hex. synthetic.py writes
+files in the same format.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+VICTRON_MANUFACTURER_ID = 0x02E1
+
+ADVERT_SOURCES = ('live', 'capture', 'replay')
+
+class ReplayDevice:
+    """Stand-in for bleak's BLEDevice."""
+
+    __slots__ = ('address', 'name', 'replayed')
+
+    def __init__(self, address, name):
+        self.address = address
+        self.name = name
+        self.replayed = True  # No real device behind it: GATT reads are skipped
+
+class ReplayAdvertisement:
+    """Stand-in for bleak's AdvertisementData."""
+
+    __slots__ = ('manufacturer_data', 'rssi', 'local_name', 'captured_at')
+
+    def __init__(self, manufacturer_data, rssi, local_name, captured_at=None):
+        self.manufacturer_data = manufacturer_data
+        self.rssi = rssi
+        self.local_name = local_name
+        self.captured_at = captured_at
+
+def capture_line(device, advertisement_data, data):
+    """Serialized capture entry for one Victron advertisement."""
+    entry = {
+        't': datetime.now(timezone.utc).isoformat(),
+        'address': device.address,
+        'name': device.name,
+        'rssi': getattr(advertisement_data, 'rssi', None),
+        'data': bytes(data).hex(),
+    }
+    return json.dumps(entry, separators=(',', ':')) + '\n'
+
+def read_capture(path):
+    """(epoch seconds, device, advertisement) for each line of a capture file."""
+    adverts = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+                t = datetime.fromisoformat(entry['t'])
+                if t.tzinfo is None:
+                    t = t.replace(tzinfo=timezone.utc)
+                data = bytes.fromhex(entry['data'])
+            except (ValueError, KeyError) as e:
+                logger.warning(f"Skipping line {line_number} of {path}: {e}")
+                continue
+            device = ReplayDevice(entry['address'], entry.get('name'))
+            advert = ReplayAdvertisement({VICTRON_MANUFACTURER_ID: data}, entry.get('rssi'), entry.get('name'),
+                                         t.timestamp())
+            adverts.append((t.timestamp(), device, advert))
+    adverts.sort(key=lambda item: item[0])
+    return adverts
+
+class LiveSource:
+    """The BLE adapter, through bleak."""
+
+    def __init__(self, detection_callback):
+        from bleak import BleakScanner
+        self._scanner = BleakScanner(detection_callback=detection_callback)
+
+    async def start(self):
+        await self._scanner.start()
+
+    async def stop(self):
+        await self._scanner.stop()
+
+class CaptureSource(LiveSource):
+    """Live scanning that also appends every Victron advertisement to a file."""
+
+    def __init__(self, detection_callback, path):
+        self.path = path
+        self._file = None
+        self.captured = 0
+
+        def capture_callback(device, advertisement_data):
+            data = (advertisement_data.manufacturer_data or {}).get(VICTRON_MANUFACTURER_ID)
+            if data is not None and self._file is not None:
+                try:
+                    self._file.write(capture_line(device, advertisement_data, data))
+                    self.captured += 1
+                except OSError as e:
+                    logger.error(f"Error writing capture file {self.path}: {e}")
+            detection_callback(device, advertisement_data)
+
+        super().__init__(capture_callback)
+
+    async def start(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Line buffered: a capture survives the collector being killed
+        self._file = open(self.path, 'a', encoding='utf-8', buffering=1)
+        logger.info(f"Capturing advertisements to {self.path}")
+        await super().start()
+
+    async def stop(self):
+        try:
+            await super().stop()
+        finally:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            logger.info(f"Captured {self.captured} advertisement(s) to {self.path}")
+
+class ReplaySource:
+    """Feeds a capture file back at `speed` times real time (optionally looping)."""
+
+    def __init__(self, detection_callback, path, speed=1.0, loop=False):
+        self.detection_callback = detection_callback
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self._task = None
+        self.replayed = 0
+
+    async def start(self):
+        adverts = read_capture(self.path)
+        if not adverts:
+            raise ValueError(f"No advertisements in {self.path}")
+        pace = f"{self.speed:g}x" if self.speed > 0 else "full speed"
+        logger.info(f"Replaying {len(adverts)} advertisement(s) from {self.path} at {pace}")
+        self._task = asyncio.create_task(self._run(adverts))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, adverts):
+        first = adverts[0][0]
+        # Each pass of a loop continues the capture's clock instead of repeating it
+        period = adverts[-1][0] - first + 1.0
+        offset = 0.0
+        while True:
+            # Schedule against a fixed start so callback time does not accumulate as lag
+            started = time.monotonic()
+            for t, device, advert in adverts:
+                if self.speed > 0:
+                    delay = started + (t - first) / self.speed - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                else:
+                    # Let the consumers run between adverts
+                    await asyncio.sleep(0)
+                advert.captured_at = t + offset
+                try:
+                    self.detection_callback(device, advert)
+                except Exception as e:
+                    logger.error(f"Error handling replayed advertisement: {e}")
+                self.replayed += 1
+            if not self.loop:
+                logger.info(f"Replay finished after {self.replayed} advertisement(s)")
+                return
+            offset += period
+
+def create_source(detection_callback, kind='live', capture_file=None, replay_file=None,
+                  replay_speed=1.0, replay_loop=False):
+    """Advertisement source of the given kind, with the callback attached."""
+    if kind == 'capture':
+        return CaptureSource(detection_callback, capture_file)
+    if kind == 'replay':
+        return ReplaySource(detection_callback, replay_file, replay_speed, replay_loop)
+    return LiveSource(detection_callback)
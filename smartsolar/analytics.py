@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+Energy and yield analytics per device over a date range.
+
+A day's readings are loaded into NumPy arrays, one set per device. Archived
+days are read straight from the archive's columns; NDJSON days are parsed
+once. The whole day is then summarized in one vectorized pass:
+
+    energy_wh          solar_power integrated over time (trapezoidal, or held
+                       until the next record for deadband-filtered records,
+                       gaps as in rollups.py)
+    yield_wh           the charger's own yield_today counter, summed over its
+                       increments; after a reset (the counter drops) the new
+                       value counts from zero
+    peak_power_w       highest solar_power (and when)
+    charge_state_s     seconds spent in each charge_state (a state holds until
+                       the next record, at most MAX_HOLD_GAP)
+    battery_voltage_*  lowest (and when) and highest battery voltage
+
+Day summaries are merged into day/week/month periods. Closed days never
+change, so their summaries are memoized in memory and on disk
+(analytics/YYYY-MM-DD.json, checked against the source file's size and
+mtime). Today's file is read incrementally, only the lines added since the
+last request.
+
+NumPy is optional: without it available() is False and the dashboard's
+analytics endpoint answers 503.
+
+    python3 analytics.py --from 2025-05-01 --to 2025-05-31 --period week
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+from archive import ArchiveReader, INT_MISSING, archive_path_for
+from ndjson_reader import data_file_for_date
+from readings import decode_line
+from recording_filter import STEP_POLICIES
+from rollups import MAX_ENERGY_GAP, MAX_HOLD_GAP, parse_timestamp
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+PERIODS = ('day', 'week', 'month')
+
+# Bumped when summaries change, so memoized ones are recomputed
+ANALYTICS_VERSION = 1
+
+# Longest range one request may cover
+MAX_DAYS = 731
+
+# Closed days kept in memory (a summary is a few hundred bytes per device)
+MEMORY_DAYS = 1024
+
+CACHE_DIR_NAME = 'analytics'
+
+_FIELDS = ('solar_power', 'yield_today', 'battery_voltage')
+
+def available():
+    """Whether NumPy is installed."""
+    return np is not None
+
+def _iso(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat()
+
+def _number(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return float('nan')
+
+class _Series:
+    """A device's readings for one day as arrays (times in epoch seconds)."""
+
+    def __init__(self, device_name, times, values, states, state_names, stepped):
+        self.device_name = device_name
+        self.times = times
+        self.values = values              # field -> float64 array, NaN where missing
+        self.states = states              # int64 codes into state_names, -1 where missing
+        self.state_names = state_names
+        self.stepped = stepped            # bool array: held until the next record
+
+    def summary(self):
+        order = np.argsort(self.times, kind='stable')
+        if np.any(order != np.arange(len(order))):
+            self.times = self.times[order]
+            self.values = {k: v[order] for k, v in self.values.items()}
+            self.states = self.states[order]
+            self.stepped = self.stepped[order]
+        t = self.times
+        out = {'device_name': self.device_name, 'samples': int(len(t)),
+               'first': _iso(t[0]), 'last': _iso(t[-1])}
+        out.update(_energy(t, self.values['solar_power'], self.stepped))
+        out.update(_yield(self.values['yield_today']))
+        out.update(_dwell(t, self.states, self.state_names))
+        out.update(_voltage(t, self.values['battery_voltage']))
+        return out
+
+def _energy(t, power, stepped):
+    present = ~np.isnan(power)
+    t, power, stepped = t[present], power[present], stepped[present]
+    if len(t) == 0:
+        return {'energy_wh': 0.0, 'peak_power_w': None, 'peak_power_at': None}
+    peak = int(np.argmax(power))
+    dt = np.diff(t)
+    held = stepped[:-1]
+    wh = np.where(held, power[:-1] * dt, (power[:-1] + power[1:]) * 0.5 * dt)
+    valid = (dt > 0) & (dt <= np.where(held, MAX_HOLD_GAP, MAX_ENERGY_GAP))
+    return {'energy_wh': float(wh[valid].sum()) / 3600.0,
+            'peak_power_w': float(power[peak]), 'peak_power_at': _iso(t[peak])}
+
+def _yield(counter):
+    counter = counter[~np.isnan(counter)]
+    if len(counter) < 2:
+        return {'yield_wh': 0.0, 'yield_resets': 0}
+    step = np.diff(counter)
+    reset = step < 0
+    return {'yield_wh': float(np.where(reset, counter[1:], step).sum()),
+            'yield_resets': int(reset.sum())}
+
+def _dwell(t, states, names):
+    present = states >= 0
+    t, states = t[present], states[present]
+    if len(t) < 2:
+        return {'charge_state_s': {}}
+    dt = np.diff(t)
+    valid = (dt > 0) & (dt <= MAX_HOLD_GAP)
+    seconds = np.bincount(states[:-1][valid], weights=dt[valid], minlength=len(names))
+    return {'charge_state_s': {str(names[i]): float(s) for i, s in enumerate(seconds) if s > 0}}
+
+def _voltage(t, voltage):
+    present = ~np.isnan(voltage)
+    if not present.any():
+        return {'battery_voltage_min': None, 'battery_voltage_min_at': None, 'battery_voltage_max': None}
+    t, voltage = t[present], voltage[present]
+    low = int(np.argmin(voltage))
+    return {'battery_voltage_min': float(voltage[low]), 'battery_voltage_min_at': _iso(t[low]),
+            'battery_voltage_max': float(voltage.max())}
+
+def _float_column(reader, device, name, rows):
+    """An archive column as float64 with NaN for missing values."""
+    column_type = reader.column_type(device, name)
+    if column_type is None:
+        return np.full(rows, np.nan)
+    column = reader.column(device, name)
+    if column_type == 'float':
+        return np.frombuffer(column, dtype=np.float64)
+    if column_type == 'int':
+        ints = np.frombuffer(column, dtype=np.int64)
+        return np.where(ints == INT_MISSING, np.nan, ints.astype(np.float64))
+    return np.array([_number(v) for v in column], dtype=np.float64)
+
+def _enum_codes(reader, device, name, rows):
+    """(codes, names) for an archive column; code -1 is missing."""
+    column_type = reader.column_type(device, name)
+    if column_type is None:
+        return np.full(rows, -1, dtype=np.int64), []
+    if column_type == 'enum':
+        codes, dictionary = reader.enum_column(device, name)
+        return np.frombuffer(codes, dtype=np.uint16).astype(np.int64) - 1, dictionary
+    return _codes(reader.column(device, name))
+
+def _codes(values):
+    names, lookup, codes = [], {}, []
+    for value in values:
+        if value is None:
+            codes.append(-1)
+            continue
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(names)
+            names.append(value)
+        codes.append(code)
+    return np.array(codes, dtype=np.int64), names
+
+def series_from_archive(path):
+    """device address -> _Series for an archived day."""
+    reader = ArchiveReader(path)
+    out = {}
+    for device in reader.devices():
+        rows = reader.row_count(device)
+        if not rows:
+            continue
+        times = np.frombuffer(reader.column(device, 'timestamp'), dtype=np.int64) / 1e6
+        values = {field: _float_column(reader, device, field, rows) for field in _FIELDS}
+        states, state_names = _enum_codes(reader, device, 'charge_state', rows)
+        policies, policy_names = _enum_codes(reader, device, 'record_policy', rows)
+        step_codes = [i for i, name in enumerate(policy_names) if name in STEP_POLICIES]
+        names = reader.column(device, 'device_name')
+        out[device] = _Series(names[-1] if names else None, times, values, states, state_names,
+                              np.isin(policies, step_codes))
+    return out
+
+class _DayColumns:
+    """Per-device columns of an NDJSON day, extended as the file grows."""
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.devices = {}   # address -> [name, times, {field: values}, states, stepped]
+
+    def update(self):
+        """Read the lines added since the last call."""
+        size = os.path.getsize(self.path)
+        if size < self.offset:
+            self.offset, self.devices = 0, {}
+        if size == self.offset:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    break
+                self.offset += len(raw)
+                record = decode_line(raw)
+                if record is not None:
+                    self._add(record)
+
+    def _add(self, record):
+        parsed_data = record.get('parsed_data')
+        address = record.get('device_address')
+        timestamp = parse_timestamp(record.get('timestamp'))
+        if not isinstance(parsed_data, dict) or not address or timestamp is None:
+            return
+        device = self.devices.get(address)
+        if device is None:
+            device = self.devices[address] = [None, [], {field: [] for field in _FIELDS}, [], []]
+        device[0] = record.get('device_name') or device[0]
+        device[1].append(timestamp)
+        for field in _FIELDS:
+            device[2][field].append(_number(parsed_data.get(field)))
+        device[3].append(parsed_data.get('charge_state'))
+        device[4].append(record.get('record_policy') in STEP_POLICIES)
+
+    def series(self):
+        out = {}
+        for address, (name, times, values, states, stepped) in self.devices.items():
+            codes, state_names = _codes(states)
+            out[address] = _Series(name, np.array(times), {k: np.array(v) for k, v in values.items()},
+                                   codes, state_names, np.array(stepped, dtype=bool))
+        return out
+
+def summarize(series):
+    """device address -> summary for a day's series."""
+    return {address: s.summary() for address, s in series.items()}
+
+def _merge(total, day):
+    if total is None:
+        total = dict(day)
+        total['charge_state_s'] = dict(day['charge_state_s'])
+        return total
+    total['device_name'] = day['device_name'] or total['device_name']
+    total['samples'] += day['samples']
+    total['first'] = min(total['first'], day['first'])
+    total['last'] = max(total['last'], day['last'])
+    total['energy_wh'] += day['energy_wh']
+    total['yield_wh'] += day['yield_wh']
+    total['yield_resets'] += day['yield_resets']
+    if day['peak_power_w'] is not None and (total['peak_power_w'] is None
+                                           or day['peak_power_w'] > total['peak_power_w']):
+        total['peak_power_w'], total['peak_power_at'] = day['peak_power_w'], day['peak_power_at']
+    for state, seconds in day['charge_state_s'].items():
+        total['charge_state_s'][state] = total['charge_state_s'].get(state, 0.0) + seconds
+    if day['battery_voltage_min'] is not None:
+        if total['battery_voltage_min'] is None or day['battery_voltage_min'] < total['battery_voltage_min']:
+            total['battery_voltage_min'] = day['battery_voltage_min']
+            total['battery_voltage_min_at'] = day['battery_voltage_min_at']
+        if total['battery_voltage_max'] is None or day['battery_voltage_max'] > total['battery_voltage_max']:
+            total['battery_voltage_max'] = day['battery_voltage_max']
+    return total
+
+def _rounded(summary):
+    summary = {k: v for k, v in summary.items() if k != 'device_name'}
+    summary['energy_wh'] = round(summary['energy_wh'], 2)
+    summary['yield_wh'] = round(summary['yield_wh'], 2)
+    summary['charge_state_s'] = {k: round(v, 1) for k, v in summary['charge_state_s'].items()}
+    return summary
+
+def period_start(date_str, period):
+    """First day of the day/week (Monday)/month a date belongs to."""
+    day = date.fromisoformat(date_str)
+    if period == 'week':
+        day -= timedelta(days=day.weekday())
+    elif period == 'month':
+        day = day.replace(day=1)
+    return day.isoformat()
+
+class Analytics:
+    """Day summaries for a data directory, memoized for closed days."""
+
+    def __init__(self, data_dir, cache_dir=None, memory_days=MEMORY_DAYS):
+        self.data_dir = data_dir
+        self.cache_dir = cache_dir or os.path.join(data_dir, CACHE_DIR_NAME)
+        self.memory_days = memory_days
+        self._memo = OrderedDict()   # date -> (source signature, summaries)
+        self._open_days = {}         # path -> _DayColumns
+        self._lock = threading.Lock()
+
+    def _source(self, date_str):
+        """(path, signature) of a day's data, or (None, None)."""
+        for path in (archive_path_for(self.data_dir, date_str), data_file_for_date(self.data_dir, date_str)):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            return path, f"{os.path.basename(path)}:{st.st_size}:{st.st_mtime_ns}"
+        return None, None
+
+    def _load_cached(self, date_str, signature):
+        try:
+            with open(os.path.join(self.cache_dir, f"{date_str}.json")) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cached.get('version') != ANALYTICS_VERSION or cached.get('source') != signature:
+            return None
+        return cached['devices']
+
+    def _save_cached(self, date_str, signature, summaries):
+        path = os.path.join(self.cache_dir, f"{date_str}.json")
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': ANALYTICS_VERSION, 'source': signature, 'devices': summaries},
+                          f, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not save analytics for {date_str}: {e}")
+
+    def day(self, date_str, closed):
+        """device address -> summary for a day ({} if there is no data)."""
+        path, signature = self._source(date_str)
+        if path is None:
+            return {}
+        if not closed:
+            with self._lock:
+                columns = self._open_days.get(path)
+                if columns is None:
+                    # Only today's file is followed; drop yesterday's
+                    self._open_days = {path: _DayColumns(path)}
+                    columns = self._open_days[path]
+                columns.update()
+                return summarize(columns.series())
+
+        with self._lock:
+            memo = self._memo.get(date_str)
+            if memo is not None and memo[0] == signature:
+                self._memo.move_to_end(date_str)
+                return memo[1]
+        summaries = self._load_cached(date_str, signature)
+        if summaries is None:
+            if path.endswith('.ndjson'):
+                columns = _DayColumns(path)
+                columns.update()
+                summaries = summarize(columns.series())
+            else:
+                summaries = summarize(series_from_archive(path))
+            self._save_cached(date_str, signature, summaries)
+        with self._lock:
+            self._memo[date_str] = (signature, summaries)
+            self._memo.move_to_end(date_str)
+            while len(self._memo) > self.memory_days:
+                self._memo.popitem(last=False)
+        return summaries
+
+    def summary(self, from_date, to_date, period='day', device=None):
+        """Per device: summaries per period between two dates (inclusive) and the total.
+
+        Returns [{device_address, device_name, periods: [{start, ...}], total}].
+        """
+        if not available():
+            raise RuntimeError("NumPy is not installed")
+        if period not in PERIODS:
+            raise ValueError(f"Unknown period, expected one of {', '.join(PERIODS)}")
+        first, last = date.fromisoformat(from_date), date.fromisoformat(to_date)
+        if last < first:
+            raise ValueError("to is before from")
+        if (last - first).days >= MAX_DAYS:
+            raise ValueError(f"Range is longer than {MAX_DAYS} days")
+
+        today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        devices = {}   # address -> {period start: merged summary}
+        day = first
+        while day <= last:
+            date_str = day.isoformat()
+            if date_str <= today:
+                start = period_start(date_str, period)
+                for address, summary in self.day(date_str, date_str < today).items():
+                    if device and address != device:
+                        continue
+                    periods = devices.setdefault(address, {})
+                    periods[start] = _merge(periods.get(start), summary)
+            day += timedelta(days=1)
+
+        out = []
+        for address in sorted(devices):
+            periods = devices[address]
+            total = None
+            for start in sorted(periods):
+                total = _merge(total, periods[start])
+            out.append({'device_address': address, 'device_name': total['device_name'],
+                        'periods': [dict(start=start, **_rounded(periods[start])) for start in sorted(periods)],
+                        'total': _rounded(total)})
+        return out
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data-dir', default=os.environ.get('DATA_DIR', '/data/smartsolar-v1'))
+    parser.add_argument('--from', dest='from_date', required=True, help='first day (YYYY-MM-DD)')
+    parser.add_argument('--to', dest='to_date', help='last day (YYYY-MM-DD, default: --from)')
+    parser.add_argument('--period', choices=PERIODS, default='day')
+    parser.add_argument('--device', help='only this device (MAC address)')
+    args = parser.parse_args()
+
+    if not available():
+        parser.error("NumPy is not installed (pip install numpy)")
+    result = Analytics(args.data_dir).summary(args.from_date, args.to_date or args.from_date,
+                                              args.period, args.device.upper() if args.device else None)
+    print(json.dumps(result, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,565 @@
+#!/usr/bin/env python3
+"""
+Columnar, compressed archive format for closed days.
+
+Once a UTC day is over its NDJSON file is never written again, so it can be
+converted into a compact columnar file: per device, typed arrays for the
+timestamps and each parsed field, dictionary-encoded strings/enums (e.g.
+charge_state, charger_error) and raw advertisement bytes instead of hex.
+The whole payload is compressed with a stdlib codec (lzma by default).
+
+File layout (archive/data_YYYY-MM-DD.col):
+
+    b'SSCOL' | version (1 byte) | codec (1 byte) | compressed payload
+
+    payload = header length (uint32 LE) | header JSON | column buffers
+
+The header lists every column with its type, offset and length in the
+column buffers. Column types:
+
+    time   int64 microseconds since the epoch ('q')
+    int    int64, missing values stored as INT_MISSING ('q')
+    float  float64 ('d'), followed by a presence bitmap (bit i of byte i // 8
+           set when row i has a value; missing rows hold NaN). Version 1
+           files have no bitmap and NaN means missing.
+    enum   uint16 codes into a dictionary of JSON values, 0 = missing ('H')
+    blob   int32 lengths (-1 = missing) followed by the concatenated bytes
+    json   JSON text per row, '' = missing (fallback for mixed-type fields)
+
+Readers can load whole columns as arrays without building a dict per row:
+
+    reader = ArchiveReader(path)
+    times = reader.column('DF:C9:B0:6E:3F:EF', 'timestamp')
+    volts = reader.column('DF:C9:B0:6E:3F:EF', 'battery_voltage')
+
+Run this module to archive closed days:
+
+    python3 archive.py [--keep-source] [--after-days N] [--nice N] [YYYY-MM-DD ...]
+
+Days given explicitly are archived regardless of their age.
+"""
+import hashlib
+import json
+import logging
+import lzma
+import math
+import os
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone, timedelta
+from glob import glob
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'SSCOL'
+FORMAT_VERSION = 2
+# Older versions that can still be read
+READABLE_VERSIONS = (1, 2)
+CODEC_ZLIB = 1
+CODEC_LZMA = 2
+
+INT_MISSING = -(2 ** 63)
+
+ARCHIVE_DIR_NAME = 'archive'
+
+# Keys stored as dedicated columns; anything else goes into the 'extra' column
+_BASE_KEYS = ('v', 'timestamp', 'device_name', 'device_address', 'parsed_data', 'raw_data', 'record_policy')
+
+def archive_dir_for(data_dir):
+    """Directory holding the archived days."""
+    return os.path.join(data_dir, ARCHIVE_DIR_NAME)
+
+def archive_path_for(data_dir, date_str):
+    """Archive file path for a date."""
+    return os.path.join(archive_dir_for(data_dir), f"data_{date_str}.col")
+
+def list_archived_dates(data_dir):
+    """Dates that have an archive file, oldest first."""
+    dates = []
+    for path in sorted(glob(os.path.join(archive_dir_for(data_dir), 'data_*.col'))):
+        dates.append(os.path.basename(path)[len('data_'):-len('.col')])
+    return dates
+
+def _to_micros(timestamp):
+    parsed = datetime.fromisoformat(timestamp)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    delta = parsed - datetime(1970, 1, 1, tzinfo=timezone.utc)
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+def _from_micros(micros):
+    return (datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(microseconds=micros)).isoformat()
+
+_MISSING = object()
+
+def _array(typecode, raw):
+    """Array view of a column buffer (array() would iterate a memoryview)."""
+    values = array(typecode)
+    values.frombytes(raw)
+    return values
+
+def _bitmap(flags):
+    """Pack booleans into bytes, least significant bit first."""
+    packed = bytearray((len(flags) + 7) // 8)
+    for i, flag in enumerate(flags):
+        if flag:
+            packed[i >> 3] |= 1 << (i & 7)
+    return bytes(packed)
+
+def _column_type(values):
+    """Pick the most compact lossless column type for a field's values."""
+    present = [v for v in values if v is not _MISSING]
+    if all(type(v) is int for v in present):
+        return 'int'
+    if all(type(v) is float for v in present):
+        return 'float'
+    if all(isinstance(v, (str, bool)) or v is None for v in present):
+        if len(set(json.dumps(v) for v in present)) < 65535:
+            return 'enum'
+    return 'json'
+
+class _ColumnWriter:
+    """Accumulates encoded column buffers and their header entries."""
+
+    def __init__(self):
+        self.buffers = []
+        self.offset = 0
+
+    def add(self, data):
+        self.buffers.append(data)
+        entry = (self.offset, len(data))
+        self.offset += len(data)
+        return entry
+
+    def encode(self, column_type, values):
+        """Encode one column and return its header entry."""
+        entry = {'type': column_type}
+        if column_type == 'time':
+            data = array('q', values).tobytes()
+        elif column_type == 'int':
+            data = array('q', (INT_MISSING if v is _MISSING else v for v in values)).tobytes()
+        elif column_type == 'float':
+            data = (array('d', (math.nan if v is _MISSING else v for v in values)).tobytes()
+                    + _bitmap([v is not _MISSING for v in values]))
+        elif column_type == 'enum':
+            dictionary = []
+            codes_by_value = {}
+            codes = array('H')
+            for v in values:
+                if v is _MISSING:
+                    codes.append(0)
+                    continue
+                key = json.dumps(v)
+                code = codes_by_value.get(key)
+                if code is None:
+                    dictionary.append(v)
+                    code = codes_by_value[key] = len(dictionary)
+                codes.append(code)
+            entry['dict'] = dictionary
+            data = codes.tobytes()
+        elif column_type == 'blob':
+            lengths = array('i', (-1 if v is _MISSING else len(v) for v in values))
+            data = lengths.tobytes() + b''.join(v for v in values if v is not _MISSING)
+        else:
+            text = '\n'.join('' if v is _MISSING else json.dumps(v, separators=(',', ':'))
+                             for v in values)
+            data = text.encode('utf-8')
+        entry['offset'], entry['length'] = self.add(data)
+        return entry
+
+def canonical_checksum(records):
+    """Order-independent checksum of records, used to verify an archive."""
+    digests = sorted(hashlib.sha256(json.dumps(r, sort_keys=True, separators=(',', ':')).encode()).digest()
+                     for r in records)
+    return hashlib.sha256(b''.join(digests)).hexdigest()
+
+def encode_day(records, date_str, codec=CODEC_LZMA):
+    """Encode a day's records into archive bytes."""
+    by_device = {}
+    for record in records:
+        by_device.setdefault(record.get('device_address') or '', []).append(record)
+
+    columns = _ColumnWriter()
+    devices = {}
+    for address, rows in by_device.items():
+        rows.sort(key=lambda r: _to_micros(r['timestamp']))
+        times = [_to_micros(r['timestamp']) for r in rows]
+        device_columns = {
+            'timestamp': columns.encode('time', times),
+            'device_name': columns.encode('enum', [r.get('device_name', _MISSING) for r in rows]),
+        }
+        # Keep the original text of timestamps that isoformat() would not reproduce
+        # (e.g. older files without a UTC offset)
+        texts = [r['timestamp'] if _from_micros(t) != r['timestamp'] else _MISSING
+                 for r, t in zip(rows, times)]
+        if any(t is not _MISSING for t in texts):
+            device_columns['timestamp_text'] = columns.encode('json', texts)
+
+        field_names = []
+        for r in rows:
+            for key in (r.get('parsed_data') or {}):
+                if key not in field_names:
+                    field_names.append(key)
+        for key in field_names:
+            values = [r['parsed_data'].get(key, _MISSING) if isinstance(r.get('parsed_data'), dict)
+                      else _MISSING for r in rows]
+            device_columns['parsed_data.' + key] = columns.encode(_column_type(values), values)
+
+        # Distinguish "no parsed_data" from "empty parsed_data"
+        device_columns['has_parsed_data'] = columns.encode(
+            'enum', [isinstance(r.get('parsed_data'), dict) for r in rows])
+
+        if any('raw_data' in r for r in rows):
+            device_columns['raw_data'] = columns.encode(
+                'blob', [bytes.fromhex(r['raw_data']) if 'raw_data' in r else _MISSING for r in rows])
+
+        if any('record_policy' in r for r in rows):
+            device_columns['record_policy'] = columns.encode(
+                'enum', [r.get('record_policy', _MISSING) for r in rows])
+
+        # Schema version of records written from typed readings (readings.py)
+        if any('v' in r for r in rows):
+            device_columns['schema_version'] = columns.encode('enum', [r.get('v', _MISSING) for r in rows])
+
+        extras = [{k: v for k, v in r.items() if k not in _BASE_KEYS} for r in rows]
+        if any(extras):
+            device_columns['extra'] = columns.encode('json', [e if e else _MISSING for e in extras])
+
+        devices[address] = {'rows': len(rows), 'columns': device_columns}
+
+    header = json.dumps({'date': date_str, 'records': len(records), 'devices': devices},
+                        separators=(',', ':')).encode('utf-8')
+    payload = struct.pack('<I', len(header)) + header + b''.join(columns.buffers)
+    if codec == CODEC_LZMA:
+        compressed = lzma.compress(payload, preset=6)
+    else:
+        compressed = zlib.compress(payload, 9)
+    return MAGIC + bytes([FORMAT_VERSION, codec]) + compressed
+
+class ArchiveReader:
+    """Random access to the columns of an archived day."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a SmartSolar archive")
+        version, codec = data[len(MAGIC)], data[len(MAGIC) + 1]
+        if version not in READABLE_VERSIONS:
+            raise ValueError(f"Unsupported archive version {version} in {path}")
+        compressed = data[len(MAGIC) + 2:]
+        payload = lzma.decompress(compressed) if codec == CODEC_LZMA else zlib.decompress(compressed)
+
+        self.version = version
+        header_length = struct.unpack_from('<I', payload)[0]
+        self.header = json.loads(payload[4:4 + header_length])
+        self._buffers = memoryview(payload)[4 + header_length:]
+
+    @property
+    def date(self):
+        return self.header['date']
+
+    def devices(self):
+        """Device addresses in the archive."""
+        return list(self.header['devices'])
+
+    def row_count(self, device):
+        return self.header['devices'][device]['rows']
+
+    def fields(self, device):
+        """Parsed data field names stored for a device."""
+        return [name[len('parsed_data.'):] for name in self.header['devices'][device]['columns']
+                if name.startswith('parsed_data.')]
+
+    def _entry(self, device, name):
+        columns = self.header['devices'][device]['columns']
+        if name in columns:
+            return columns[name]
+        return columns.get('parsed_data.' + name)
+
+    def _raw(self, entry):
+        return self._buffers[entry['offset']:entry['offset'] + entry['length']]
+
+    def column_type(self, device, name):
+        entry = self._entry(device, name)
+        return entry['type'] if entry else None
+
+    def column(self, device, name):
+        """Load a whole column.
+
+        time/int/float columns are returned as arrays ('q' or 'd'), enum
+        columns as a list of values, blob columns as a list of bytes (None
+        for missing) and json columns as a list of values (None for missing).
+        Returns None if the device has no such column.
+        """
+        entry = self._entry(device, name)
+        if entry is None:
+            return None
+        column_type = entry['type']
+        raw = self._raw(entry)
+        if column_type in ('time', 'int'):
+            return _array('q', raw)
+        if column_type == 'float':
+            return _array('d', raw[:self.row_count(device) * 8])
+        if column_type == 'enum':
+            codes, dictionary = self.enum_column(device, name)
+            values = [None] + dictionary
+            return [values[c] for c in codes]
+        if column_type == 'blob':
+            rows = self.row_count(device)
+            lengths = _array('i', raw[:rows * 4])
+            out, pos = [], rows * 4
+            for length in lengths:
+                if length < 0:
+                    out.append(None)
+                else:
+                    out.append(bytes(raw[pos:pos + length]))
+                    pos += length
+            return out
+        return [json.loads(line) if line else None
+                for line in bytes(raw).decode('utf-8').split('\n')]
+
+    def enum_column(self, device, name):
+        """Codes (array 'H', 0 = missing) and dictionary (code 1 = dictionary[0])."""
+        entry = self._entry(device, name)
+        return _array('H', self._raw(entry)), entry['dict']
+
+    def _present_mask(self, device, name):
+        """Which rows have a value for a column."""
+        entry = self._entry(device, name)
+        column_type = entry['type']
+        raw = self._raw(entry)
+        if column_type == 'int':
+            return [v != INT_MISSING for v in _array('q', raw)]
+        if column_type == 'float':
+            rows = self.row_count(device)
+            if self.version < 2:
+                return [not math.isnan(v) for v in _array('d', raw)]
+            bits = raw[rows * 8:]
+            return [bool(bits[i >> 3] >> (i & 7) & 1) for i in range(rows)]
+        if column_type == 'enum':
+            return [c != 0 for c in _array('H', raw)]
+        if column_type == 'blob':
+            return [length >= 0 for length in _array('i', raw[:self.row_count(device) * 4])]
+        return [bool(line) for line in bytes(raw).decode('utf-8').split('\n')]
+
+    def row_range(self, device, from_ts, to_ts):
+        """Row slice [start, end) with from_ts <= time <= to_ts ('YYYY-MM-DDTHH:MM:SS', UTC)."""
+        times = self.column(device, 'timestamp')
+        start = bisect_left(times, _to_micros(from_ts))
+        end = bisect_right(times, _to_micros(to_ts) + 999999)
+        return start, end
+
+    def records(self, device=None, from_ts=None, to_ts=None):
+        """Rebuild the original records (one dict per row), ordered by time.
+
+        from_ts/to_ts ('YYYY-MM-DDTHH:MM:SS', UTC, inclusive) limit the rows returned.
+        """
+        out = []
+        for address in ([device] if device else self.devices()):
+            if address in self.header['devices']:
+                out.extend(self.iter_device_records(address, from_ts, to_ts))
+        out.sort(key=lambda item: item[0])
+        return [record for _, record in out]
+
+    def iter_device_records(self, address, from_ts=None, to_ts=None):
+        """Yield (microseconds, record) for one device's rows, ordered by time."""
+        columns = self.header['devices'][address]['columns']
+        times = self.column(address, 'timestamp')
+        texts = self.column(address, 'timestamp_text') if 'timestamp_text' in columns else None
+        names = self.column(address, 'device_name')
+        name_present = self._present_mask(address, 'device_name')
+        has_parsed = self.column(address, 'has_parsed_data')
+        fields = [(f, self.column(address, f), self._present_mask(address, f))
+                  for f in self.fields(address)]
+        raw = self.column(address, 'raw_data') if 'raw_data' in columns else None
+        policies = self.column(address, 'record_policy') if 'record_policy' in columns else None
+        policy_present = self._present_mask(address, 'record_policy') if policies is not None else None
+        versions = self.column(address, 'schema_version') if 'schema_version' in columns else None
+        version_present = self._present_mask(address, 'schema_version') if versions is not None else None
+        extra = self.column(address, 'extra') if 'extra' in columns else None
+
+        start, end = 0, len(times)
+        if from_ts and to_ts:
+            start, end = self.row_range(address, from_ts, to_ts)
+        for i in range(start, end):
+            micros = times[i]
+            record = {}
+            if versions is not None and version_present[i]:
+                record['v'] = versions[i]
+            if texts is not None and texts[i]:
+                record['timestamp'] = texts[i]
+            else:
+                record['timestamp'] = _from_micros(micros)
+            if name_present[i]:
+                record['device_name'] = names[i]
+            if address:
+                record['device_address'] = address
+            if has_parsed[i]:
+                record['parsed_data'] = {f: values[i] for f, values, present in fields if present[i]}
+            if raw is not None and raw[i] is not None:
+                record['raw_data'] = raw[i].hex()
+            if policies is not None and policy_present[i]:
+                record['record_policy'] = policies[i]
+            if extra is not None and extra[i]:
+                record.update(extra[i])
+            yield micros, record
+
+def rejected_path_for(data_dir, date_str):
+    """Where the lines of a day that could not be archived are kept."""
+    return os.path.join(archive_dir_for(data_dir), f"data_{date_str}.rejected.ndjson")
+
+def _archivable(raw):
+    """The record on an NDJSON line, or None if it cannot be archived."""
+    try:
+        record = json.loads(raw)
+        _to_micros(record['timestamp'])
+    except (ValueError, TypeError, KeyError):
+        return None
+    return record if isinstance(record, dict) else None
+
+def read_day(path):
+    """Records of an NDJSON file, and the non-blank lines that cannot be archived.
+
+    A line is rejected if it does not parse, has no valid timestamp or is
+    not newline-terminated (a torn last line).
+    """
+    records, rejected = [], []
+    with open(path, 'rb') as f:
+        for raw in f:
+            if not raw.strip():
+                continue
+            record = _archivable(raw) if raw.endswith(b'\n') else None
+            if record is None:
+                rejected.append(raw if raw.endswith(b'\n') else raw + b'\n')
+            else:
+                records.append(record)
+    return records, rejected
+
+def _write_synced(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+def archive_day(data_dir, date_str, keep_source=False, codec=CODEC_LZMA):
+    """Archive one day's NDJSON file, verifying the result before retiring the source.
+
+    Lines that cannot be archived are kept in rejected_path_for(). The archive is
+    read back one device at a time, so the restored day is never held in full.
+    Returns (records, source bytes, archive bytes).
+    """
+    source = os.path.join(data_dir, f"data_{date_str}.ndjson")
+    target = archive_path_for(data_dir, date_str)
+    records, rejected = read_day(source)
+    count = len(records)
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_target = target + '.tmp'
+    _write_synced(tmp_target, encode_day(records, date_str, codec))
+    expected = canonical_checksum(records)
+    del records
+
+    # Verify before the source is removed
+    reader = ArchiveReader(tmp_target)
+    restored = (record for address in reader.devices() for _, record in reader.iter_device_records(address))
+    if canonical_checksum(restored) != expected:
+        os.remove(tmp_target)
+        raise ValueError(f"Verification failed for {date_str}")
+    if rejected:
+        rejected_path = rejected_path_for(data_dir, date_str)
+        _write_synced(rejected_path, b''.join(rejected))
+        logger.warning(f"{date_str}: {len(rejected)} line(s) could not be archived, kept in {rejected_path}")
+    os.replace(tmp_target, target)
+
+    source_size = os.path.getsize(source)
+    if not keep_source:
+        os.remove(source)
+        if os.path.exists(source + '.idx'):
+            os.remove(source + '.idx')
+    return count, source_size, os.path.getsize(target)
+
+def closed_days(data_dir, after_days=1):
+    """Dates of NDJSON files that are at least `after_days` days old (UTC)."""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=after_days)).strftime('%Y-%m-%d')
+    dates = []
+    for path in sorted(glob(os.path.join(data_dir, 'data_*.ndjson'))):
+        date_str = os.path.basename(path)[len('data_'):-len('.ndjson')]
+        if date_str < cutoff:
+            dates.append(date_str)
+    return dates
+
+def days_to_archive(data_dir, after_days=1, ready=None):
+    """Closed days older than `after_days`.
+
+    `ready(date_str)`, if given, can hold a day back (e.g. until it has been exported).
+    """
+    dates = []
+    for date_str in closed_days(data_dir, after_days):
+        if ready is not None and not ready(date_str):
+            logger.info(f"Not archiving {date_str} yet, still being exported")
+            continue
+        dates.append(date_str)
+    return dates
+
+def archive_closed_days(data_dir, after_days=1, keep_source=False, ready=None):
+    """Archive every closed day older than `after_days`. Returns the number archived."""
+    archived = 0
+    for date_str in days_to_archive(data_dir, after_days, ready):
+        try:
+            count, before, after = archive_day(data_dir, date_str, keep_source)
+            logger.info(f"Archived {date_str}: {count} records, {before} -> {after} bytes")
+            archived += 1
+        except Exception as e:
+            logger.error(f"Error archiving {date_str}: {e}")
+    return archived
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    data_dir = os.environ.get('DATA_DIR', '/data/smartsolar-v1')
+    args = sys.argv[1:]
+    keep_source = '--keep-source' in args
+    after_days = 1
+    dates = []
+    i = 0
+    while i < len(args):
+        if args[i] == '--after-days':
+            after_days = max(1, int(args[i + 1]))
+            i += 1
+        elif args[i] == '--nice':
+            # The collector runs archiving at a lower CPU priority than itself
+            os.nice(int(args[i + 1]))
+            i += 1
+        elif not args[i].startswith('--'):
+            dates.append(args[i])
+        i += 1
+
+    dates = dates or closed_days(data_dir, after_days)
+    if not dates:
+        print(f"No closed days to archive in {data_dir}")
+        return
+
+    print(f"Found {len(dates)} closed day(s) to archive")
+    total_before = total_after = 0
+    failed = 0
+    for date_str in dates:
+        try:
+            count, before, after = archive_day(data_dir, date_str, keep_source)
+            total_before += before
+            total_after += after
+            print(f"Archived {date_str}: {count} records, {before} -> {after} bytes")
+        except Exception as e:
+            print(f"Error archiving {date_str}: {e}")
+            failed += 1
+
+    if total_after:
+        print(f"\nArchive complete: {total_before} -> {total_after} bytes "
+              f"({total_before / total_after:.1f}x smaller)")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
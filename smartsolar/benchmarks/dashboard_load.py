@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Load benchmark for the dashboard.
+
+Generates a local data directory (optional), then hits a running dashboard
+with concurrent keep-alive clients and reports requests/sec and latency
+percentiles per endpoint. Run it against both serving modes to compare:
+
+    python3 benchmarks/dashboard_load.py --generate /tmp/ss-bench --days 14
+    DATA_DIR=/tmp/ss-bench DASHBOARD_PORT=8080 DASHBOARD_SERVER=flask python3 dashboard.py
+    DATA_DIR=/tmp/ss-bench DASHBOARD_PORT=8080 gunicorn -c gunicorn.conf.py wsgi:app
+    python3 benchmarks/dashboard_load.py --url http://127.0.0.1:8080 --concurrency 16
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+
+CHARGE_STATES = ['OFF', 'BULK', 'ABSORPTION', 'FLOAT']
+
+def generate(data_dir, days, devices, interval):
+    """Write `days` daily NDJSON files with `devices` chargers every `interval` seconds."""
+    os.makedirs(data_dir, exist_ok=True)
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    addresses = [f"C0:FF:EE:00:00:{i:02X}" for i in range(devices)]
+    total = 0
+    for day in range(days - 1, -1, -1):
+        start = today - timedelta(days=day)
+        path = os.path.join(data_dir, f"data_{start.strftime('%Y-%m-%d')}.ndjson")
+        with open(path, 'w') as f:
+            for second in range(0, 86400, interval):
+                ts = start + timedelta(seconds=second)
+                if ts > datetime.now(timezone.utc):
+                    break
+                for i, address in enumerate(addresses):
+                    power = max(0, int(300 * (1 - abs(second - 43200) / 21600)) + random.randint(-5, 5))
+                    record = {
+                        "timestamp": ts.isoformat(),
+                        "device_name": f"SmartSolar {i}",
+                        "device_address": address,
+                        "parsed_data": {
+                            "charge_state": CHARGE_STATES[min(3, power // 80)],
+                            "battery_voltage": round(12.4 + power / 400, 2),
+                            "battery_charging_current": round(power / 13.2, 1),
+                            "yield_today": second * power // 86400,
+                            "solar_power": power,
+                            "external_device_load": 0.0,
+                            "model_id": 41052,
+                        },
+                        "raw_data": os.urandom(16).hex(),
+                    }
+                    f.write(json.dumps(record, separators=(',', ':')) + '\n')
+                    total += 1
+        print(f"Wrote {path}")
+    print(f"Generated {total} records for {devices} device(s) over {days} day(s) in {data_dir}")
+
+def default_paths(host, port):
+    """Endpoint mix: latest (hot), tail (slow), a closed day and the dates list."""
+    paths = ['/api/latest', '/api/dates', '/api/tail/500']
+    try:
+        conn = http.client.HTTPConnection(host, port, timeout=10)
+        conn.request('GET', '/api/dates')
+        dates = json.loads(conn.getresponse().read())
+        conn.close()
+        if len(dates) > 1:
+            paths.append(f'/api/data/{dates[1]}')
+    except (OSError, ValueError) as e:
+        print(f"Could not list dates: {e}")
+    return paths
+
+def worker(host, port, paths, deadline, results, lock):
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    local = {path: [] for path in paths}
+    errors = 0
+    i = random.randrange(len(paths))
+    while time.monotonic() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            conn.request('GET', path, headers={'Accept-Encoding': 'gzip'})
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 500:
+                errors += 1
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+            continue
+        local[path].append(time.perf_counter() - start)
+    conn.close()
+    with lock:
+        for path, latencies in local.items():
+            results['latencies'].setdefault(path, []).extend(latencies)
+        results['errors'] += errors
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def run(url, concurrency, duration, paths):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    paths = paths or default_paths(host, port)
+    results = {'latencies': {}, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    threads = [threading.Thread(target=worker, args=(host, port, paths, deadline, results, lock))
+               for _ in range(concurrency)]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - started
+
+    all_latencies = [l for latencies in results['latencies'].values() for l in latencies]
+    print(f"\n{url}: {concurrency} client(s) for {elapsed:.1f}s")
+    print(f"{'endpoint':<28} {'requests':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for path, latencies in sorted(results['latencies'].items()):
+        print(f"{path:<28} {len(latencies):>9} {percentile(latencies, 50) * 1000:>9.1f} "
+              f"{percentile(latencies, 99) * 1000:>9.1f}")
+    print(f"Total: {len(all_latencies)} requests, {len(all_latencies) / elapsed:.1f} req/s, "
+          f"p99 {percentile(all_latencies, 99) * 1000:.1f} ms, {results['errors']} error(s)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--generate', metavar='DIR', help='generate a data directory and exit')
+    parser.add_argument('--days', type=int, default=14)
+    parser.add_argument('--devices', type=int, default=2)
+    parser.add_argument('--interval', type=int, default=60, help='seconds between readings')
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--path', action='append', dest='paths', help='endpoint to request (repeatable)')
+    args = parser.parse_args()
+
+    if args.generate:
+        generate(args.generate, args.days, args.devices, args.interval)
+    else:
+        run(args.url, args.concurrency, args.duration, args.paths)
+
+if __name__ == '__main__':
+    main()
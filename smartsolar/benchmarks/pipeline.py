@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+End-to-end throughput benchmark for the collector and the dashboard.
+
+collect:   synthetic encrypted SolarCharger adverts for 1, 10 and 100 devices
+           at rising rates, driven through the collector's own path
+           (detection_callback -> DecodeEngine: detect_device_type/parser/
+           Reading -> save_data -> writer thread)
+dashboard: the read endpoints against a generated multi-month data directory
+           (NDJSON days with indexes, archived older days and rollups)
+
+Reports adverts/sec, per-stage latency percentiles, peak RSS and bytes
+written, and saves everything as JSON so runs can be compared:
+
+    python3 benchmarks/pipeline.py --output results.json
+    python3 benchmarks/pipeline.py --suite dashboard --days 90
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEVICE_COUNTS = (1, 10, 100)
+RATES = (1, 5, 20)   # adverts per second per device
+
+def percentiles(values):
+    """p50/p90/p99/max in microseconds."""
+    if not values:
+        return {}
+    values = sorted(values)
+    pick = lambda p: values[min(len(values) - 1, int(len(values) * p / 100))]
+    return {'p50_us': round(pick(50) * 1e6, 1), 'p90_us': round(pick(90) * 1e6, 1),
+            'p99_us': round(pick(99) * 1e6, 1), 'max_us': round(values[-1] * 1e6, 1)}
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if platform.system() == 'Darwin' else 1024), 1)
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+def run_collect(work_dir, duration):
+    """Drive the collector path for each device count and rate."""
+    from synthetic import generate_adverts, synthetic_keys
+
+    max_devices = max(DEVICE_COUNTS)
+    keys_file = os.path.join(work_dir, 'keys.json')
+    with open(keys_file, 'w') as f:
+        json.dump({'devices': synthetic_keys(max_devices, seed=1)}, f)
+
+    # main.py reads its configuration at import
+    os.environ.update({
+        'DATA_DIR': os.path.join(work_dir, 'collect'),
+        'KEYS_FILE': keys_file,
+        'LATEST_STATE_PATH': os.path.join(work_dir, 'latest.state'),
+        'METRICS_PORT': '0',
+        'RECORD_POLICY': 'all',
+        'ARCHIVE_AFTER_DAYS': '0',
+    })
+    # Short time-based flushes so each step's bytes are on disk soon after it ends
+    os.environ.setdefault('WRITER_FLUSH_INTERVAL', '0.2')
+    import main
+    main.logger.setLevel(logging.WARNING)
+    main.key_store.refresh(force=True)
+    main.data_writer.start()
+
+    results = []
+    try:
+        for devices in DEVICE_COUNTS:
+            for rate in RATES:
+                adverts = list(generate_adverts(devices, duration, update_interval=1.0 / rate, seed=1))
+                results.append(collect_step(main, devices, rate, adverts))
+                r = results[-1]
+                print(f"collect: {devices:>3} device(s) x {rate:>2}/s: {r['adverts_per_sec']:>8.0f} adverts/s "
+                      f"(offered {r['offered_per_sec']}), decode p99 {r['stages']['decode'].get('p99_us')} us, "
+                      f"save p99 {r['stages']['save'].get('p99_us')} us, peak RSS {r['peak_rss_mb']} MB")
+    finally:
+        main.data_writer.close()
+    return results
+
+def collect_step(main, devices, rate, adverts):
+    """Offer adverts at devices x rate per second; measure each stage."""
+    data_dir = main.DATA_DIR
+    bytes_before = directory_size(data_dir)
+    stages = {'callback': [], 'decode': [], 'save': [], 'total': []}
+    offered = devices * rate
+    max_lag = 0.0
+    failures = 0
+
+    started = time.perf_counter()
+    for i, (_, device, advert) in enumerate(adverts):
+        # Pace to the offered rate; when behind, run flat out and record the lag
+        due = started + i / offered
+        now = time.perf_counter()
+        if due > now:
+            time.sleep(due - now)
+        else:
+            max_lag = max(max_lag, now - due)
+
+        t0 = time.perf_counter()
+        main.detection_callback(device, advert)
+        address = device.address.upper()
+        device_info = main.snapshot_discovered_devices()[address]
+        t1 = time.perf_counter()
+        try:
+            reading = main.decode_engine.decode_reading(address, main.key_store.get(address),
+                                                        device_info['victron_data'],
+                                                        device_info['timestamp'].isoformat(), device.name)
+        except Exception:
+            reading = None
+        t2 = time.perf_counter()
+        if reading is None:
+            failures += 1
+            continue
+        main.save_data(reading)
+        t3 = time.perf_counter()
+        stages['callback'].append(t1 - t0)
+        stages['decode'].append(t2 - t1)
+        stages['save'].append(t3 - t2)
+        stages['total'].append(t3 - t0)
+    # The last advert is due at (n - 1) / offered; count the whole offered window
+    elapsed = max(time.perf_counter() - started, len(adverts) / offered)
+
+    # Wait for the writer thread to catch up so bytes written are complete
+    drain_started = time.perf_counter()
+    while main.data_writer.queue_depth():
+        time.sleep(0.01)
+    time.sleep(main.data_writer.flush_interval + 0.1)
+
+    busy = sum(stages['total'])
+    return {
+        'devices': devices,
+        'rate_per_device': rate,
+        'offered_per_sec': offered,
+        'adverts': len(adverts),
+        'decode_failures': failures,
+        'elapsed_s': round(elapsed, 3),
+        'adverts_per_sec': round(len(adverts) / elapsed, 1),
+        'capacity_per_sec': round(len(stages['total']) / busy, 1) if busy else None,
+        'max_lag_s': round(max_lag, 3),
+        'writer_drain_s': round(time.perf_counter() - drain_started, 3),
+        'stages': {name: percentiles(values) for name, values in stages.items()},
+        'bytes_written': directory_size(data_dir) - bytes_before,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+def build_dataset(data_dir, days, devices, interval, archive_after):
+    """Multi-month data directory laid out like a long-running collector's."""
+    from dashboard_load import generate
+    from data_index import rebuild_index
+    from ndjson_reader import list_data_files
+    from rollups import backfill
+    from archive import archive_closed_days
+
+    started = time.perf_counter()
+    generate(data_dir, days, devices, interval)
+    for path in list_data_files(data_dir):
+        rebuild_index(path)
+    backfill(data_dir, os.path.join(data_dir, 'rollups'))
+    if archive_after:
+        archive_closed_days(data_dir, archive_after)
+    return {'days': days, 'devices': devices, 'interval_s': interval,
+            'archive_after_days': archive_after, 'bytes': directory_size(data_dir),
+            'build_s': round(time.perf_counter() - started, 1)}
+
+def run_dashboard(work_dir, days, devices, interval, archive_after, requests):
+    """Time the read endpoints in-process with Flask's test client."""
+    data_dir = os.path.join(work_dir, 'dashboard')
+    dataset = build_dataset(data_dir, days, devices, interval, archive_after)
+    print(f"dashboard: dataset {dataset['days']} day(s), {dataset['bytes'] / 1e6:.0f} MB "
+          f"(built in {dataset['build_s']}s)")
+
+    os.environ['DATA_DIR'] = data_dir
+    os.environ['LATEST_STATE_PATH'] = os.path.join(work_dir, 'dashboard-latest.state')
+    from dashboard import app
+    client = app.test_client()
+
+    dates = json.loads(client.get('/api/dates').data)
+    newest, oldest = dates[0], dates[-1]
+    recent_closed = dates[1] if len(dates) > 1 else newest
+    device = 'C0:FF:EE:00:00:00'
+    endpoints = [
+        ('dates', '/api/dates'),
+        ('latest', '/api/latest'),
+        ('tail_100', '/api/tail/100'),
+        ('day_ndjson', f'/api/data/{recent_closed}'),
+        ('day_archived', f'/api/data/{oldest}'),
+        ('range_6h_device', f'/api/range?from={recent_closed}T06:00:00&to={recent_closed}T12:00:00&device={device}'),
+        ('range_week', f'/api/range?from={dates[min(7, len(dates) - 1)]}&to={newest}'),
+        ('rollups_hour_month', f'/api/rollups/hour?from={dates[min(30, len(dates) - 1)]}&to={newest}'),
+        ('rollups_day_all', f'/api/rollups/day?from={oldest}&to={newest}'),
+    ]
+
+    results = {'dataset': dataset, 'endpoints': {}}
+    for name, url in endpoints:
+        latencies = []
+        size = 0
+        for i in range(requests):
+            t0 = time.perf_counter()
+            response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+            body = response.get_data()
+            latencies.append(time.perf_counter() - t0)
+            size = len(body)
+            if i == 0:
+                first = latencies[0]
+        results['endpoints'][name] = {
+            'url': url, 'status': response.status_code, 'bytes': size,
+            'first_ms': round(first * 1000, 2),
+            'requests_per_sec': round(len(latencies) / sum(latencies), 1),
+            **percentiles(latencies),
+        }
+        r = results['endpoints'][name]
+        print(f"dashboard: {name:<20} {r['status']} {size / 1024:>9.1f} KiB  first {r['first_ms']:>8.1f} ms  "
+              f"p50 {r['p50_us'] / 1000:>8.2f} ms  p99 {r['p99_us'] / 1000:>8.2f} ms")
+    results['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--suite', choices=('all', 'collect', 'dashboard'), default='all')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds of adverts per collect step')
+    parser.add_argument('--days', type=int, default=60, help='days of data for the dashboard suite')
+    parser.add_argument('--devices', type=int, default=2, help='devices in the dashboard dataset')
+    parser.add_argument('--interval', type=int, default=60, help='seconds between readings in the dataset')
+    parser.add_argument('--archive-after', type=int, default=7, help='archive days older than this (0: none)')
+    parser.add_argument('--requests', type=int, default=20, help='requests per dashboard endpoint')
+    parser.add_argument('--work-dir', help='keep generated data here (default: a temporary directory)')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='smartsolar-bench-')
+    os.makedirs(work_dir, exist_ok=True)
+    results = {
+        'started': datetime.now(timezone.utc).isoformat(),
+        'host': {'machine': platform.machine(), 'python': platform.python_version(),
+                 'cpus': os.cpu_count()},
+        'args': vars(args),
+    }
+    try:
+        if args.suite in ('all', 'collect'):
+            results['collect'] = run_collect(work_dir, args.duration)
+        if args.suite in ('all', 'dashboard'):
+            results['dashboard'] = run_dashboard(work_dir, args.days, args.devices, args.interval,
+                                                 args.archive_after, args.requests)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    results['peak_rss_mb'] = peak_rss_mb()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: typed Readings (readings.py) against the record dict path.
+
+Uses real SolarCharger parser output from synthetic encrypted adverts and
+compares, per reading:
+
+    build      parse_victron_data + record dict   vs  reading_from_parsed
+    serialize  json.dumps(record) + newline       vs  Reading.to_json + newline
+    record     build and serialize together (what the collector does)
+    query      json.loads + filter on every line  vs  decode_line (range query
+               that matches --selectivity of the lines, as the dashboard does)
+    memory     bytes retained per reading held in memory
+
+    python3 benchmarks/readings.py --readings 20000 --output readings.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from key_manager import parse_victron_data
+from readings import decode_line, reading_from_parsed
+from synthetic import generate_adverts, synthetic_keys, VICTRON_MANUFACTURER_ID
+from victron_ble.devices import detect_device_type
+
+def parsed_adverts(count, devices=4):
+    """(timestamp, address, name, raw bytes, parsed object) for `count` adverts."""
+    keys = synthetic_keys(devices, seed=1)
+    parsers = {}
+    out = []
+    for t, device, advert in generate_adverts(devices, count * 60 // devices + 60, update_interval=60, seed=1):
+        raw = advert.manufacturer_data[VICTRON_MANUFACTURER_ID]
+        parser = parsers.get(device.address)
+        if parser is None:
+            parser = parsers[device.address] = detect_device_type(raw)(keys[device.address])
+        out.append((t.isoformat(), device.address, device.name, raw, parser.parse(raw)))
+        if len(out) == count:
+            break
+    return out
+
+def build_dict(item):
+    timestamp, address, name, raw, parsed = item
+    return {"timestamp": timestamp, "device_name": name, "device_address": address,
+            "parsed_data": parse_victron_data(parsed), "raw_data": raw.hex()}
+
+def build_reading(item):
+    timestamp, address, name, raw, parsed = item
+    return reading_from_parsed(parsed, timestamp, address, name, raw)
+
+def encode_dict(record):
+    return json.dumps(record, separators=(',', ':')) + '\n'
+
+def encode_reading(reading):
+    return reading.to_json() + '\n'
+
+def timed(function, items, repeat):
+    """Best of `repeat` runs, in microseconds per item."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for item in items:
+            function(item)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best / len(items) * 1e6, 3)
+
+def retained_bytes(function, items):
+    """Bytes held per result when every result is kept."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [function(item) for item in items]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return round((after - before) / len(items), 1)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readings', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5, help='runs per measurement (best is kept)')
+    parser.add_argument('--selectivity', type=float, default=0.1, help='fraction of lines a query matches')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    items = parsed_adverts(args.readings)
+    records = [build_dict(item) for item in items]
+    readings = [build_reading(item) for item in items]
+    dict_lines = [encode_dict(r).encode() for r in records]
+    reading_lines = [encode_reading(r).encode() for r in readings]
+
+    # Query window covering the first `selectivity` of the readings
+    times = sorted(item[0][:19] for item in items)
+    from_ts, to_ts = times[0], times[max(0, int(len(times) * args.selectivity) - 1)]
+
+    def query_dict(raw):
+        record = json.loads(raw)
+        return record if from_ts <= record.get('timestamp', '')[:19] <= to_ts else None
+
+    def query_reading(raw):
+        return decode_line(raw, None, from_ts, to_ts)
+
+    results = {'readings': len(items), 'model': type(readings[0]).__name__,
+               'bytes_per_line': {'dict': round(sum(map(len, dict_lines)) / len(items), 1),
+                                  'reading': round(sum(map(len, reading_lines)) / len(items), 1)}}
+    results['us_per_reading'] = {
+        'build': {'dict': timed(build_dict, items, args.repeat), 'reading': timed(build_reading, items, args.repeat)},
+        'serialize': {'dict': timed(encode_dict, records, args.repeat),
+                      'reading': timed(encode_reading, readings, args.repeat)},
+        'record': {'dict': timed(lambda i: encode_dict(build_dict(i)), items, args.repeat),
+                   'reading': timed(lambda i: encode_reading(build_reading(i)), items, args.repeat)},
+        'query': {'dict': timed(query_dict, dict_lines, args.repeat),
+                  'reading': timed(query_reading, reading_lines, args.repeat)},
+    }
+    results['retained_bytes_per_reading'] = {'dict': retained_bytes(build_dict, items),
+                                             'reading': retained_bytes(build_reading, items)}
+
+    print(f"{results['readings']} {results['model']} readings "
+          f"({results['bytes_per_line']['dict']} / {results['bytes_per_line']['reading']} bytes per line)")
+    print(f"{'':<16}{'dict':>10}{'reading':>10}{'speedup':>10}")
+    for stage, values in results['us_per_reading'].items():
+        print(f"{stage + ' (us)':<16}{values['dict']:>10.2f}{values['reading']:>10.2f}"
+              f"{values['dict'] / values['reading']:>9.1f}x")
+    memory = results['retained_bytes_per_reading']
+    print(f"{'memory (B)':<16}{memory['dict']:>10.0f}{memory['reading']:>10.0f}"
+          f"{memory['dict'] / memory['reading']:>9.1f}x")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == '__main__':
+    main()
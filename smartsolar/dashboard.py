@@ -1,33 +1,296 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, Response
+from werkzeug.http import http_date
 import json
 import os
-from datetime import datetime, timedelta
-import glob
+from datetime import datetime, timezone
 from key_manager import load_device_keys, save_device_keys
+from ndjson_reader import (is_valid_date, data_file_for_date, list_dates,
+                           iter_lines, tail_across_files)
+from data_index import query_range
+from rollups import RESOLUTIONS, load_rollups
+from archive import ArchiveReader, archive_path_for, list_archived_dates
+from latest_state import LatestStateReader, default_state_path
+from live_stream import LiveBroadcaster, sse_events
+from downsample import DEFAULT_POINTS, MODES, series as downsampled_series
+from analytics import Analytics, PERIODS, available as analytics_available
+from response_cache import (ResponseCache, MIN_COMPRESS_SIZE, etag_for_stat, accepts_gzip,
+                            gzip_bytes, gzip_stream)
 
 app = Flask(__name__)
 
 # Constants
 VERSION = "v1"
 SLUG = "smartsolar"
-DATA_DIR = f"/data/{SLUG}-{VERSION}"
+DATA_DIR = os.getenv('DATA_DIR', f"/data/{SLUG}-{VERSION}")
+ROLLUP_DIR = os.path.join(DATA_DIR, "rollups")
+
+# A device is reported as stale once it has not been seen for this long
+STALE_AFTER = 3 * max(10, int(os.getenv('COLLECTION_INTERVAL', '60')))
+
+# Everything below is per process: each server worker maps the shared state
+# file itself, starts its own broadcaster thread on first use and keeps its
+# own (thread-safe) response cache.
+
+# Latest reading per device, published by the collector
+latest_state = LatestStateReader(default_state_path(DATA_DIR))
+
+# Each live stream holds a server thread; by default at most half of a
+# worker's threads, so the rest stay free for regular requests
+LIVE_MAX_CLIENTS = max(1, int(os.getenv('LIVE_MAX_CLIENTS', str(int(os.getenv('DASHBOARD_THREADS', '16')) // 2))))
+
+# One watcher on the latest state, fanned out to every live stream client
+live_broadcaster = LiveBroadcaster(latest_state, max_clients=LIVE_MAX_CLIENTS)
+
+# Serialized responses for closed (immutable) days, bounded by memory
+response_cache = ResponseCache(int(float(os.getenv('RESPONSE_CACHE_MB', '16')) * 1024 * 1024))
+
+# Energy/yield summaries per day, memoized for closed days
+analytics = Analytics(DATA_DIR)
+
+# Closed days never change, so browsers and proxies may keep them for a year
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# A day only counts as closed this long after its midnight and its file's last
+# write, so lines still buffered by the collector at rollover are not cut off
+CLOSED_DAY_GRACE = max(0, int(os.getenv('CLOSED_DAY_GRACE', '900')))
 
 @app.route('/')
 def index():
     """Main dashboard page."""
     return render_template('index.html')
 
+def stream_json_array(lines):
+    """Stream pre-serialised JSON lines as a JSON array."""
+    yield '['
+    first = True
+    for line in lines:
+        if not first:
+            yield ','
+        yield line
+        first = False
+    yield ']'
+
+def not_modified(etag, mtime):
+    """Check the request's validators against the current file version."""
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        # Weak comparison: the same data may be sent gzipped or not
+        wanted = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+        return '*' in wanted or etag.removeprefix('W/') in wanted
+    if_modified_since = request.if_modified_since
+    if if_modified_since:
+        return int(mtime) <= if_modified_since.timestamp()
+    return False
+
+@app.after_request
+def compress_response(response):
+    """gzip larger JSON responses for clients that accept it."""
+    if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+            or 'Content-Encoding' in response.headers or response.mimetype != 'application/json'
+            or not accepts_gzip(request)):
+        return response
+    body = response.get_data()
+    if len(body) < MIN_COMPRESS_SIZE:
+        return response
+    response.set_data(gzip_bytes(body))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+def day_is_closed(date, mtime, now=None):
+    """Whether a day's file can be treated as immutable."""
+    now = now if now is not None else datetime.now(timezone.utc).timestamp()
+    end_of_day = datetime.fromisoformat(date).replace(tzinfo=timezone.utc).timestamp() + 86400
+    return now >= end_of_day + CLOSED_DAY_GRACE and now >= mtime + CLOSED_DAY_GRACE
+
+def day_lines(path):
+    """Serialized records of a day, from its NDJSON file or its archive."""
+    if path.endswith('.ndjson'):
+        return iter_lines(path)
+    return (json.dumps(r, separators=(',', ':')) for r in ArchiveReader(path).records())
+
 @app.route('/api/data/<date>')
 def get_data(date):
-    """Get data for a specific date."""
+    """Get data for a specific date.
+    
+    Closed days are immutable: they are served with validators, long-lived
+    cache headers and from the server-side response cache. Today's data (and
+    yesterday's, until CLOSED_DAY_GRACE has passed) is streamed and must be
+    revalidated on every request.
+    """
     try:
-        json_file = os.path.join(DATA_DIR, f"data_{date}.json")
-        if os.path.exists(json_file):
-            with open(json_file, 'r') as f:
-                data = json.load(f)
-            return jsonify(data)
+        if not is_valid_date(date):
+            return jsonify({"error": "Invalid date, expected YYYY-MM-DD"}), 400
+        data_file = data_file_for_date(DATA_DIR, date)
+        archive_file = archive_path_for(DATA_DIR, date)
+        if os.path.exists(data_file):
+            path = data_file
+        elif os.path.exists(archive_file):
+            path = archive_file
         else:
             return jsonify([]), 404
+        
+        st = os.stat(path)
+        etag = etag_for_stat(st)
+        closed = day_is_closed(date, st.st_mtime)
+        headers = {
+            'ETag': etag,
+            'Last-Modified': http_date(st.st_mtime),
+            'Cache-Control': IMMUTABLE_CACHE_CONTROL if closed else 'no-cache',
+            'Vary': 'Accept-Encoding',
+        }
+        if not_modified(etag, st.st_mtime):
+            return Response(status=304, headers=headers)
+        
+        use_gzip = accepts_gzip(request)
+        if closed:
+            key = (path, etag)
+            cached = response_cache.get(key)
+            if cached is None:
+                body = ''.join(stream_json_array(day_lines(path))).encode('utf-8')
+                gzipped = gzip_bytes(body) if len(body) >= MIN_COMPRESS_SIZE else None
+                response_cache.put(key, body, gzipped)
+            else:
+                body, gzipped = cached
+            if use_gzip and gzipped:
+                headers['Content-Encoding'] = 'gzip'
+                return Response(gzipped, mimetype='application/json', headers=headers)
+            return Response(body, mimetype='application/json', headers=headers)
+        
+        chunks = stream_json_array(day_lines(path))
+        if use_gzip and st.st_size >= MIN_COMPRESS_SIZE:
+            headers['Content-Encoding'] = 'gzip'
+            chunks = gzip_stream(chunks)
+        return Response(chunks, mimetype='application/json', headers=headers)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def parse_time_param(value, end_of_day=False):
+    """Parse a date or ISO datetime query parameter into a UTC 'YYYY-MM-DDTHH:MM:SS' string."""
+    if len(value) == 10:
+        value += 'T23:59:59' if end_of_day else 'T00:00:00'
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc)
+    return parsed.strftime('%Y-%m-%dT%H:%M:%S')
+
+@app.route('/api/range')
+def get_range():
+    """Get data between two times, optionally for one device.
+    
+    Query parameters: from, to (date or ISO datetime, UTC), device (MAC address).
+    Uses each day's sidecar time index to seek straight to the requested minutes.
+    """
+    try:
+        if 'from' not in request.args or 'to' not in request.args:
+            return jsonify({"error": "Missing from or to parameter"}), 400
+        try:
+            from_ts = parse_time_param(request.args['from'])
+            to_ts = parse_time_param(request.args['to'], end_of_day=True)
+        except ValueError:
+            return jsonify({"error": "Invalid from/to, expected YYYY-MM-DD or ISO datetime"}), 400
+        device = request.args.get('device')
+        if device:
+            device = device.upper()
+        
+        records = query_range(DATA_DIR, from_ts, to_ts, device)
+        return Response(stream_json_array(json.dumps(r, separators=(',', ':')) for r in records),
+                        mimetype='application/json')
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/rollups/<resolution>')
+def get_rollups(resolution):
+    """Get minute/hour/day aggregates between two times.
+    
+    Query parameters: from, to (date or ISO datetime, UTC), device (MAC address),
+    fields (comma-separated parsed_data fields to include; default all).
+    Each bucket has n, energy_wh and f: {field: [min, max, mean, last, count]}, with a
+    sixth element (seconds held) for values recorded by the deadband filter.
+    """
+    try:
+        if resolution not in RESOLUTIONS:
+            return jsonify({"error": f"Unknown resolution, expected one of {', '.join(RESOLUTIONS)}"}), 400
+        if 'from' not in request.args or 'to' not in request.args:
+            return jsonify({"error": "Missing from or to parameter"}), 400
+        try:
+            from_ts = parse_time_param(request.args['from'])
+            to_ts = parse_time_param(request.args['to'], end_of_day=True)
+        except ValueError:
+            return jsonify({"error": "Invalid from/to, expected YYYY-MM-DD or ISO datetime"}), 400
+        device = request.args.get('device')
+        if device:
+            device = device.upper()
+        
+        buckets = load_rollups(ROLLUP_DIR, resolution, from_ts, to_ts, device)
+        fields = request.args.get('fields')
+        if fields:
+            wanted = set(fields.split(','))
+            for bucket in buckets:
+                bucket['f'] = {k: v for k, v in bucket['f'].items() if k in wanted}
+        return jsonify(buckets)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/series')
+def get_series():
+    """Get one field of a device as a chart series, downsampled to a bounded number of points.
+    
+    Query parameters: device (MAC address), field (numeric parsed_data field),
+    from, to (date or ISO datetime, UTC), points (default 800, at most 5000),
+    mode (lttb, or minmax to keep each bucket's extremes).
+    Returns {source, mode, total, data: [[epoch milliseconds, value], ...]}.
+    """
+    try:
+        device = request.args.get('device')
+        field = request.args.get('field')
+        if not device or not field:
+            return jsonify({"error": "Missing device or field parameter"}), 400
+        if 'from' not in request.args or 'to' not in request.args:
+            return jsonify({"error": "Missing from or to parameter"}), 400
+        try:
+            from_ts = parse_time_param(request.args['from'])
+            to_ts = parse_time_param(request.args['to'], end_of_day=True)
+        except ValueError:
+            return jsonify({"error": "Invalid from/to, expected YYYY-MM-DD or ISO datetime"}), 400
+        mode = request.args.get('mode', 'lttb')
+        if mode not in MODES:
+            return jsonify({"error": f"Unknown mode, expected one of {', '.join(MODES)}"}), 400
+        try:
+            points = int(request.args.get('points', DEFAULT_POINTS))
+        except ValueError:
+            return jsonify({"error": "Invalid points, expected an integer"}), 400
+        try:
+            result = downsampled_series(DATA_DIR, ROLLUP_DIR, device.upper(), field, from_ts, to_ts, points, mode)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify(dict(device_address=device.upper(), field=field, **result))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/analytics/<period>')
+def get_analytics(period):
+    """Get energy, yield, peak power, charge state times and battery voltage per day/week/month.
+    
+    Query parameters: from, to (YYYY-MM-DD, UTC; to defaults to from), device (MAC address).
+    Returns one entry per device with its periods and the total over the range.
+    """
+    try:
+        if not analytics_available():
+            return jsonify({"error": "Analytics need NumPy, which is not installed"}), 503
+        if period not in PERIODS:
+            return jsonify({"error": f"Unknown period, expected one of {', '.join(PERIODS)}"}), 400
+        from_date = request.args.get('from')
+        to_date = request.args.get('to', from_date)
+        if not from_date or not is_valid_date(from_date) or not is_valid_date(to_date):
+            return jsonify({"error": "Missing or invalid from/to, expected YYYY-MM-DD"}), 400
+        device = request.args.get('device')
+        if device:
+            device = device.upper()
+        try:
+            return jsonify(analytics.summary(from_date, to_date, period, device))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -35,56 +298,83 @@ def get_data(date):
 def get_available_dates():
     """Get list of dates with available data."""
     try:
-        files = glob.glob(os.path.join(DATA_DIR, "data_*.json"))
-        dates = []
-        for file in files:
-            filename = os.path.basename(file)
-            date = filename.replace("data_", "").replace(".json", "")
-            dates.append(date)
-        dates.sort(reverse=True)
+        dates = sorted(set(list_dates(DATA_DIR)) | set(list_archived_dates(DATA_DIR)), reverse=True)
         return jsonify(dates)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def with_age(entry, now):
+    """Copy of a reading with its last-seen age and staleness."""
+    entry = dict(entry)
+    try:
+        seen = datetime.fromisoformat(entry['timestamp'])
+        if seen.tzinfo is None:
+            seen = seen.replace(tzinfo=timezone.utc)
+        age = max(0.0, (now - seen).total_seconds())
+        entry['age_seconds'] = round(age, 1)
+        entry['stale'] = age > STALE_AFTER
+    except (KeyError, TypeError, ValueError):
+        pass
+    return entry
+
+def latest_entries():
+    """Latest reading per device with its last-seen age, newest first (empty if none)."""
+    latest = latest_state.read()
+    if not latest:
+        # Collector not running (or nothing published yet): fall back to the data files
+        latest = {}
+        for entry in tail_across_files(DATA_DIR, 50):
+            latest.setdefault(entry.get('device_address'), entry)
+    now = datetime.now(timezone.utc)
+    entries = [with_age(entry, now) for entry in latest.values()]
+    entries.sort(key=lambda e: e.get('timestamp', ''), reverse=True)
+    return entries
+
 @app.route('/api/latest')
 def get_latest_data():
-    """Get the most recent data entry."""
+    """Get the most recent data entry, with its last-seen age."""
     try:
-        files = glob.glob(os.path.join(DATA_DIR, "data_*.json"))
-        if not files:
+        entries = latest_entries()
+        if not entries:
             return jsonify({"message": "No data available"}), 404
-        
-        # Get the most recent file
-        latest_file = max(files, key=os.path.getctime)
-        
-        with open(latest_file, 'r') as f:
-            data = json.load(f)
-        
-        if data:
-            return jsonify(data[-1])  # Return last entry
-        else:
-            return jsonify({"message": "No data in file"}), 404
+        return jsonify(entries[0])
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/latest/devices')
+def get_latest_per_device():
+    """Get the most recent data entry for each device, with its last-seen age."""
+    try:
+        entries = latest_entries()
+        if not entries:
+            return jsonify({"message": "No data available"}), 404
+        return jsonify(entries)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/stream')
+def stream_live():
+    """Server-Sent Events stream: current state on connect, then each new reading.
+
+    Answers 503 once LIVE_MAX_CLIENTS streams are open; the page then polls.
+    """
+    client = live_broadcaster.subscribe()
+    if client is None:
+        return jsonify({"error": "Too many live clients"}), 503, {'Retry-After': '60'}
+    now = datetime.now(timezone.utc)
+    initial = [with_age(entry, now) for entry in (latest_state.read() or {}).values()]
+    initial.sort(key=lambda e: e.get('timestamp', ''))
+    response = Response(sse_events(live_broadcaster, client, initial), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Also release the slot if the stream is closed before it started
+    response.call_on_close(lambda: live_broadcaster.unsubscribe(client))
+    return response
+
 @app.route('/api/tail/<int:n>')
 def tail_data(n=10):
-    """Get the last n data entries across all files."""
+    """Get the last n data entries across all files (most recent first)."""
     try:
-        all_data = []
-        files = glob.glob(os.path.join(DATA_DIR, "data_*.json"))
-        files.sort(reverse=True)  # Most recent first
-        
-        for file in files:
-            if len(all_data) >= n:
-                break
-            
-            with open(file, 'r') as f:
-                data = json.load(f)
-                all_data.extend(reversed(data))  # Add in reverse order
-                
-        # Return only the requested number of entries
-        return jsonify(all_data[:n])
+        return jsonify(tail_across_files(DATA_DIR, n))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -158,4 +448,5 @@ def delete_key(device_address):
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=80, debug=False) 
\ No newline at end of file
+    # Development server; production runs under gunicorn (see gunicorn.conf.py)
+    app.run(host='0.0.0.0', port=int(os.getenv('DASHBOARD_PORT', '80')), debug=False, threaded=True) 
\ No newline at end of file
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Sidecar time index for the daily NDJSON data files.
+
+Each data_YYYY-MM-DD.ndjson gets a data_YYYY-MM-DD.ndjson.idx next to it.
+The index is itself NDJSON, one line per minute bucket:
+
+    {"m":615,"t0":615,"t1":615,"o":123456,"e":130112,"l":8000,"n":60,
+     "d":{"DF:C9:B0:6E:3F:EF":[123456,8000,60]}}
+
+m      minute of the day (UTC) the bucket was opened for
+t0/t1  earliest/latest minute of any record in the bucket
+o/e    byte range [o, e) of the bucket's lines in the data file
+l/n    line number of the first line and number of lines
+d      per device: [byte offset of first line, line number of first line, count]
+
+The collector's writer appends a bucket when a minute is over, so anything
+after the last bucket (the current minute) is scanned directly. Run this
+module to rebuild missing or stale indexes of closed days:
+
+    python3 data_index.py [--force] [data_file ...]
+"""
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+from glob import glob
+from archive import ArchiveReader, archive_path_for, list_archived_dates
+from readings import decode_line
+
+logger = logging.getLogger(__name__)
+
+INDEX_SUFFIX = '.idx'
+
+def index_path_for(data_path):
+    """Sidecar index path for a data file."""
+    return data_path + INDEX_SUFFIX
+
+def timestamp_minute(timestamp):
+    """Minute of the day from an ISO timestamp string, or None."""
+    try:
+        return int(timestamp[11:13]) * 60 + int(timestamp[14:16])
+    except (TypeError, ValueError, IndexError):
+        return None
+
+class IndexBuilder:
+    """Builds minute buckets for lines as they are appended to a data file."""
+
+    def __init__(self, index_path, offset=0, line=0):
+        self.index_path = index_path
+        self.offset = offset     # byte offset of the next line
+        self.line = line         # line number of the next line
+        self._bucket = None
+        self._closed = []        # finished buckets not yet written to the index
+
+    def add(self, minute, device, length):
+        """Account for one line of `length` bytes written at the current offset."""
+        bucket = self._bucket
+        if minute is None:
+            minute = bucket['m'] if bucket else 0
+        if bucket is not None and minute > bucket['m']:
+            self._close_bucket()
+            bucket = None
+        if bucket is None:
+            bucket = self._bucket = {'m': minute, 't0': minute, 't1': minute,
+                                     'o': self.offset, 'e': self.offset,
+                                     'l': self.line, 'n': 0, 'd': {}}
+
+        # Late records (e.g. a slow GATT read) stay in the open bucket
+        if minute < bucket['t0']:
+            bucket['t0'] = minute
+        if minute > bucket['t1']:
+            bucket['t1'] = minute
+        if device:
+            entry = bucket['d'].get(device)
+            if entry is None:
+                bucket['d'][device] = [self.offset, self.line, 1]
+            else:
+                entry[2] += 1
+        bucket['n'] += 1
+        self.offset += length
+        bucket['e'] = self.offset
+        self.line += 1
+
+    def _close_bucket(self):
+        if self._bucket is not None and self._bucket['n']:
+            self._closed.append(self._bucket)
+        self._bucket = None
+
+    def flush(self, close_open_bucket=False):
+        """Append finished buckets to the index file."""
+        if close_open_bucket:
+            self._close_bucket()
+        if not self._closed:
+            return
+        lines = ''.join(json.dumps(b, separators=(',', ':')) + '\n' for b in self._closed)
+        with open(self.index_path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+        self._closed = []
+
+    @classmethod
+    def resume(cls, data_path):
+        """Pick up indexing for an existing data file.
+
+        Reuses the index if it is consistent with the data file, rebuilds it
+        otherwise, and indexes any lines written after the last bucket.
+        """
+        index_path = index_path_for(data_path)
+        size = os.path.getsize(data_path) if os.path.exists(data_path) else 0
+        buckets = load_index(data_path)
+        if buckets is None:
+            if os.path.exists(index_path):
+                os.remove(index_path)
+            buckets = []
+        else:
+            # Drop any buckets load_index trimmed so new ones stay contiguous
+            _write_index(index_path, buckets)
+        offset = buckets[-1]['e'] if buckets else 0
+        line = buckets[-1]['l'] + buckets[-1]['n'] if buckets else 0
+
+        builder = cls(index_path, offset, line)
+        if size > offset:
+            builder._scan(data_path)
+            builder.flush()
+        return builder
+
+    def _scan(self, data_path):
+        """Index complete lines from the current offset to the end of the file."""
+        with open(data_path, 'rb') as f:
+            f.seek(self.offset)
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    break
+                minute, device = None, None
+                try:
+                    record = json.loads(raw)
+                    minute = timestamp_minute(record.get('timestamp'))
+                    device = record.get('device_address')
+                except ValueError:
+                    pass
+                self.add(minute, device, len(raw))
+
+def _write_index(index_path, buckets):
+    """Atomically replace an index file with the given buckets."""
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(''.join(json.dumps(b, separators=(',', ':')) + '\n' for b in buckets))
+    os.replace(tmp_path, index_path)
+
+def load_index(data_path):
+    """Load the buckets of a data file's index.
+
+    Returns None if the index is missing or does not match the data file.
+    """
+    index_path = index_path_for(data_path)
+    if not os.path.exists(index_path):
+        return None
+    try:
+        size = os.path.getsize(data_path)
+        buckets = []
+        with open(index_path, 'rb') as f:
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    break
+                buckets.append(json.loads(raw))
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable index {index_path}: {e}")
+        return None
+
+    # Buckets must be contiguous, start at the beginning and fit in the file
+    expected = 0
+    for bucket in buckets:
+        if bucket['o'] != expected:
+            return None
+        expected = bucket['e']
+    if expected > size:
+        # Data written with durability 'none' may not have reached the file yet
+        while buckets and buckets[-1]['e'] > size:
+            buckets.pop()
+        if not buckets:
+            return None
+    return buckets
+
+def index_is_complete(data_path):
+    """Check that a data file's index covers every line in the file."""
+    buckets = load_index(data_path)
+    return bool(buckets) and buckets[-1]['e'] == os.path.getsize(data_path)
+
+def rebuild_index(data_path):
+    """Regenerate a data file's index from scratch. Returns the number of buckets."""
+    builder = IndexBuilder(None)
+    builder._scan(data_path)
+    builder._close_bucket()
+    _write_index(index_path_for(data_path), builder._closed)
+    return len(builder._closed)
+
+def _read_lines(f, start, end, device, from_ts, to_ts):
+    """Yield matching records from the byte range [start, end) of an open data file."""
+    f.seek(start)
+    pos = start
+    device_bytes = device.encode() if device else None
+    while end is None or pos < end:
+        raw = f.readline()
+        if not raw or not raw.endswith(b'\n'):
+            break
+        pos += len(raw)
+        # Cheap byte check before paying for a JSON parse
+        if device_bytes and device_bytes not in raw:
+            continue
+        record = decode_line(raw, device, from_ts, to_ts)
+        if record is not None:
+            yield record
+
+def query_file(data_path, from_ts, to_ts, device=None):
+    """Yield records from one data file with from_ts <= timestamp <= to_ts.
+
+    Timestamps are compared as ISO strings truncated to seconds
+    (YYYY-MM-DDTHH:MM:SS). Uses the sidecar index when available.
+    """
+    buckets = load_index(data_path)
+    if buckets is None:
+        buckets = []
+        logger.debug(f"No usable index for {data_path}, scanning whole file")
+
+    date_str = os.path.basename(data_path)[len('data_'):len('data_') + 10]
+    from_minute = timestamp_minute(from_ts) if from_ts[:10] == date_str else 0
+    to_minute = timestamp_minute(to_ts) if to_ts[:10] == date_str else 24 * 60
+
+    with open(data_path, 'rb') as f:
+        for bucket in buckets:
+            if bucket['t1'] < from_minute or bucket['t0'] > to_minute:
+                continue
+            start = bucket['o']
+            if device:
+                entry = bucket['d'].get(device)
+                if entry is None:
+                    continue
+                start = entry[0]
+            yield from _read_lines(f, start, bucket['e'], device, from_ts, to_ts)
+
+        # Lines after the last indexed bucket (the minute being written)
+        tail_start = buckets[-1]['e'] if buckets else 0
+        yield from _read_lines(f, tail_start, None, device, from_ts, to_ts)
+
+def query_range(data_dir, from_ts, to_ts, device=None):
+    """Yield records across daily files for a timestamp range, oldest day first.
+
+    Days that have been archived (see archive.py) are read from the archive.
+    """
+    date_from, date_to = from_ts[:10], to_ts[:10]
+    days = {}
+    for date_str in list_archived_dates(data_dir):
+        days[date_str] = archive_path_for(data_dir, date_str)
+    for data_path in glob(os.path.join(data_dir, 'data_*.ndjson')):
+        days[os.path.basename(data_path)[len('data_'):-len('.ndjson')]] = data_path
+
+    for date_str in sorted(days):
+        if not (date_from <= date_str <= date_to):
+            continue
+        path = days[date_str]
+        if path.endswith('.ndjson'):
+            yield from query_file(path, from_ts, to_ts, device)
+        else:
+            yield from ArchiveReader(path).records(device, from_ts, to_ts)
+
+def main():
+    data_dir = os.environ.get('DATA_DIR', '/data/smartsolar-v1')
+    args = sys.argv[1:]
+    force = '--force' in args
+    files = [a for a in args if a != '--force']
+    if not files:
+        files = sorted(glob(os.path.join(data_dir, 'data_*.ndjson')))
+
+    if not files:
+        print(f"No NDJSON files found in {data_dir}")
+        return
+
+    # The collector is still appending to today's file and its index
+    today_file = f"data_{datetime.now(timezone.utc).strftime('%Y-%m-%d')}.ndjson"
+
+    rebuilt = 0
+    for data_path in files:
+        if not force and os.path.basename(data_path) == today_file:
+            print(f"Skipping {data_path} - still being written (use --force to override)")
+            continue
+        if not force and index_is_complete(data_path):
+            print(f"Skipping {data_path} - index is up to date")
+            continue
+        try:
+            buckets = rebuild_index(data_path)
+            print(f"Indexed {data_path} ({buckets} minute buckets)")
+            rebuilt += 1
+        except Exception as e:
+            print(f"Error indexing {data_path}: {e}")
+
+    print(f"\nIndexing complete: {rebuilt}/{len(files)} files rebuilt")
+
+if __name__ == "__main__":
+    main()
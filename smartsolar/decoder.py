@@ -0,0 +1,90 @@
+"""
+Cached decoding of Victron BLE advertisements.
+
+Victron devices rebroadcast the same encrypted payload many times between
+updates, so the engine keeps the last payload it decoded per device and
+skips decryption when it sees the same bytes again. Parser instances are
+cached per (address, key, model) instead of being rebuilt for every advert.
+decode_reading() returns a typed Reading (readings.py).
+"""
+import logging
+from victron_ble.devices import detect_device_type
+from key_manager import parse_victron_data
+from readings import reading_from_parsed
+
+logger = logging.getLogger(__name__)
+
+class UnusableReading(ValueError):
+    """An advertisement decoded, but no Reading can hold its fields."""
+
+    def __init__(self, address, parsed_data):
+        super().__init__(f"Decoded data from {address} has no fields a reading can hold")
+        self.parsed_data = parsed_data   # parse_victron_data() of the parser output
+
+class DecodeEngine:
+    """Decode Victron advertisements with a parser cache and duplicate short-circuit."""
+
+    def __init__(self):
+        self._parsers = {}  # (address, key, model) -> parser instance
+        self._last = {}     # address -> (key, raw bytes, parsed object)
+        self.stats = {'decoded': 0, 'skipped': 0, 'failed': 0}
+
+    def decode_reading(self, address, encryption_key, victron_data, timestamp, device_name):
+        """Return a Reading (with the raw payload) for an advertisement.
+
+        Returns None if the device type could not be detected, and raises
+        UnusableReading if the parser output has no fields a Reading can hold.
+        Decryption and parse errors are counted and re-raised to the caller.
+        """
+        parsed = self._parse(address, encryption_key, victron_data)
+        if parsed is None:
+            return None
+        reading = reading_from_parsed(parsed, timestamp, address, device_name, bytes(victron_data))
+        if reading is None:
+            raise UnusableReading(address, parse_victron_data(parsed))
+        return reading
+
+    def _parse(self, address, encryption_key, victron_data):
+        """victron_ble parsed data object for an advertisement (None: unknown type)."""
+        raw = bytes(victron_data)
+
+        # Same payload as last time: nothing new to decrypt
+        last = self._last.get(address)
+        if last and last[0] == encryption_key and last[1] == raw:
+            self.stats['skipped'] += 1
+            return last[2]
+
+        # Model ID (bytes 2-3) and readout type (byte 4) select the parser
+        cache_key = (address, encryption_key, raw[2:5])
+        parser = self._parsers.get(cache_key)
+        if parser is None:
+            parser_class = detect_device_type(raw)
+            if not parser_class:
+                self.stats['failed'] += 1
+                return None
+            parser = parser_class(encryption_key)
+            self._forget_parsers(address)
+            self._parsers[cache_key] = parser
+
+        try:
+            parsed = parser.parse(raw)
+        except Exception:
+            self.stats['failed'] += 1
+            raise
+
+        # Parsed objects are only read from, so a repeat can share this one
+        self._last[address] = (encryption_key, raw, parsed)
+        self.stats['decoded'] += 1
+        return parsed
+
+    def _forget_parsers(self, address):
+        """Drop cached parsers for a device whose key or model changed."""
+        for cache_key in [k for k in self._parsers if k[0] == address]:
+            del self._parsers[cache_key]
+
+    def stats_summary(self):
+        """Human-readable decode counters for logging."""
+        total = self.stats['decoded'] + self.stats['skipped']
+        skipped_pct = (100.0 * self.stats['skipped'] / total) if total else 0.0
+        return (f"{self.stats['decoded']} decoded, {self.stats['skipped']} skipped "
+                f"({skipped_pct:.0f}% duplicates), {self.stats['failed']} failed")
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the InfluxDB v2 write API, for testing the exporter.
+
+Accepts POST /api/v2/write (gzip or plain line protocol), checks the token,
+and keeps every point keyed by series and timestamp like InfluxDB does, so
+re-sent points show up as duplicates instead of extra data. Can simulate an
+outage to exercise the exporter's on-disk queue:
+
+    python3 dev/influx_stub.py --port 8086 --token dev --output /tmp/points.lp
+    python3 dev/influx_stub.py --down-for 120       # refuse writes for 2 minutes
+    curl http://localhost:8086/stats
+
+Point the collector at it with INFLUX_EXPORT=true INFLUX_URL=http://localhost:8086
+INFLUX_TOKEN=dev INFLUX_ORG=dev INFLUX_BUCKET=dev.
+"""
+import argparse
+import gzip
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+class Store:
+    """Points received so far, as InfluxDB would keep them."""
+
+    def __init__(self, output=None):
+        self.lock = threading.Lock()
+        self.points = {}       # (series, timestamp) -> fields
+        self.received = 0
+        self.duplicates = 0
+        self.requests = 0
+        self.failed = 0
+        self.bytes = 0
+        self.output = open(output, 'a', encoding='utf-8') if output else None
+
+    def add(self, body):
+        with self.lock:
+            for line in body.decode('utf-8').splitlines():
+                if not line.strip():
+                    continue
+                # series<space>fields<space>timestamp (the stub does not expect spaces in string fields)
+                series, fields, timestamp = line.rsplit(' ', 2)
+                key = (series, timestamp)
+                self.received += 1
+                if key in self.points:
+                    self.duplicates += 1
+                self.points[key] = fields
+                if self.output:
+                    self.output.write(line + '\n')
+            if self.output:
+                self.output.flush()
+
+    def stats(self):
+        with self.lock:
+            return {'requests': self.requests, 'failed_requests': self.failed,
+                    'bytes_received': self.bytes, 'points_received': self.received,
+                    'unique_points': len(self.points), 'duplicates': self.duplicates}
+
+def make_handler(store, token, fail_rate, down_until):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def reply(self, status, body=b''):
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if urlparse(self.path).path == '/stats':
+                self.reply(200, json.dumps(store.stats()).encode('utf-8'))
+            else:
+                self.reply(404)
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            with store.lock:
+                store.requests += 1
+                store.bytes += len(body)
+            if url.path != '/api/v2/write':
+                return self.reply(404)
+            if token and self.headers.get('Authorization') != f"Token {token}":
+                return self.reply(401, b'{"code":"unauthorized"}')
+            query = parse_qs(url.query)
+            if not query.get('bucket') or not query.get('org'):
+                return self.reply(400, b'{"code":"invalid","message":"bucket and org are required"}')
+            if time.monotonic() < down_until or random.random() < fail_rate:
+                with store.lock:
+                    store.failed += 1
+                return self.reply(503, b'{"code":"unavailable"}')
+            try:
+                if self.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                store.add(body)
+            except (OSError, ValueError) as e:
+                return self.reply(400, json.dumps({'code': 'invalid', 'message': str(e)}).encode('utf-8'))
+            self.reply(204)
+
+    return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8086)
+    parser.add_argument('--token', default='dev', help="required token ('' accepts any)")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of writes answered with 503')
+    parser.add_argument('--down-for', type=float, default=0.0, help='answer 503 for this many seconds first')
+    parser.add_argument('--output', help='append received points to this file')
+    args = parser.parse_args()
+
+    store = Store(args.output)
+    handler = make_handler(store, args.token, args.fail_rate, time.monotonic() + args.down_for)
+    server = ThreadingHTTPServer(('0.0.0.0', args.port), handler)
+    print(f"InfluxDB stand-in listening on port {args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(store.stats()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+"""
+Downsampled chart series for one device field over a time range.
+
+However long the range, a series is reduced to at most a target number of
+points before it is sent, so the payload and the browser's drawing work stay
+the same size as history grows:
+
+    lttb     Largest-Triangle-Three-Buckets: one point per bucket, the one
+             forming the largest triangle with its neighbours' selections,
+             which keeps the visual shape (peaks, dips, slopes)
+    minmax   the lowest and highest point of each time bucket, which keeps
+             every extreme (e.g. battery voltage minima) at the cost of a
+             noisier line
+
+Each output point covers span / points seconds. Ranges where that is short
+are read from the raw readings (through the time index and the archive's
+columns); longer ones start from the minute or hour rollups, whose buckets
+already carry min/max/mean, with raw readings filling in whatever the
+rollups do not cover: the time after the last closed bucket, days before the
+rollups start, or gaps left by a partial backfill. Deadband-filtered
+readings count as covered for as long as their value holds. The coarsest rollup whose
+buckets are no longer than two output points is used, which keeps the input
+small as well.
+"""
+import math
+import os
+from bisect import bisect_right
+from datetime import date, datetime, timedelta, timezone
+from archive import ArchiveReader, INT_MISSING, archive_path_for
+from data_index import query_file
+from ndjson_reader import data_file_for_date
+from rollups import MAX_HOLD_GAP, RESOLUTIONS, load_rollups, parse_timestamp
+
+MODES = ('lttb', 'minmax')
+
+DEFAULT_POINTS = 800
+MAX_POINTS = 5000
+
+# Rollup resolutions a series can be built from, finest first
+_ROLLUP_SOURCES = ('minute', 'hour')
+
+def _number(value):
+    """Float for a numeric field value, None otherwise."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+        return float(value)
+    return None
+
+def lttb(xs, ys, threshold):
+    """Indices of the points Largest-Triangle-Three-Buckets keeps (xs ascending)."""
+    n = len(xs)
+    if threshold >= n or n <= 2:
+        return list(range(n))
+    if threshold < 3:
+        return [0, n - 1]
+
+    every = (n - 2) / (threshold - 2)
+    keep = [0]
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the triangle's third corner
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        if next_start >= n - 1:
+            next_start, next_end = n - 1, n
+        count = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / count
+        avg_y = sum(ys[next_start:next_end]) / count
+
+        ax, ay = xs[a], ys[a]
+        dx, dy = avg_x - ax, avg_y - ay
+        best, best_area = None, -1.0
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            # Twice the triangle's area; the constant factor does not matter
+            area = abs(dx * (ys[j] - ay) - (xs[j] - ax) * dy)
+            if area > best_area:
+                best, best_area = j, area
+        keep.append(best)
+        a = best
+    keep.append(n - 1)
+    return keep
+
+def minmax(xs, ys, buckets):
+    """Indices of the lowest and highest point of each of `buckets` equal time spans."""
+    n = len(xs)
+    if n <= 2 * buckets:
+        return list(range(n))
+    span = (xs[-1] - xs[0]) or 1
+    keep = []
+    current, low, high = None, 0, 0
+    for i in range(n):
+        bucket = min(int((xs[i] - xs[0]) * buckets / span), buckets - 1)
+        if bucket != current:
+            if current is not None:
+                keep.extend(sorted({low, high}))
+            current, low, high = bucket, i, i
+        elif ys[i] < ys[low]:
+            low = i
+        elif ys[i] > ys[high]:
+            high = i
+    keep.extend(sorted({low, high}))
+    return keep
+
+def _archive_points(path, device, field, from_ts, to_ts, xs, ys):
+    reader = ArchiveReader(path)
+    if device not in reader.devices() or reader.column_type(device, field) is None:
+        return
+    start, end = reader.row_range(device, from_ts, to_ts)
+    times = reader.column(device, 'timestamp')
+    values = reader.column(device, field)
+    column_type = reader.column_type(device, field)
+    for i in range(start, end):
+        value = values[i]
+        if column_type == 'int':
+            value = None if value == INT_MISSING else float(value)
+        else:
+            value = _number(value)
+        if value is not None:
+            xs.append(times[i] / 1e6)
+            ys.append(value)
+
+def raw_points(data_dir, device, field, from_ts, to_ts):
+    """(times, values) of a field's readings between two timestamps, oldest first."""
+    xs, ys = [], []
+    day = date.fromisoformat(from_ts[:10])
+    while day.isoformat() <= to_ts[:10]:
+        date_str = day.isoformat()
+        day += timedelta(days=1)
+        data_path = data_file_for_date(data_dir, date_str)
+        if os.path.exists(data_path):
+            for record in query_file(data_path, from_ts, to_ts, device):
+                value = _number((record.get('parsed_data') or {}).get(field))
+                timestamp = parse_timestamp(record.get('timestamp'))
+                if value is not None and timestamp is not None:
+                    xs.append(timestamp)
+                    ys.append(value)
+            continue
+        archive_path = archive_path_for(data_dir, date_str)
+        if os.path.exists(archive_path):
+            _archive_points(archive_path, device, field, from_ts, to_ts, xs, ys)
+    # Late lines can be slightly out of order
+    if any(xs[i] > xs[i + 1] for i in range(len(xs) - 1)):
+        order = sorted(range(len(xs)), key=xs.__getitem__)
+        xs, ys = [xs[i] for i in order], [ys[i] for i in order]
+    return xs, ys
+
+def _rollup_points(rollup_dir, resolution, device, field, from_ts, to_ts, mode):
+    """Points from rollup buckets, the start of each bucket (epoch seconds)
+    and whether its value was recorded by the deadband filter (and so holds).
+
+    lttb uses each bucket's mean at its middle; minmax puts its min and max
+    there, so a bucket's extremes survive whatever is dropped later.
+    """
+    size = RESOLUTIONS[resolution]
+    xs, ys, starts, held = [], [], [], []
+    for bucket in load_rollups(rollup_dir, resolution, from_ts, to_ts, device):
+        stats = bucket['f'].get(field)
+        start = parse_timestamp(bucket['t'])
+        if stats is None or start is None:
+            continue
+        middle = start + size / 2
+        if mode == 'minmax':
+            xs.extend((middle, middle))
+            ys.extend((stats[0], stats[1]))
+        else:
+            xs.append(middle)
+            ys.append(stats[2])
+        starts.append(start)
+        held.append(len(stats) > 5)
+    return xs, ys, starts, held
+
+def _uncovered(starts, size, start, end, held=()):
+    """Spans [from, to) of a range that no rollup bucket covers.
+
+    Missing buckets inside the range count once a whole bucket is missing,
+    unless they follow a bucket of deadband-filtered values and end within
+    MAX_HOLD_GAP of it: a deadband-filtered value holds until the next
+    record, so the raw readings have nothing there (e.g. buckets the hold
+    was not carried into across a restart). Everything after the last
+    bucket counts (the open bucket, or more).
+    """
+    gaps = []
+    position = start
+    holding = False
+    for i, bucket_start in enumerate(starts):
+        if bucket_start - position >= size and not (holding and bucket_start - position <= MAX_HOLD_GAP):
+            gaps.append((position, bucket_start))
+        position = max(position, bucket_start + size)
+        holding = i < len(held) and held[i]
+    if position <= end:
+        # Inclusive end: raw timestamps are compared to whole seconds
+        gaps.append((position, end + 1))
+    return gaps
+
+def _gap_points(data_dir, device, field, gaps):
+    """Raw points inside the gaps, read once per day that has any."""
+    by_day = {}
+    for gap_start, gap_end in gaps:
+        while gap_start < gap_end:
+            day_end = (gap_start // 86400 + 1) * 86400
+            by_day.setdefault(day_end, []).append((gap_start, min(gap_end, day_end)))
+            gap_start = day_end
+    xs, ys = [], []
+    for day_end in sorted(by_day):
+        spans = by_day[day_end]
+        span_starts = [span[0] for span in spans]
+        day_xs, day_ys = raw_points(data_dir, device, field, _iso(spans[0][0]), _iso(spans[-1][1] - 1))
+        for x, y in zip(day_xs, day_ys):
+            i = bisect_right(span_starts, x) - 1
+            if i >= 0 and x < spans[i][1]:
+                xs.append(x)
+                ys.append(y)
+    return xs, ys
+
+def _iso(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+
+def series(data_dir, rollup_dir, device, field, from_ts, to_ts, points=DEFAULT_POINTS, mode='lttb'):
+    """Downsampled series of a device field between two 'YYYY-MM-DDTHH:MM:SS' UTC timestamps.
+
+    Returns {source, mode, total, data: [[epoch milliseconds, value], ...]},
+    where total is the number of points the series was reduced from.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode, expected one of {', '.join(MODES)}")
+    points = max(3, min(int(points), MAX_POINTS))
+    start, end = parse_timestamp(from_ts + '+00:00'), parse_timestamp(to_ts + '+00:00')
+    if start is None or end is None or end < start:
+        raise ValueError("Invalid time range")
+
+    per_point = (end - start) / points
+    source = 'raw'
+    for resolution in _ROLLUP_SOURCES:
+        if RESOLUTIONS[resolution] <= 2 * per_point:
+            source = resolution
+    xs = ys = None
+    if source != 'raw':
+        xs, ys, starts, held = _rollup_points(rollup_dir, source, device, field, from_ts, to_ts, mode)
+        if not xs:
+            # No rollups for this range (e.g. not backfilled yet)
+            source, xs = 'raw', None
+        else:
+            gaps = _uncovered(starts, RESOLUTIONS[source], start, end, held)
+            gap_x, gap_y = _gap_points(data_dir, device, field, gaps)
+            if gap_x:
+                xs.extend(gap_x)
+                ys.extend(gap_y)
+                order = sorted(range(len(xs)), key=xs.__getitem__)
+                xs, ys = [xs[i] for i in order], [ys[i] for i in order]
+    if xs is None:
+        xs, ys = raw_points(data_dir, device, field, from_ts, to_ts)
+
+    if mode == 'minmax':
+        keep = minmax(xs, ys, points // 2)
+    else:
+        keep = lttb(xs, ys, points)
+    return {'source': source, 'mode': mode, 'total': len(xs),
+            'data': [[int(xs[i] * 1000), ys[i]] for i in keep]}
@@ -0,0 +1,167 @@
+"""
+GATT fallback reader for devices whose advertisements cannot be decoded.
+
+Connections are kept open across cycles where the device allows it, the
+readable characteristics found by service discovery are remembered per
+device, and all of them are read concurrently with a per-read timeout.
+A per-device circuit breaker with exponential backoff stops an unreachable
+device from costing a connect timeout every cycle.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from bleak import BleakClient
+
+logger = logging.getLogger(__name__)
+
+class CircuitBreaker:
+    """Skips a device after a failure, doubling the wait after each further failure."""
+
+    def __init__(self, base_delay=30.0, max_delay=1800.0):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failures = 0
+        self.open_until = 0.0
+
+    def allow(self):
+        """Whether an attempt may be made now (closed, or the backoff has expired)."""
+        return time.monotonic() >= self.open_until
+
+    def record_success(self):
+        self.failures = 0
+        self.open_until = 0.0
+
+    def record_failure(self):
+        """Open the breaker; returns the backoff delay in seconds."""
+        self.failures += 1
+        delay = min(self.max_delay, self.base_delay * 2 ** (self.failures - 1))
+        self.open_until = time.monotonic() + delay
+        return delay
+
+class GattReader:
+    """Reads every readable characteristic of a device, reusing connections."""
+
+    def __init__(self, connect_timeout=10.0, read_timeout=5.0, keep_alive=True,
+                 backoff_base=30.0, backoff_max=1800.0):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keep_alive = keep_alive
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._clients = {}          # address -> connected BleakClient
+        self._characteristics = {}  # address -> (service uuids, readable characteristic uuids)
+        self._breakers = {}         # address -> CircuitBreaker
+        self._locks = {}            # address -> asyncio.Lock (one operation per device)
+
+    def _breaker(self, address):
+        breaker = self._breakers.get(address)
+        if breaker is None:
+            breaker = self._breakers[address] = CircuitBreaker(self.backoff_base, self.backoff_max)
+        return breaker
+
+    async def read(self, device):
+        """Data entry with a `readings` dict {uuid: hex}, or None if skipped or failed."""
+        address = device.address.upper()
+        breaker = self._breaker(address)
+        if not breaker.allow():
+            remaining = breaker.open_until - time.monotonic()
+            logger.debug(f"Skipping GATT read of {address}, backing off for {remaining:.0f}s")
+            return None
+
+        lock = self._locks.setdefault(address, asyncio.Lock())
+        async with lock:
+            try:
+                client = await self._connect(device, address)
+                readings = await self._read_all(client, address)
+            except Exception as e:
+                await self._disconnect(address)
+                delay = breaker.record_failure()
+                if breaker.failures >= 2:
+                    # Rediscover in case the cached services are what is failing
+                    self._characteristics.pop(address, None)
+                logger.error(f"GATT read of {device.name} ({address}) failed: {e}; "
+                             f"retrying in {delay:.0f}s ({breaker.failures} consecutive failure(s))")
+                return None
+
+            breaker.record_success()
+            if not self.keep_alive:
+                await self._disconnect(address)
+
+        return {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "device_name": device.name,
+            "device_address": device.address,
+            "readings": readings
+        }
+
+    async def _connect(self, device, address):
+        """Reuse a live connection, otherwise connect (limited to known services)."""
+        client = self._clients.get(address)
+        if client is not None and client.is_connected:
+            return client
+
+        cached = self._characteristics.get(address)
+        client = BleakClient(
+            device,
+            disconnected_callback=lambda c: self._forget(address, c),
+            services=cached[0] if cached else None,
+            timeout=self.connect_timeout
+        )
+        await client.connect()
+        logger.info(f"Connected to {device.name} ({address})")
+        self._clients[address] = client
+        return client
+
+    def _discover(self, client, address):
+        """Readable characteristics of a device, from service discovery on first connect."""
+        cached = self._characteristics.get(address)
+        if cached is None:
+            services = []
+            readable = []
+            for service in client.services:
+                uuids = [char.uuid for char in service.characteristics if "read" in char.properties]
+                if uuids:
+                    services.append(service.uuid)
+                    readable.extend(uuids)
+            cached = self._characteristics[address] = (services, readable)
+            logger.info(f"Discovered {len(readable)} readable characteristic(s) on {address}")
+        return cached[1]
+
+    async def _read_all(self, client, address):
+        uuids = self._discover(client, address)
+        results = await asyncio.gather(
+            *(asyncio.wait_for(client.read_gatt_char(uuid), self.read_timeout) for uuid in uuids),
+            return_exceptions=True
+        )
+
+        readings = {}
+        for uuid, result in zip(uuids, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error reading characteristic {uuid}: {result!r}")
+            else:
+                readings[uuid] = result.hex()
+                logger.debug(f"Characteristic {uuid}: {readings[uuid]}")
+        if uuids and not readings:
+            # Nothing answered: treat the connection as dead
+            raise ConnectionError(f"none of {len(uuids)} characteristic read(s) succeeded")
+        return readings
+
+    def _forget(self, address, client):
+        """Drop a connection the device closed (unless it has been replaced)."""
+        if self._clients.get(address) is client:
+            del self._clients[address]
+
+    async def _disconnect(self, address):
+        client = self._clients.pop(address, None)
+        if client is None:
+            return
+        try:
+            await client.disconnect()
+        except Exception as e:
+            logger.debug(f"Error disconnecting {address}: {e}")
+
+    async def close(self):
+        """Disconnect every kept-alive connection."""
+        for address in list(self._clients):
+            await self._disconnect(address)
@@ -0,0 +1,43 @@
+"""
+gunicorn configuration for the dashboard.
+
+Threaded workers (gthread) suit this app: requests mostly wait on file I/O,
+and each live stream (/api/stream) holds one thread for as long as the
+browser is connected, so threads are what bounds concurrent clients. A
+second process keeps one slow request (a long /api/tail or a cold closed
+day) from holding the GIL against everything else.
+
+Environment:
+    DASHBOARD_PORT     listen port (default 80)
+    DASHBOARD_WORKERS  worker processes (default: CPU count, at most 2 -
+                       each keeps its own response cache)
+    DASHBOARD_THREADS  threads per worker (default 16)
+    LIVE_MAX_CLIENTS   live streams per worker (default: half the threads);
+                       further /api/stream requests get 503 and the page
+                       polls instead, so streams cannot take every thread
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('DASHBOARD_PORT', '80')}"
+worker_class = 'gthread'
+workers = int(os.getenv('DASHBOARD_WORKERS', str(min(2, multiprocessing.cpu_count()))))
+threads = int(os.getenv('DASHBOARD_THREADS', '16'))
+
+# Workers import the app themselves (no preload) so every process opens its
+# own mapping of the latest state and starts its own broadcaster thread
+preload_app = False
+
+# With gthread the timeout only applies to a worker's heartbeat, not to
+# long-lived streaming responses
+timeout = 60
+graceful_timeout = 10
+keepalive = 5
+
+# Recycle workers now and then to bound memory growth on small devices
+max_requests = 10000
+max_requests_jitter = 1000
+
+accesslog = None
+errorlog = '-'
+loglevel = 'info'
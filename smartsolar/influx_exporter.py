@@ -0,0 +1,374 @@
+"""
+Direct export of the collected records to InfluxDB (v2 write API).
+
+A reader thread follows the daily NDJSON files from a durable per-file byte
+offset, converts complete lines to line protocol and spools gzipped batches
+(by size or age) into a bounded on-disk queue. A sender thread posts the
+queued batches in order and deletes each one only after InfluxDB accepted
+it, backing off while the uplink is down. Nothing is held only in memory:
+
+    influx/checkpoint.json   byte offset per data file, and which are done
+    influx/spool/*.lp.gz     batches waiting to be sent (oldest first)
+
+A batch is spooled before the checkpoint moves past its lines, so a crash
+can at worst spool the same lines twice; InfluxDB stores a point with the
+same series and timestamp only once, so that does not duplicate data.
+When the spool is full the reader pauses (the data files are the backlog);
+days are not archived until they have been exported.
+"""
+import gzip
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timezone
+from ndjson_reader import list_data_files
+
+logger = logging.getLogger(__name__)
+
+MEASUREMENT = 'smartsolar'
+
+# Read this much of a data file at a time
+READ_CHUNK = 256 * 1024
+
+def _escape_tag(value):
+    return str(value).replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+def _escape_string(value):
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def _timestamp_ns(timestamp):
+    parsed = datetime.fromisoformat(timestamp)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    delta = parsed - datetime(1970, 1, 1, tzinfo=timezone.utc)
+    return (delta.days * 86400 + delta.seconds) * 10**9 + delta.microseconds * 1000
+
+def to_line_protocol(record, host=None, path=None):
+    """One line-protocol point for a record, or None if it has no fields.
+
+    Points have the series the Telegraf tail input wrote (see
+    telegraf.conf): tags device_address, device_name, host and path (the
+    data file), and fields parsed_data_<field>, with numbers as floats, so
+    existing series keep their field types and a point sent by both lands
+    on the same series and timestamp. Unlike Telegraf's JSON parser, string
+    fields (e.g. a charge state name) are kept. Only parsed_data becomes
+    fields: top-level keys such as the schema version "v" are not exported.
+    """
+    parsed_data = record.get('parsed_data')
+    timestamp = record.get('timestamp')
+    if not parsed_data or not timestamp:
+        return None
+
+    fields = []
+    for key, value in parsed_data.items():
+        name = _escape_tag(f"parsed_data_{key}")
+        if isinstance(value, bool):
+            fields.append(f"{name}={'true' if value else 'false'}")
+        elif isinstance(value, (int, float)):
+            fields.append(f"{name}={float(value)!r}")
+        elif isinstance(value, str):
+            fields.append(f"{name}={_escape_string(value)}")
+    if not fields:
+        return None
+
+    tags = [MEASUREMENT]
+    for key in ('device_address', 'device_name'):
+        if record.get(key):
+            tags.append(f"{key}={_escape_tag(record[key])}")
+    if host:
+        tags.append(f"host={_escape_tag(host)}")
+    if path:
+        tags.append(f"path={_escape_tag(path)}")
+    try:
+        ns = _timestamp_ns(timestamp)
+    except (TypeError, ValueError):
+        return None
+    return f"{','.join(tags)} {','.join(fields)} {ns}"
+
+def _write_atomic(path, data):
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+
+class InfluxExporter:
+    """Follows the data files and ships them to InfluxDB through a disk spool."""
+
+    def __init__(self, data_dir, url, token, org, bucket, batch_size=5000, batch_interval=10.0,
+                 spool_max_bytes=200 * 1024 * 1024, poll_interval=1.0, start_from='today',
+                 host=None, timeout=30.0, backoff_max=300.0):
+        self.data_dir = data_dir
+        self.write_url = url.rstrip('/') + '/api/v2/write?' + urllib.parse.urlencode(
+            {'org': org, 'bucket': bucket, 'precision': 'ns'})
+        self.token = token
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.spool_max_bytes = spool_max_bytes
+        self.poll_interval = poll_interval
+        self.start_from = start_from
+        self.host = host or socket.gethostname()
+        self.timeout = timeout
+        self.backoff_max = backoff_max
+
+        self.state_dir = os.path.join(data_dir, 'influx')
+        self.spool_dir = os.path.join(self.state_dir, 'spool')
+        self.rejected_dir = os.path.join(self.state_dir, 'rejected')
+        self.checkpoint_path = os.path.join(self.state_dir, 'checkpoint.json')
+
+        self._files = {}       # data file name -> {'offset': int, 'done': bool}
+        self._seq = 0
+        self._lock = threading.Lock()   # guards _files (read by is_exported)
+        self._stop = threading.Event()
+        self._reader = None
+        self._sender = None
+
+        # Batch being built: lines, and the checkpoint it advances to once spooled
+        self._batch = []
+        self._batch_started = None
+        self._batch_offsets = {}
+        self._batch_done = set()
+
+        self.sent_batches = 0
+
+    # Checkpoint ---------------------------------------------------------
+
+    def _load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, 'r') as f:
+                state = json.load(f)
+            self._files = state.get('files', {})
+            self._seq = state.get('seq', 0)
+            logger.info(f"Influx export resuming from checkpoint ({len(self._files)} file(s))")
+            return
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.error(f"Unreadable Influx checkpoint {self.checkpoint_path}: {e}")
+
+        # First run (or lost state): do not re-send all history unless asked to
+        today = f"data_{datetime.now(timezone.utc).strftime('%Y-%m-%d')}.ndjson"
+        for path in list_data_files(self.data_dir):
+            name = os.path.basename(path)
+            if self.start_from != 'all' and name < today:
+                self._files[name] = {'offset': os.path.getsize(path), 'done': True}
+        logger.info(f"Influx export starting from {'all data' if self.start_from == 'all' else 'today'}")
+
+    def _save_checkpoint(self):
+        with self._lock:
+            state = {'files': self._files, 'seq': self._seq}
+            data = json.dumps(state, separators=(',', ':')).encode('utf-8')
+        _write_atomic(self.checkpoint_path, data)
+
+    def is_exported(self, date_str):
+        """Whether a day's data file has been completely spooled (safe to archive)."""
+        with self._lock:
+            entry = self._files.get(f"data_{date_str}.ndjson")
+            return bool(entry and entry.get('done'))
+
+    # Lifecycle -----------------------------------------------------------
+
+    def start(self):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._load_checkpoint()
+        self._seq = max([self._seq] + [int(n.split('.')[0]) for n in self._spooled()])
+        self._reader = threading.Thread(target=self._run_reader, name='influx-reader', daemon=True)
+        self._sender = threading.Thread(target=self._run_sender, name='influx-sender', daemon=True)
+        self._reader.start()
+        self._sender.start()
+
+    def close(self, timeout=10.0):
+        """Spool what has been read and stop; unsent batches stay queued on disk."""
+        if self._reader is None:
+            return
+        self._stop.set()
+        self._reader.join(timeout)
+        self._sender.join(timeout)
+        self._reader = self._sender = None
+        logger.info(f"Influx exporter stopped ({len(self._spooled())} batch(es) queued)")
+
+    # Reader --------------------------------------------------------------
+
+    def _spooled(self):
+        try:
+            return sorted(n for n in os.listdir(self.spool_dir) if n.endswith('.lp.gz'))
+        except FileNotFoundError:
+            return []
+
+    def spool_bytes(self):
+        total = 0
+        for name in self._spooled():
+            try:
+                total += os.path.getsize(os.path.join(self.spool_dir, name))
+            except OSError:
+                pass
+        return total
+
+    def _run_reader(self):
+        paused = False
+        while not self._stop.is_set():
+            try:
+                if self.spool_bytes() >= self.spool_max_bytes:
+                    if not paused:
+                        logger.warning("Influx spool full, pausing export until batches are sent")
+                        paused = True
+                    progressed = False
+                else:
+                    paused = False
+                    progressed = self._read_available()
+                due = (self._batch_started is not None and
+                       time.monotonic() - self._batch_started >= self.batch_interval)
+                # Checkpoint-only progress (lines without points, finished days) is saved right away
+                idle = not self._batch and (self._batch_offsets or self._batch_done)
+                if len(self._batch) >= self.batch_size or due or idle:
+                    self._spool()
+            except Exception as e:
+                logger.error(f"Influx export reader error: {e}")
+                progressed = False
+            if not progressed:
+                self._stop.wait(self.poll_interval)
+        try:
+            self._spool()
+        except Exception as e:
+            logger.error(f"Error spooling final Influx batch: {e}")
+
+    def _read_available(self):
+        """Convert new complete lines into the batch; True if anything was read."""
+        progressed = False
+        today = f"data_{datetime.now(timezone.utc).strftime('%Y-%m-%d')}.ndjson"
+        for path in list_data_files(self.data_dir):
+            if len(self._batch) >= self.batch_size:
+                break
+            name = os.path.basename(path)
+            entry = self._files.get(name, {'offset': 0, 'done': False})
+            if entry['done'] or name in self._batch_done:
+                continue
+            offset = self._batch_offsets.get(name, entry['offset'])
+            new_offset = self._read_file(path, offset)
+            if new_offset != offset:
+                self._batch_offsets[name] = new_offset
+                progressed = True
+            elif name < today:
+                # A closed day, fully read, that the writer has stopped appending to
+                try:
+                    idle = time.time() - os.path.getmtime(path) > 60
+                except OSError:
+                    idle = False
+                if idle:
+                    self._batch_done.add(name)
+                    progressed = True
+        return progressed
+
+    def _read_file(self, path, offset):
+        """Add complete lines after offset to the batch; returns the new offset."""
+        try:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                while len(self._batch) < self.batch_size:
+                    chunk = f.read(READ_CHUNK)
+                    end = chunk.rfind(b'\n')
+                    if end < 0:
+                        break   # nothing new, or only a partial line still being written
+                    for line in chunk[:end].split(b'\n'):
+                        self._add_line(line, path)
+                    offset += end + 1
+                    f.seek(offset)
+        except FileNotFoundError:
+            pass
+        return offset
+
+    def _add_line(self, line, path):
+        if not line.strip():
+            return
+        try:
+            point = to_line_protocol(json.loads(line), self.host, path)
+        except ValueError:
+            logger.warning("Skipping malformed line in data file")
+            return
+        if point is None:
+            return
+        if self._batch_started is None:
+            self._batch_started = time.monotonic()
+        self._batch.append(point)
+
+    def _spool(self):
+        """Queue the batch on disk, then move the checkpoint past it."""
+        if self._batch:
+            self._seq += 1
+            body = gzip.compress(('\n'.join(self._batch) + '\n').encode('utf-8'), compresslevel=6)
+            _write_atomic(os.path.join(self.spool_dir, f"{self._seq:012d}.lp.gz"), body)
+            logger.debug(f"Spooled {len(self._batch)} point(s) ({len(body)} bytes)")
+        if not self._batch and not self._batch_offsets and not self._batch_done:
+            return
+        with self._lock:
+            for name, offset in self._batch_offsets.items():
+                self._files.setdefault(name, {'offset': 0, 'done': False})['offset'] = offset
+            for name in self._batch_done:
+                self._files.setdefault(name, {'offset': 0, 'done': False})['done'] = True
+            # Forget files that no longer exist (archived after export)
+            existing = {os.path.basename(p) for p in list_data_files(self.data_dir)}
+            for name in [n for n, e in self._files.items() if e['done'] and n not in existing]:
+                del self._files[name]
+        self._save_checkpoint()
+        self._batch = []
+        self._batch_started = None
+        self._batch_offsets = {}
+        self._batch_done = set()
+
+    # Sender --------------------------------------------------------------
+
+    def _run_sender(self):
+        backoff = 1.0
+        while not self._stop.is_set():
+            queued = self._spooled()
+            if not queued:
+                self._stop.wait(self.poll_interval)
+                continue
+            path = os.path.join(self.spool_dir, queued[0])
+            try:
+                with open(path, 'rb') as f:
+                    body = f.read()
+            except FileNotFoundError:
+                continue
+
+            status = self._post(body)
+            if status is not None and 200 <= status < 300:
+                os.remove(path)
+                self.sent_batches += 1
+                backoff = 1.0
+            elif status is not None and 400 <= status < 500 and status not in (408, 429):
+                # The batch itself is bad; keep it for inspection but do not block the queue
+                os.makedirs(self.rejected_dir, exist_ok=True)
+                os.replace(path, os.path.join(self.rejected_dir, queued[0]))
+                logger.error(f"InfluxDB rejected batch {queued[0]} (HTTP {status}), moved to {self.rejected_dir}")
+            else:
+                logger.warning(f"InfluxDB write failed ({status or 'no connection'}), "
+                               f"{len(queued)} batch(es) queued, retrying in {backoff:.0f}s")
+                self._stop.wait(backoff)
+                backoff = min(self.backoff_max, backoff * 2)
+
+    def _post(self, body):
+        """POST a gzipped batch; returns the HTTP status, or None if unreachable."""
+        request = urllib.request.Request(self.write_url, data=body, method='POST', headers={
+            'Authorization': f"Token {self.token}",
+            'Content-Encoding': 'gzip',
+            'Content-Type': 'text/plain; charset=utf-8',
+        })
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            if e.code >= 400:
+                detail = e.read(200).decode('utf-8', 'replace')
+                logger.debug(f"InfluxDB error response: {detail}")
+            return e.code
+        except (urllib.error.URLError, OSError) as e:
+            logger.debug(f"InfluxDB unreachable: {e}")
+            return None
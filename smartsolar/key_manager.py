@@ -4,50 +4,130 @@ Shared key management functions for SmartSolar BLE data collection.
 import json
 import os
 import logging
+import tempfile
 
 logger = logging.getLogger(__name__)
 
-KEYS_FILE = "/data/smartsolar-keys.json"
+KEYS_FILE = os.getenv('KEYS_FILE', "/data/smartsolar-keys.json")
 
-def load_device_keys():
-    """Load device encryption keys from file or environment variables."""
+def normalize_address(address):
+    """Normalise a MAC address to upper-case, colon-separated form."""
+    return address.strip().upper().replace('-', ':')
+
+def load_file_keys(keys_file=KEYS_FILE):
+    """Load device encryption keys from the JSON keys file."""
     device_keys = {}
-    
-    # First, try to load from JSON file
-    if os.path.exists(KEYS_FILE):
+    if os.path.exists(keys_file):
         try:
-            with open(KEYS_FILE, 'r') as f:
+            with open(keys_file, 'r') as f:
                 keys_data = json.load(f)
                 device_keys = keys_data.get('devices', {})
-                logger.info(f"Loaded {len(device_keys)} device key(s) from {KEYS_FILE}")
+                logger.info(f"Loaded {len(device_keys)} device key(s) from {keys_file}")
         except Exception as e:
-            logger.error(f"Error loading keys from {KEYS_FILE}: {e}")
-    
-    # Then, check environment variables (these override file settings)
+            logger.error(f"Error loading keys from {keys_file}: {e}")
+    return device_keys
+
+def load_env_keys():
+    """Load device encryption keys from SMARTSOLAR_KEY_<MAC> environment variables."""
+    device_keys = {}
     # Format: SMARTSOLAR_KEY_<MAC_ADDRESS> where MAC address has colons replaced with underscores
     for key, value in os.environ.items():
         if key.startswith('SMARTSOLAR_KEY_'):
             mac_address = key.replace('SMARTSOLAR_KEY_', '').replace('_', ':')
             device_keys[mac_address] = value
             logger.info(f"Loaded key for {mac_address} from environment variable")
-    
     return device_keys
 
+def merge_device_keys(file_keys, env_keys):
+    """Combine file and environment keys (environment wins), normalising addresses."""
+    device_keys = {}
+    for source in (file_keys, env_keys):
+        for address, key in source.items():
+            device_keys[normalize_address(address)] = key
+    return device_keys
+
+def load_device_keys():
+    """Load device encryption keys from file or environment variables."""
+    # Environment variables override file settings
+    return merge_device_keys(load_file_keys(), load_env_keys())
+
+class KeyStore:
+    """Device keys cached in memory and reloaded only when the keys file changes.
+    
+    Environment variables are read once, since they cannot change while the
+    process is running. Addresses are normalised on load, so lookups with an
+    already-normalised address are a single dict access.
+    """
+
+    def __init__(self, keys_file=KEYS_FILE):
+        self.keys_file = keys_file
+        self._env_keys = load_env_keys()
+        self._file_state = None
+        self._keys = {}
+        self.refresh(force=True)
+
+    def _stat(self):
+        """Identify the current keys file version by inode, size and mtime."""
+        try:
+            st = os.stat(self.keys_file)
+            return (st.st_ino, st.st_size, st.st_mtime_ns)
+        except FileNotFoundError:
+            return None
+
+    def refresh(self, force=False):
+        """Reload keys if the file changed since the last load. Returns True if reloaded."""
+        state = self._stat()
+        if not force and state == self._file_state:
+            return False
+        
+        file_keys = load_file_keys(self.keys_file) if state else {}
+        self._keys = merge_device_keys(file_keys, self._env_keys)
+        self._file_state = state
+        return True
+
+    def get(self, address):
+        """Look up the key for a normalised address."""
+        return self._keys.get(address)
+
+    def addresses(self):
+        """Set of addresses that have a key configured."""
+        return set(self._keys)
+
+    def __contains__(self, address):
+        return address in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
 def save_device_keys(device_keys):
-    """Save device encryption keys to file."""
+    """Save device encryption keys to file.
+    
+    The file is written to a temporary file and renamed into place, so a
+    reader never sees a partially written keys file.
+    """
+    tmp_file = None
     try:
         from datetime import datetime
         keys_data = {
             'devices': device_keys,
             'updated': datetime.utcnow().isoformat()
         }
-        with open(KEYS_FILE, 'w') as f:
+        keys_dir = os.path.dirname(KEYS_FILE) or '.'
+        fd, tmp_file = tempfile.mkstemp(dir=keys_dir, prefix='.smartsolar-keys.', suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
             json.dump(keys_data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, KEYS_FILE)
+        tmp_file = None
         logger.info(f"Saved {len(device_keys)} device key(s) to {KEYS_FILE}")
         return True
     except Exception as e:
         logger.error(f"Error saving keys to {KEYS_FILE}: {e}")
         return False
+    finally:
+        if tmp_file and os.path.exists(tmp_file):
+            os.remove(tmp_file)
 
 def parse_victron_data(parsed_obj):
     """Convert Victron parsed data object to dictionary."""
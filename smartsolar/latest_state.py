@@ -0,0 +1,173 @@
+"""
+Latest reading per device, shared from the collector to the dashboard.
+
+The collector publishes into a small memory-mapped file (in /dev/shm when
+available) guarded by a sequence counter, so the dashboard can read the
+current state in microseconds without listing the data directory or
+parsing data files.
+
+Layout: sequence (uint64 LE) | payload length (uint32 LE) | JSON payload
+
+The sequence is odd while the collector is writing; readers retry until
+they see the same even sequence before and after copying the payload.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+STATE_SIZE = 64 * 1024
+HEADER = struct.Struct('<QI')
+
+def default_state_path(data_dir):
+    """Shared memory if available (same container), otherwise the data directory."""
+    path = os.getenv('LATEST_STATE_PATH')
+    if path:
+        return path
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm/smartsolar-latest'
+    return os.path.join(data_dir, 'latest.state')
+
+def _as_dict(record):
+    to_dict = getattr(record, 'to_dict', None)
+    return to_dict() if to_dict is not None else record
+
+class LatestStatePublisher:
+    """Collector side: keeps the latest record per device and publishes it."""
+
+    def __init__(self, path, size=STATE_SIZE):
+        self.path = path
+        self.size = size
+        self._latest = {}
+        self._encoded = {}   # address -> JSON text of its latest record
+        self._seq = 0
+        self._mmap = None
+
+    def _open(self):
+        # Reuse an existing file so readers that already mapped it keep working
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < self.size:
+                os.ftruncate(fd, self.size)
+            self._mmap = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+        self._seq = HEADER.unpack_from(self._mmap, 0)[0]
+        if self._seq % 2:
+            self._seq += 1
+
+    def publish(self, record):
+        """Make `record` the latest reading for its device."""
+        address = record.get('device_address')
+        if not address:
+            return
+        self._latest[address] = record
+        try:
+            if self._mmap is None:
+                self._open()
+            # Only the device that changed is encoded again (Readings encode themselves)
+            to_json = getattr(record, 'to_json', None)
+            self._encoded[address] = to_json() if to_json is not None else json.dumps(record, separators=(',', ':'))
+            payload = ('{' + ','.join(f"{json.dumps(a)}:{text}" for a, text in self._encoded.items())
+                       + '}').encode('utf-8')
+            if HEADER.size + len(payload) > self.size:
+                # Raw advertisement/characteristic data is not needed for the live view
+                slim = {a: {k: v for k, v in _as_dict(r).items() if k not in ('raw_data', 'readings')}
+                        for a, r in self._latest.items()}
+                payload = json.dumps(slim, separators=(',', ':')).encode('utf-8')
+                if HEADER.size + len(payload) > self.size:
+                    logger.error(f"Latest state for {len(self._latest)} devices does not fit in {self.size} bytes")
+                    return
+            self._write(payload)
+        except Exception as e:
+            logger.error(f"Error publishing latest state: {e}")
+
+    def _write(self, payload):
+        self._seq += 1  # odd: write in progress
+        HEADER.pack_into(self._mmap, 0, self._seq, 0)
+        self._mmap[HEADER.size:HEADER.size + len(payload)] = payload
+        self._seq += 1  # even: consistent
+        HEADER.pack_into(self._mmap, 0, self._seq, len(payload))
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+class LatestStateReader:
+    """Dashboard side: reads the snapshot published by the collector.
+    
+    Safe to share between the request threads of one server worker.
+    """
+
+    def __init__(self, path, size=STATE_SIZE):
+        self.path = path
+        self.size = size
+        self._lock = threading.Lock()
+        self._mmap = None
+        self._inode = None
+        self._cached_seq = None
+        self._cached = None
+
+    def _map(self):
+        """Map the state file, remapping if the collector recreated it.
+
+        Called on every access: a stat is cheap next to reading a stale
+        mapping of a file the collector replaced (e.g. after a restart with
+        /dev/shm cleared).
+        """
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        inode = (st.st_dev, st.st_ino)
+        if self._mmap is not None and inode == self._inode:
+            return True
+        with open(self.path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                return False
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap is not None:
+            self._mmap.close()
+        self._mmap = mapped
+        self._inode = inode
+        self._cached_seq = None
+        return True
+
+    def sequence(self):
+        """Current publish sequence (changes whenever a new reading is published)."""
+        with self._lock:
+            if not self._map():
+                return None
+            return HEADER.unpack_from(self._mmap, 0)[0]
+
+    def read(self, retries=100):
+        """Latest record per device ({address: record}), or None if unavailable."""
+        with self._lock:
+            if not self._map():
+                return None
+            return self._read(retries)
+
+    def _read(self, retries):
+        for _ in range(retries):
+            seq, length = HEADER.unpack_from(self._mmap, 0)
+            if seq == self._cached_seq:
+                return self._cached
+            if seq % 2 == 0 and HEADER.size + length <= len(self._mmap):
+                payload = self._mmap[HEADER.size:HEADER.size + length]
+                if HEADER.unpack_from(self._mmap, 0)[0] == seq:
+                    if seq == 0:
+                        return {}
+                    try:
+                        self._cached = json.loads(payload)
+                        self._cached_seq = seq
+                        return self._cached
+                    except ValueError:
+                        pass
+            time.sleep(0.0001)
+        return None
@@ -0,0 +1,117 @@
+"""
+Fan-out of new readings to Server-Sent Events clients.
+
+A single background thread watches the collector's latest-state snapshot
+(a memory read, no disk access) and pushes every new reading to each
+connected client's queue, so adding viewers does not add watchers or I/O.
+
+Every open stream holds a server thread, so the number of clients per
+process is capped (max_clients); beyond it subscribe() refuses and the
+page falls back to polling.
+"""
+import json
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class LiveBroadcaster:
+    """Watches a LatestStateReader and fans new readings out to subscribers."""
+
+    def __init__(self, reader, poll_interval=0.25, client_queue_size=100, max_clients=None):
+        self.reader = reader
+        self.max_clients = max_clients
+        self.poll_interval = poll_interval
+        self.client_queue_size = client_queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_seen = {}   # address -> timestamp of the last reading sent
+
+    def subscribe(self):
+        """Register a client; returns the queue its readings arrive on, or None when full."""
+        client = queue.Queue(maxsize=self.client_queue_size)
+        with self._lock:
+            if self.max_clients is not None and len(self._subscribers) >= self.max_clients:
+                return None
+            self._subscribers.add(client)
+            # Started lazily so every (forked) server worker runs its own watcher
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='live-broadcaster', daemon=True)
+                self._thread.start()
+        return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._subscribers.discard(client)
+
+    def client_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def _run(self):
+        # Clients get the current state when they connect; only send what is new
+        last_seq = self.reader.sequence()
+        for address, entry in (self.reader.read() or {}).items():
+            self._last_seen[address] = entry.get('timestamp')
+
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                if not self._subscribers:
+                    continue
+            try:
+                seq = self.reader.sequence()
+                if seq is None or seq == last_seq:
+                    continue
+                last_seq = seq
+                latest = self.reader.read() or {}
+            except Exception as e:
+                logger.error(f"Error reading latest state: {e}")
+                continue
+
+            for address, entry in latest.items():
+                timestamp = entry.get('timestamp')
+                if self._last_seen.get(address) == timestamp:
+                    continue
+                self._last_seen[address] = timestamp
+                self._broadcast(entry)
+
+    def _broadcast(self, entry):
+        message = json.dumps(entry, separators=(',', ':'))
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for client in subscribers:
+            try:
+                client.put_nowait(message)
+            except queue.Full:
+                # A client that stopped reading; drop it rather than buffer forever
+                logger.warning("Dropping slow live stream client")
+                self.unsubscribe(client)
+                # Make room for the end-of-stream marker; only this thread puts,
+                # so the queue cannot fill up again in between
+                try:
+                    client.get_nowait()
+                except queue.Empty:
+                    pass
+                client.put_nowait(None)
+
+def sse_events(broadcaster, client, initial_entries=(), heartbeat=15.0):
+    """Generator of Server-Sent Events for one subscribed client."""
+    try:
+        for entry in initial_entries:
+            yield f"data: {json.dumps(entry, separators=(',', ':'))}\n\n"
+        while True:
+            try:
+                message = client.get(timeout=heartbeat)
+            except queue.Empty:
+                # Comment line keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+                continue
+            if message is None:
+                break
+            yield f"data: {message}\n\n"
+    finally:
+        broadcaster.unsubscribe(client)
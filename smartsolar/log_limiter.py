@@ -0,0 +1,61 @@
+"""
+Per-key rate limiting for log messages on the collection hot path.
+
+Messages logged with a rate key pass at most once per interval per key;
+the next one to pass carries the number suppressed in between, so log
+volume stays bounded however many advertisements arrive:
+
+    logger.info(f"Heard {address}", extra=rate_limited(f"advert:{address}"))
+    -> Heard DF:C9:B0:6E:3F:EF (1180 similar suppressed in 60s)
+
+Messages without a rate key are not affected.
+"""
+import logging
+import time
+from logging.handlers import QueueHandler
+
+RATE_KEY = 'rate_key'
+
+# Keys remembered at most; the least recently passed are forgotten first
+MAX_KEYS = 10000
+
+def rate_limited(key):
+    """`extra` argument that puts a log call under rate key `key`."""
+    return {RATE_KEY: key}
+
+class RateLimitFilter(logging.Filter):
+    """Lets each rate key through at most once every `interval` seconds."""
+
+    def __init__(self, interval=60.0):
+        super().__init__()
+        self.interval = interval
+        self._keys = {}   # key -> [monotonic time last passed, suppressed since]
+
+    def filter(self, record):
+        key = getattr(record, RATE_KEY, None)
+        if key is None or self.interval <= 0:
+            return True
+        now = time.monotonic()
+        entry = self._keys.get(key)
+        if entry is not None and now - entry[0] < self.interval:
+            entry[1] += 1
+            return False
+
+        if entry is not None and entry[1]:
+            record.msg = f"{record.msg} ({entry[1]} similar suppressed in {now - entry[0]:.0f}s)"
+        # Re-insert so the dict stays in order of last use
+        self._keys.pop(key, None)
+        self._keys[key] = [now, 0]
+        if len(self._keys) > MAX_KEYS:
+            del self._keys[next(iter(self._keys))]
+        return True
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The stock handler formats each record before queueing it (so it can be
+    pickled). This queue stays in the process, so the record is passed as is.
+    """
+
+    def prepare(self, record):
+        return record
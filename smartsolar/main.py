@@ -1,24 +1,39 @@
 import asyncio
+import atexit
 import logging
-from logging.handlers import TimedRotatingFileHandler
-from bleak import BleakScanner, BleakClient
-import json
+import queue
+from logging.handlers import QueueListener, TimedRotatingFileHandler
 from datetime import datetime, timezone
 import os
+import signal
 import sys
-from victron_ble.devices import detect_device_type
-from key_manager import load_device_keys, parse_victron_data
+import time
+from key_manager import KeyStore
+from decoder import DecodeEngine, UnusableReading
+from writer import NDJSONWriter, DURABILITY_POLICIES
+from rollups import RollupEngine
+from archive import days_to_archive
+from latest_state import LatestStatePublisher, default_state_path
+from gatt_reader import GattReader
+from advert_source import ADVERT_SOURCES, create_source
+from scheduler import SampleScheduler, load_sample_intervals
+from metrics import Registry, start_metrics_server
+from recording_filter import DeadbandFilter, RECORD_POLICIES, MAX_HEARTBEAT_MINUTES, load_deadbands
+from influx_exporter import InfluxExporter
+from log_limiter import DeferredQueueHandler, RateLimitFilter, rate_limited
 
 # Constants
 VERSION = "v1"
 SLUG = "smartsolar"
-DATA_DIR = f"/data/{SLUG}-{VERSION}"
+DATA_DIR = os.getenv('DATA_DIR', f"/data/{SLUG}-{VERSION}")
 
 # Ensure data directory exists
 os.makedirs(DATA_DIR, exist_ok=True)
 
 # Configure logging
 def setup_logging():
+    """Log through a queue: the callers only enqueue records, and a background
+    thread formats them and writes to the console and the log file."""
     log_file = os.path.join(DATA_DIR, "smartsolar.log")
     
     # Create formatter
@@ -36,16 +51,33 @@ def setup_logging():
     file_handler.suffix = "%Y-%m-%d"
     file_handler.setLevel(logging.WARNING)  # Only warnings and errors to file
     
-    # Console handler for info and above
+    # Console handler for info and above (LOG_LEVEL=DEBUG for more detail)
+    level_name = os.getenv('LOG_LEVEL', 'INFO').strip().upper()
+    console_level = getattr(logging, level_name, None)
+    if not isinstance(console_level, int):
+        console_level = logging.INFO
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setFormatter(formatter)
-    console_handler.setLevel(logging.INFO)  # Info and above to console
+    console_handler.setLevel(console_level)
+    
+    # Hot-path messages under a rate key pass at most once per LOG_RATE_LIMIT seconds
+    queue_handler = DeferredQueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(RateLimitFilter(max(0.0, float(os.getenv('LOG_RATE_LIMIT', '60')))))
+    listener = QueueListener(queue_handler.queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    # Write out whatever is still queued when the process exits
+    atexit.register(listener.stop)
+    
+    # Records below every handler's level are not even created
+    level = min(console_level, logging.WARNING)
+    
+    # Configure the root logger, so the other modules' messages are written too
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
     
-    # Configure root logger
     logger = logging.getLogger(__name__)
-    logger.setLevel(logging.DEBUG)  # Changed to DEBUG to see more details
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    logger.setLevel(level)
     
     return logger
 
@@ -56,6 +88,7 @@ def get_config():
     """Load and validate configuration from environment variables."""
     ble_scan_timeout = int(os.getenv('BLE_SCAN_TIMEOUT', '5'))
     collection_interval = int(os.getenv('COLLECTION_INTERVAL', '60'))
+    scan_mode = os.getenv('SCAN_MODE', 'continuous').strip().lower()
     
     # Validate BLE scan timeout
     if ble_scan_timeout < 1:
@@ -70,192 +103,592 @@ def get_config():
         logger.warning(f"COLLECTION_INTERVAL too low ({collection_interval}), setting to 10 seconds")
         collection_interval = 10
     
-    return ble_scan_timeout, collection_interval
+    # Validate scan mode
+    if scan_mode not in ('continuous', 'interval'):
+        logger.warning(f"Unknown SCAN_MODE '{scan_mode}', using 'continuous'")
+        scan_mode = 'continuous'
+    
+    return ble_scan_timeout, collection_interval, scan_mode
 
 # Load configuration
-BLE_SCAN_TIMEOUT, COLLECTION_INTERVAL = get_config()
+BLE_SCAN_TIMEOUT, COLLECTION_INTERVAL, SCAN_MODE = get_config()
+
+def get_source_config():
+    """Advertisement source (live, capture or replay) from environment variables."""
+    kind = os.getenv('ADVERT_SOURCE', 'live').strip().lower()
+    if kind not in ADVERT_SOURCES:
+        logger.warning(f"Unknown ADVERT_SOURCE '{kind}', using 'live'")
+        kind = 'live'
+    config = {
+        'kind': kind,
+        'capture_file': os.getenv('CAPTURE_FILE', os.path.join(DATA_DIR, 'captures', 'adverts.ndjson')),
+        'replay_file': os.getenv('REPLAY_FILE'),
+        'replay_speed': max(0.0, float(os.getenv('REPLAY_SPEED', '1'))),
+        'replay_loop': os.getenv('REPLAY_LOOP', 'false').strip().lower() in ('1', 'true', 'yes'),
+    }
+    if kind == 'replay' and not config['replay_file']:
+        logger.warning("ADVERT_SOURCE=replay needs REPLAY_FILE, using 'live'")
+        config['kind'] = 'live'
+    return config
+
+SOURCE_CONFIG = get_source_config()
+
+# A replay runs once from start to end, so it needs the long-lived scanner
+if SOURCE_CONFIG['kind'] == 'replay' and SCAN_MODE != 'continuous':
+    logger.warning("Replaying advertisements requires SCAN_MODE=continuous, switching")
+    SCAN_MODE = 'continuous'
+
+def get_writer_config():
+    """Load and validate data writer settings from environment variables."""
+    durability = os.getenv('WRITER_DURABILITY', 'flush').strip().lower()
+    if durability not in DURABILITY_POLICIES:
+        logger.warning(f"Unknown WRITER_DURABILITY '{durability}', using 'flush'")
+        durability = 'flush'
+    
+    return {
+        'durability': durability,
+        'flush_records': max(1, int(os.getenv('WRITER_FLUSH_RECORDS', '50'))),
+        'flush_interval': max(0.1, float(os.getenv('WRITER_FLUSH_INTERVAL', '5'))),
+        'fsync_records': max(1, int(os.getenv('WRITER_FSYNC_RECORDS', '500'))),
+        'fsync_interval': max(1.0, float(os.getenv('WRITER_FSYNC_INTERVAL', '60'))),
+    }
+
+def get_gatt_config():
+    """Load GATT fallback reader settings from environment variables."""
+    return {
+        'connect_timeout': max(1.0, float(os.getenv('GATT_CONNECT_TIMEOUT', '10'))),
+        'read_timeout': max(0.5, float(os.getenv('GATT_READ_TIMEOUT', '5'))),
+        'keep_alive': os.getenv('GATT_KEEP_ALIVE', 'true').strip().lower() in ('1', 'true', 'yes'),
+        'backoff_base': max(1.0, float(os.getenv('GATT_BACKOFF_BASE', '30'))),
+        'backoff_max': max(1.0, float(os.getenv('GATT_BACKOFF_MAX', '1800'))),
+    }
+
+def get_recording_filter():
+    """Deadband recording filter from environment variables (None stores every reading)."""
+    policy = os.getenv('RECORD_POLICY', 'deadband').strip().lower()
+    if policy not in RECORD_POLICIES:
+        logger.warning(f"Unknown RECORD_POLICY '{policy}', using 'deadband'")
+        policy = 'deadband'
+    if policy == 'all':
+        return None
+    
+    heartbeat = float(os.getenv('RECORD_HEARTBEAT', '10'))
+    if heartbeat <= 0 or heartbeat > MAX_HEARTBEAT_MINUTES:
+        logger.warning(f"RECORD_HEARTBEAT out of range ({heartbeat}), setting to {MAX_HEARTBEAT_MINUTES} minutes")
+        heartbeat = MAX_HEARTBEAT_MINUTES
+    return DeadbandFilter(load_deadbands(), heartbeat=heartbeat * 60)
+
+def get_influx_exporter():
+    """Direct InfluxDB exporter from environment variables (None unless INFLUX_EXPORT is on)."""
+    if os.getenv('INFLUX_EXPORT', 'false').strip().lower() not in ('1', 'true', 'yes'):
+        return None
+    url = os.getenv('INFLUX_URL')
+    if not url:
+        logger.warning("INFLUX_EXPORT needs INFLUX_URL, export disabled")
+        return None
+    start_from = os.getenv('INFLUX_EXPORT_FROM', 'today').strip().lower()
+    if start_from not in ('today', 'all'):
+        logger.warning(f"Unknown INFLUX_EXPORT_FROM '{start_from}', using 'today'")
+        start_from = 'today'
+    return InfluxExporter(
+        DATA_DIR, url,
+        token=os.getenv('INFLUX_TOKEN', ''),
+        org=os.getenv('INFLUX_ORG', ''),
+        bucket=os.getenv('INFLUX_BUCKET', ''),
+        batch_size=max(1, int(os.getenv('INFLUX_BATCH_SIZE', '5000'))),
+        batch_interval=max(1.0, float(os.getenv('INFLUX_BATCH_INTERVAL', '10'))),
+        spool_max_bytes=int(max(1.0, float(os.getenv('INFLUX_SPOOL_MB', '200'))) * 1024 * 1024),
+        start_from=start_from,
+        host=os.getenv('INFLUX_HOST_TAG') or os.getenv('BALENA_DEVICE_NAME_AT_INIT'),
+    )
+
+# Collector metrics, served as Prometheus text on METRICS_PORT (0 disables)
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9101'))
+# Local only by default; set e.g. 0.0.0.0 to let other hosts scrape it
+METRICS_BIND = os.getenv('METRICS_BIND', '127.0.0.1')
+metrics = Registry()
+scan_seconds = metrics.histogram('smartsolar_scan_duration_seconds', 'Duration of interval-mode scans')
+first_advert_seconds = metrics.histogram('smartsolar_first_advert_seconds',
+                                         'Time from starting a scanner to the first Victron advertisement')
+adverts_received = metrics.counter('smartsolar_adverts_received_total',
+                                   'Victron advertisements received', ('device',))
+decode_seconds = metrics.histogram('smartsolar_decode_seconds', 'Advertisement decode latency')
+decode_failures = metrics.counter('smartsolar_decode_failures_total',
+                                  'Advertisements that could not be decoded', ('device',))
+gatt_reads = metrics.counter('smartsolar_gatt_reads_total', 'GATT fallback reads', ('result',))
+gatt_seconds = metrics.histogram('smartsolar_gatt_read_seconds', 'GATT fallback read latency')
+records_written = metrics.counter('smartsolar_records_written_total', 'Records written to the data files')
+writer_flush_seconds = metrics.histogram('smartsolar_writer_flush_seconds', 'Time to write one batch of records')
+cycle_seconds = metrics.histogram('smartsolar_cycle_duration_seconds', 'Duration of collection cycles')
+cycle_overruns = metrics.counter('smartsolar_cycle_overruns_total',
+                                 'Collection cycles that took longer than COLLECTION_INTERVAL')
+
+def observe_batch(records, seconds):
+    """Writer thread callback after each written batch."""
+    records_written.inc(amount=records)
+    writer_flush_seconds.observe(seconds)
+
+# Latest reading per device, shared with the dashboard
+latest_state = LatestStatePublisher(default_state_path(DATA_DIR))
+
+# Days to keep as NDJSON before archiving to the columnar format (0 disables)
+ARCHIVE_AFTER_DAYS = max(0, int(os.getenv('ARCHIVE_AFTER_DAYS', '7')))
+
+# Background writer for the daily NDJSON files, which also keeps the rollups
+rollup_engine = RollupEngine(os.path.join(DATA_DIR, "rollups"))
+data_writer = NDJSONWriter(DATA_DIR, listeners=[rollup_engine], on_batch=observe_batch,
+                           **get_writer_config())
+metrics.gauge('smartsolar_writer_queue_depth', 'Records queued for the writer thread',
+              function=data_writer.queue_depth)
+
+# Ships the data files to InfluxDB through an on-disk queue (None: Telegraf does it)
+influx_exporter = get_influx_exporter()
+if influx_exporter is not None:
+    metrics.gauge('smartsolar_influx_spool_bytes', 'Bytes of batches queued for InfluxDB',
+                  function=influx_exporter.spool_bytes)
+    metrics.gauge('smartsolar_influx_batches_sent', 'Batches accepted by InfluxDB since start',
+                  function=lambda: influx_exporter.sent_batches)
 
-# Device keys will be loaded dynamically
-DEVICE_KEYS = {}
+# Device keys, reloaded only when the keys file changes
+key_store = KeyStore()
 
-# Global variable to store discovered devices with their data
+# Global variable to store discovered devices with their data.
+# In continuous mode this is the "latest advertisement" table, keyed by address.
 discovered_devices = {}
 
+# Long-lived scanner used in continuous mode
+continuous_scanner = None
+
+# Monotonic time the current scanner started, until its first advertisement
+scan_started = None
+
+# Decoder with cached parsers, shared across cycles
+decode_engine = DecodeEngine()
+
+# Drops readings within the deadband of the last stored one (None: store all)
+recording_filter = get_recording_filter()
+
+# GATT fallback for devices without a key or with undecodable advertisements
+gatt_reader = GattReader(**get_gatt_config())
+
+# Per-device coverage: number of cycles each device was seen or missed in
+device_coverage = {}
+
+# Per-device sample rates (SAMPLE_INTERVAL_<MAC>, default COLLECTION_INTERVAL)
+sample_scheduler = SampleScheduler(COLLECTION_INTERVAL, load_sample_intervals())
+
+# In continuous mode, advertisements let through by the scheduler wait here
+# to be decoded and recorded (created in main(), inside the event loop)
+record_queue = None
+RECORD_QUEUE_SIZE = 1000
+
+# Devices with a sample queued or still being processed; their adverts are
+# skipped without claiming a scheduler slot, so the next one is recorded
+recording = set()
+
+def is_victron_device(device):
+    """Check whether a scanned device is one we should collect from."""
+    if device.address.upper() in key_store:
+        return True
+    return bool(device.name and ("SmartSolar" in device.name or "Victron" in device.name))
+
 def detection_callback(device, advertisement_data):
     """Callback for when a device is detected during scanning."""
-    if device.name and ("SmartSolar" in device.name or "Victron" in device.name):
-        logger.debug(f"Found Victron device in callback: {device.name} ({device.address})")
-        
+    global scan_started
+    if is_victron_device(device):
         # Check for manufacturer data
         if advertisement_data.manufacturer_data:
             for mfr_id, data in advertisement_data.manufacturer_data.items():
                 if mfr_id == 737:  # Victron manufacturer ID (0x02E1)
-                    logger.info(f"Found Victron manufacturer data for {device.address}")
-                    discovered_devices[device.address] = {
+                    address = device.address.upper()
+                    logger.info(f"Receiving Victron advertisements from {device.name} ({address})",
+                                extra=rate_limited(f"advert:{address}"))
+                    adverts_received.inc(address)
+                    if scan_started is not None:
+                        first_advert_seconds.observe(time.monotonic() - scan_started)
+                        scan_started = None
+                    # Replayed adverts are stamped and sampled on their capture clock,
+                    # so a faster replay records proportionally more readings
+                    captured_at = getattr(advertisement_data, 'captured_at', None)
+                    if captured_at is not None:
+                        timestamp = datetime.fromtimestamp(captured_at, timezone.utc)
+                    else:
+                        timestamp = datetime.now(timezone.utc)
+                    device_info = {
                         'device': device,
                         'victron_data': data,
-                        'timestamp': datetime.now(timezone.utc)
+                        'timestamp': timestamp
                     }
+                    discovered_devices[address] = device_info
+                    # Continuous mode: record on arrival, at the device's own rate.
+                    # The slot is only claimed for a sample that will be processed.
+                    if record_queue is not None and address not in recording:
+                        if record_queue.full():
+                            logger.warning(f"Record queue full, dropping advertisement from {address}",
+                                           extra=rate_limited(f"queue-full:{address}"))
+                        elif sample_scheduler.due(address, captured_at):
+                            record_queue.put_nowait((address, device_info))
+                            recording.add(address)
                     break
 
-async def scan_and_process_devices():
-    """Scan for devices and process them with encryption keys."""
+async def start_continuous_scanner():
+    """Start a scanner that runs for the life of the process."""
+    global continuous_scanner, scan_started
+    if continuous_scanner is not None:
+        return
+    
+    logger.info("Starting continuous BLE scanner")
+    scanner = create_source(detection_callback, **SOURCE_CONFIG)
+    scan_started = time.monotonic()
+    await scanner.start()
+    continuous_scanner = scanner
+
+async def stop_continuous_scanner():
+    """Stop the long-lived scanner, if running."""
+    global continuous_scanner
+    if continuous_scanner is None:
+        return
+    
+    scanner = continuous_scanner
+    continuous_scanner = None
+    try:
+        await scanner.stop()
+    except Exception as e:
+        logger.warning(f"Error stopping continuous scanner: {e}")
+
+def snapshot_discovered_devices():
+    """Take the latest advertisement per device and start a fresh table."""
     global discovered_devices
+    snapshot = discovered_devices
+    discovered_devices = {}
+    return snapshot
+
+async def scan_interval(expected_devices):
+    """Start a scanner, wait for the expected devices or the timeout, then stop it.
+    
+    With no expected devices (no keys configured) the scan stops at the first
+    Victron device found.
+    """
+    global discovered_devices, scan_started
     discovered_devices = {}  # Clear previous discoveries
     
-    logger.info("Scanning for Victron devices...")
+    logger.info(f"Scanning for Victron devices ({len(expected_devices)} expected)...")
     
-    # Create an event to signal when we've found a device
+    # Create an event to signal when we've found every device we need
     device_found = asyncio.Event()
     
     def detection_callback_with_stop(device, advertisement_data):
-        """Modified callback that signals when a device is found."""
+        """Modified callback that signals when all expected devices are found."""
         detection_callback(device, advertisement_data)
-        # If we found a Victron device with data, signal to stop scanning
-        if discovered_devices:
+        if not discovered_devices:
+            return
+        # Stop early only once every keyed device has been seen
+        if expected_devices.issubset(discovered_devices):
             device_found.set()
     
-    scanner = BleakScanner(detection_callback=detection_callback_with_stop)
+    scanner = create_source(detection_callback_with_stop, **SOURCE_CONFIG)
     
     # Start scanning
+    scan_started = started = time.monotonic()
     await scanner.start()
     
     try:
         # Wait for either a device to be found or timeout
         await asyncio.wait_for(device_found.wait(), timeout=BLE_SCAN_TIMEOUT)
-        logger.info(f"Device found early, stopping scan")
+        logger.info(f"All expected devices found early, stopping scan")
     except asyncio.TimeoutError:
         # No device found within timeout, that's OK
         logger.debug(f"Scan timeout after {BLE_SCAN_TIMEOUT}s")
     
     await scanner.stop()
+    scan_seconds.observe(time.monotonic() - started)
     
-    logger.info(f"Scan complete. Found {len(discovered_devices)} Victron device(s)")
-    
-    # Process discovered devices
-    for address, device_info in discovered_devices.items():
-        device = device_info['device']
-        victron_data = device_info['victron_data']
-        
-        # Get encryption key if available
-        encryption_key = DEVICE_KEYS.get(address)
-        
-        data_entry = {
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "device_name": device.name,
-            "device_address": address
-        }
-        
-        if encryption_key:
-            logger.info(f"Processing {device.name} ({address}) with encryption key")
-            try:
-                # Detect device type and parse data
-                parser_class = detect_device_type(victron_data)
-                if parser_class:
-                    parser = parser_class(encryption_key)
-                    parsed = parser.parse(victron_data)
-                    
-                    # Convert to dictionary using shared function
-                    parsed_dict = parse_victron_data(parsed)
-                    
-                    logger.info(f"Parsed Victron data: {parsed_dict}")
-                    data_entry["parsed_data"] = parsed_dict
-                    data_entry["raw_data"] = victron_data.hex()
-                else:
-                    logger.warning(f"Could not detect device type for {address}")
-                    # Fall back to raw characteristic reading
-                    raw_data = await read_raw_characteristics(device)
-                    if raw_data:
-                        data_entry.update(raw_data)
-            except Exception as e:
-                logger.warning(f"Could not parse Victron data for {address}: {e}")
+    return snapshot_discovered_devices()
+
+def update_coverage(expected_devices, seen_devices):
+    """Record which devices were seen or missed this cycle and log a summary."""
+    for address in expected_devices | seen_devices:
+        stats = device_coverage.setdefault(address, {'seen': 0, 'missed': 0})
+        if address in seen_devices:
+            stats['seen'] += 1
+        else:
+            stats['missed'] += 1
+    
+    missed = sorted(expected_devices - seen_devices)
+    if expected_devices:
+        logger.info(f"Coverage: {len(expected_devices) - len(missed)}/{len(expected_devices)} keyed device(s) seen this cycle")
+    for address in missed:
+        stats = device_coverage[address]
+        total = stats['seen'] + stats['missed']
+        logger.warning(f"Missed {address} this cycle (seen in {stats['seen']}/{total} cycles)")
+
+async def read_gatt(device):
+    """GATT fallback read, counted and timed."""
+    if getattr(device, 'replayed', False):
+        # Replayed advertisement: there is no device to connect to
+        return None
+    started = time.monotonic()
+    raw_data = await gatt_reader.read(device)
+    gatt_reads.inc('ok' if raw_data else 'failed')
+    gatt_seconds.observe(time.monotonic() - started)
+    return raw_data
+
+async def process_device(address, device_info):
+    """Decode one device's advertisement (or fall back to GATT) and save it."""
+    device = device_info['device']
+    victron_data = device_info['victron_data']
+    
+    # Get encryption key if available
+    encryption_key = key_store.get(address)
+    
+    data_entry = {
+        "timestamp": device_info['timestamp'].isoformat(),
+        "device_name": device.name,
+        "device_address": address
+    }
+    
+    if encryption_key:
+        logger.debug(f"Processing {device.name} ({address}) with encryption key")
+        try:
+            # Detect device type and parse data (cached per device) into a typed reading
+            started = time.perf_counter()
+            reading = decode_engine.decode_reading(address, encryption_key, victron_data,
+                                                   data_entry["timestamp"], device.name)
+            decode_seconds.observe(time.perf_counter() - started)
+            if reading is not None:
+                # Formatted only if it passes the rate limit
+                logger.info("Parsed Victron data from %s: %s", address, reading,
+                            extra=rate_limited(f"parsed:{address}"))
+                data_entry = reading
+            else:
+                decode_failures.inc(address)
+                logger.warning(f"Could not detect device type for {address}",
+                               extra=rate_limited(f"undetected:{address}"))
                 # Fall back to raw characteristic reading
-                raw_data = await read_raw_characteristics(device)
+                raw_data = await read_gatt(device)
                 if raw_data:
                     data_entry.update(raw_data)
-        else:
-            logger.warning(f"No encryption key found for {address}, reading raw characteristics")
-            # Read raw characteristics
-            raw_data = await read_raw_characteristics(device)
+        except UnusableReading as e:
+            # The advertisement decoded, so GATT would not tell us more
+            decode_failures.inc(address)
+            logger.warning(str(e), extra=rate_limited(f"unusable:{address}"))
+            if e.parsed_data:
+                data_entry["parsed_data"] = e.parsed_data
+        except Exception as e:
+            decode_failures.inc(address)
+            logger.warning(f"Could not parse Victron data for {address}: {e}",
+                           extra=rate_limited(f"parse-error:{address}"))
+            # Fall back to raw characteristic reading
+            raw_data = await read_gatt(device)
             if raw_data:
                 data_entry.update(raw_data)
-        
-        # Save the data
-        save_data(data_entry)
+    else:
+        logger.warning(f"No encryption key found for {address}, reading raw characteristics",
+                       extra=rate_limited(f"no-key:{address}"))
+        # Read raw characteristics
+        raw_data = await read_gatt(device)
+        if raw_data:
+            data_entry.update(raw_data)
+    
+    # Save the data
+    save_data(data_entry)
 
-async def read_raw_characteristics(device):
-    """Read raw characteristics from the device."""
-    try:
-        async with BleakClient(device.address) as client:
-            logger.info(f"Connected to {device.name}")
-            
-            # Create a data entry for this reading
-            data_entry = {
-                "timestamp": datetime.now(timezone.utc).isoformat(),
-                "device_name": device.name,
-                "device_address": device.address,
-                "readings": {}
-            }
-            
-            # Read data from all services
-            for service in client.services:
-                for char in service.characteristics:
-                    if "read" in char.properties:
-                        try:
-                            value = await client.read_gatt_char(char.uuid)
-                            hex_value = value.hex()
-                            logger.info(f"Characteristic {char.uuid}: {hex_value}")
-                            data_entry["readings"][char.uuid] = hex_value
-                        except Exception as e:
-                            logger.error(f"Error reading characteristic {char.uuid}: {str(e)}")
-            
-            return data_entry
+async def scan_and_process_devices():
+    """Report on the last cycle (continuous mode) or scan and process devices (interval mode).
+    
+    In continuous mode advertisements are recorded as they arrive by
+    record_loop(); this cycle only tracks which devices were heard.
+    """
+    expected_devices = key_store.addresses()
+    
+    if SCAN_MODE == 'continuous':
+        if continuous_scanner is None:
+            await start_continuous_scanner()
+            # Give a freshly started scanner time to hear from the devices
+            await asyncio.sleep(BLE_SCAN_TIMEOUT)
+        devices = snapshot_discovered_devices()
+        logger.info(f"Heard {len(devices)} Victron device(s) this cycle")
+        update_coverage(expected_devices, set(devices))
+        logger.info(f"Sampling: {sample_scheduler.stats_summary()}")
+        logger.info(f"Decode stats: {decode_engine.stats_summary()}")
+        if recording_filter is not None:
+            logger.info(f"Recording: {recording_filter.stats_summary()}")
+        return
+    
+    devices = await scan_interval(expected_devices)
+    logger.info(f"Scan complete. Found {len(devices)} Victron device(s)")
+    update_coverage(expected_devices, set(devices))
+    
+    # Devices with a longer sample interval than the cycle are skipped until due
+    devices = {address: device_info for address, device_info in devices.items()
+               if sample_scheduler.due(address)}
+    
+    # Process all discovered devices concurrently
+    results = await asyncio.gather(
+        *(process_device(address, device_info) for address, device_info in devices.items()),
+        return_exceptions=True
+    )
+    for address, result in zip(devices, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error processing {address}: {result}")
+    
+    logger.info(f"Decode stats: {decode_engine.stats_summary()}")
+    if recording_filter is not None:
+        logger.info(f"Recording: {recording_filter.stats_summary()}")
 
-    except Exception as e:
-        logger.error(f"Connection error: {str(e)}")
-        return None
+async def record_loop():
+    """Decode and save advertisements as the scheduler lets them through (continuous mode).
+
+    At most one sample per device is queued or processing (see `recording`), so a
+    slow decode or GATT read skips that device's adverts instead of piling them up.
+    """
+    def finished(address, task):
+        recording.discard(address)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Error processing {address}: {task.exception()}")
+    
+    while True:
+        address, device_info = await record_queue.get()
+        task = asyncio.create_task(process_device(address, device_info))
+        task.add_done_callback(lambda t, a=address: finished(a, t))
 
 def save_data(data_entry):
-    """Save data entry to a daily NDJSON file (one JSON object per line)."""
+    """Queue a data entry (record dict or Reading) for the daily NDJSON file.
+    
+    Every reading goes to the live view; the recording filter decides which
+    ones are written.
+    """
+    if recording_filter is not None:
+        policy = recording_filter.check(data_entry)
+        if policy is None:
+            latest_state.publish(data_entry)
+            logger.debug(f"Reading from {data_entry.get('device_address')} within deadband, not stored")
+            return
+        data_entry["record_policy"] = policy
+    data_writer.write(data_entry)
+    latest_state.publish(data_entry)
+    logger.debug(f"Data queued for writing ({data_writer.queue_depth()} pending)")
+
+# UTC date archiving last ran for, and the running archive job
+last_archive_date = None
+archive_future = None
+
+# Archiving runs in its own process at this niceness, so a day's records never
+# sit in the collector's memory and encoding does not compete with scanning
+ARCHIVE_NICE = 10
+ARCHIVE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive.py')
+
+async def run_archiver(dates):
+    """Archive days in a separate low-priority process and log its output."""
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, ARCHIVE_SCRIPT, '--nice', str(ARCHIVE_NICE), *dates,
+        env=dict(os.environ, DATA_DIR=DATA_DIR),
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
     try:
-        date_str = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-        json_file = os.path.join(DATA_DIR, f"data_{date_str}.ndjson")
-        
-        # Append new data as a single line
-        with open(json_file, 'a') as f:
-            json.dump(data_entry, f, separators=(',', ':'))  # Compact JSON
-            f.write('\n')  # Newline delimiter
-        
-        logger.info(f"Data appended to {json_file}")
-    except Exception as e:
-        logger.error(f"Error saving data: {str(e)}")
+        async for line in process.stdout:
+            if line.strip():
+                logger.info(f"Archiver: {line.decode(errors='replace').rstrip()}")
+        returncode = await process.wait()
+    except asyncio.CancelledError:
+        # A day is only replaced once verified, so stopping midway is safe
+        process.terminate()
+        await process.wait()
+        raise
+    if returncode:
+        logger.error(f"Archiver exited with status {returncode}")
+
+def maybe_start_archiving():
+    """Once per UTC day, archive closed days in a separate process."""
+    global last_archive_date, archive_future
+    # Replayed records keep their capture dates, so "closed" days may still be written to
+    if ARCHIVE_AFTER_DAYS == 0 or SOURCE_CONFIG['kind'] == 'replay':
+        return
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    if today == last_archive_date or (archive_future and not archive_future.done()):
+        return
+    last_archive_date = today
+    ready = influx_exporter.is_exported if influx_exporter is not None else None
+    dates = days_to_archive(DATA_DIR, ARCHIVE_AFTER_DAYS, ready)
+    if dates:
+        archive_future = asyncio.create_task(run_archiver(dates))
 
 async def main():
     logger.info(f"Starting SmartSolar data collection service {VERSION}")
     logger.info(f"Data files will be stored in {DATA_DIR}")
-    logger.info(f"Collection interval: {COLLECTION_INTERVAL}s, BLE scan timeout: {BLE_SCAN_TIMEOUT}s")
+    logger.info(f"Collection interval: {COLLECTION_INTERVAL}s, BLE scan timeout: {BLE_SCAN_TIMEOUT}s, scan mode: {SCAN_MODE}")
+    logger.info(f"Writer durability: {data_writer.durability}")
+    logger.info(f"Advertisement source: {SOURCE_CONFIG['kind']}")
+    
+    # Stop cleanly on SIGTERM (balena restarts) so buffered data is written
+    main_task = asyncio.current_task()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, main_task.cancel)
+    
+    global record_queue
+    recorder = None
+    if SCAN_MODE == 'continuous':
+        record_queue = asyncio.Queue(maxsize=RECORD_QUEUE_SIZE)
+        recorder = asyncio.create_task(record_loop())
+    
+    metrics_server = None
+    if METRICS_PORT:
+        try:
+            metrics_server = await start_metrics_server(metrics, METRICS_PORT, METRICS_BIND)
+        except OSError as e:
+            logger.error(f"Could not serve metrics on {METRICS_BIND}:{METRICS_PORT}: {e}")
+    
+    data_writer.start()
+    if influx_exporter is not None:
+        influx_exporter.start()
+        logger.info(f"Exporting to InfluxDB at {os.getenv('INFLUX_URL')}")
+    try:
+        await collection_loop()
+    except asyncio.CancelledError:
+        logger.info("Shutting down")
+    finally:
+        await stop_continuous_scanner()
+        if recorder is not None:
+            recorder.cancel()
+        if metrics_server is not None:
+            metrics_server.close()
+        if archive_future is not None and not archive_future.done():
+            archive_future.cancel()
+            await asyncio.gather(archive_future, return_exceptions=True)
+        await gatt_reader.close()
+        data_writer.close()
+        logger.info("Data writer flushed and closed")
+        if influx_exporter is not None:
+            influx_exporter.close()
+
+async def collection_loop():
+    """Run collection cycles at the configured interval."""
+    keys_changed = True  # Report the keys loaded at startup
     
     while True:
         try:
             # Record start time
             cycle_start = asyncio.get_event_loop().time()
             
-            # Reload device keys on each cycle to pick up changes
-            global DEVICE_KEYS
-            DEVICE_KEYS = load_device_keys()
+            # Pick up key changes (only re-reads the file when it has changed)
+            keys_changed = key_store.refresh() or keys_changed
             
-            if DEVICE_KEYS:
-                logger.info(f"Configured with {len(DEVICE_KEYS)} device key(s)")
-            else:
-                logger.warning("No device encryption keys configured!")
-                logger.warning("Add your device key via the web UI or environment variables")
-                logger.warning("Falling back to raw characteristic reading...")
+            if keys_changed:
+                keys_changed = False
+                if len(key_store):
+                    logger.info(f"Configured with {len(key_store)} device key(s)")
+                else:
+                    logger.warning("No device encryption keys configured!")
+                    logger.warning("Add your device key via the web UI or environment variables")
+                    logger.warning("Falling back to raw characteristic reading...")
             
             # Scan and process devices
             await scan_and_process_devices()
             
+            # Convert old days to the compact archive format
+            maybe_start_archiving()
+            
             # Calculate how long this cycle took
             cycle_duration = asyncio.get_event_loop().time() - cycle_start
+            cycle_seconds.observe(cycle_duration)
             
             # Calculate remaining time to maintain target interval
             sleep_time = max(0, COLLECTION_INTERVAL - cycle_duration)
@@ -264,10 +697,13 @@ async def main():
                 logger.debug(f"Cycle took {cycle_duration:.1f}s, sleeping for {sleep_time:.1f}s")
                 await asyncio.sleep(sleep_time)
             else:
+                cycle_overruns.inc()
                 logger.warning(f"Cycle took {cycle_duration:.1f}s, which exceeds target interval of {COLLECTION_INTERVAL}s")
             
         except Exception as e:
             logger.error(f"Main loop error: {str(e)}")
+            # Restart the long-lived scanner in case BlueZ dropped it
+            await stop_continuous_scanner()
             await asyncio.sleep(10)
 
 if __name__ == "__main__":
@@ -0,0 +1,177 @@
+"""
+Counters, gauges and histograms for the collector, exposed as Prometheus text.
+
+Metrics are cheap to update from the event loop or the writer thread (a
+lock and a few additions), and rendered only when /metrics is scraped:
+
+    curl http://localhost:9101/metrics
+"""
+import asyncio
+import logging
+import threading
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from sub-millisecond decodes to slow GATT reads
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(f'{n}="{v}"' for n, v in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    """Monotonically increasing count, optionally per label values."""
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            items = sorted(self._values.items())
+        if not items and not self.label_names:
+            items = [((), 0)]
+        for label_values, value in items:
+            lines.append(f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}")
+        return lines
+
+class Gauge(_Metric):
+    """Current value; either set directly or read from a function at scrape time."""
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, function=None):
+        super().__init__(name, help_text)
+        self.function = function
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def render(self):
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception as e:
+                logger.debug(f"Error reading gauge {self.name}: {e}")
+        return self.header() + [f"{self.name} {_format_value(value)}"]
+
+class Histogram(_Metric):
+    """Distribution of observed values in fixed cumulative buckets."""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+        self._series = {}   # label values -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for label_values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                labels = _format_labels(self.label_names, label_values, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class Registry:
+    """The set of metrics rendered on /metrics."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, function=None):
+        return self.register(Gauge(name, help_text, function))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+async def _handle(registry, reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Skip the request headers
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=5)
+            if not line or line in (b'\r\n', b'\n'):
+                break
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            body = registry.render().encode('utf-8')
+            status = '200 OK'
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            body = b'Not Found\n'
+            status = '404 Not Found'
+            content_type = 'text/plain'
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError) as e:
+        logger.debug(f"Metrics request failed: {e}")
+    finally:
+        writer.close()
+
+async def start_metrics_server(registry, port, host='127.0.0.1'):
+    """Serve the registry on http://host:port/metrics from the running event loop."""
+    server = await asyncio.start_server(lambda r, w: _handle(registry, r, w), host, port)
+    logger.info(f"Serving metrics on {host}:{port}")
+    return server
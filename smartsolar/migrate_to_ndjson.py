@@ -2,61 +2,339 @@
 """
 Migration script to convert existing JSON array files to NDJSON format.
 Run this once to convert historical data.
+
+Each data_*.json array is parsed incrementally (a record at a time, so memory
+does not grow with the file) and files are converted in parallel, one per
+worker process. Output is written to a temporary file and checked (record
+count and checksum against the source) before it is moved into place, and
+only then is the source retired (renamed to .backup, or deleted).
+
+Interrupted runs can simply be started again: leftover temporary files are
+discarded, and a day whose output is already in place and matches its
+source just has the source retired. Output that does not match is never
+overwritten; the day is reported and left alone.
+
+Days can go straight to the newer formats in the same pass: NDJSON files
+get their sidecar minute index, and days older than --archive-after go
+directly to the columnar archive.
+
+    python3 migrate_to_ndjson.py [--workers N] [--archive-after DAYS] [--rollups]
 """
+import argparse
+import hashlib
 import json
 import os
-import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
 from glob import glob
+from archive import ArchiveReader, archive_path_for, canonical_checksum, encode_day
+from data_index import IndexBuilder, index_path_for, timestamp_minute
+
+# Characters read from a JSON array file at a time
+CHUNK_SIZE = 1024 * 1024
+
+_WHITESPACE = ' \t\n\r'
+_DELIMITERS = _WHITESPACE + ',]'
+_NUMBER_CHARS = '0123456789+-.eE'
+
+class TruncatedFile(ValueError):
+    """The JSON array ends before its closing bracket."""
+
+def iter_json_array(path, chunk_size=CHUNK_SIZE):
+    """Yield the elements of a JSON array file one at a time.
+
+    Raises TruncatedFile (after yielding every complete element) if the file
+    ends early, e.g. when the old writer was interrupted mid-rewrite.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = ''
+        pos = 0
+        eof = False
+
+        def fill():
+            nonlocal buffer, pos, eof
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+        def skip_whitespace():
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    return
+                fill()
+
+        skip_whitespace()
+        if pos >= len(buffer):
+            return   # empty file
+        if buffer[pos] != '[':
+            raise ValueError(f"{path} is not a JSON array")
+        pos += 1
+
+        first = True
+        need_value = False   # a comma has been consumed
+        while True:
+            skip_whitespace()
+            if pos >= len(buffer):
+                raise TruncatedFile(f"{path} ends before the closing bracket")
+            if not need_value:
+                if buffer[pos] == ']':
+                    return
+                if not first:
+                    if buffer[pos] != ',':
+                        raise ValueError(f"{path}: expected ',' between records")
+                    pos += 1
+                    need_value = True
+                    continue
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise TruncatedFile(f"{path} ends inside a record")
+                fill()
+                continue
+            # A number cut by the end of the buffer parses as a shorter one:
+            # only accept a value once the delimiter after it has been read
+            if end == len(buffer) or buffer[end] not in _DELIMITERS:
+                if not eof:
+                    fill()
+                    continue
+                # At the end of the file a number may have been cut anywhere
+                # (12 of 123, 3 of 3e-07); other values end in a closing character
+                if end == len(buffer):
+                    cut = isinstance(value, (int, float)) and not isinstance(value, bool)
+                else:
+                    cut = not buffer[end:].strip(_NUMBER_CHARS)
+                if cut:
+                    raise TruncatedFile(f"{path} ends inside a record")
+            pos = end
+            first = False
+            need_value = False
+            yield value
+
+def _canonical(record):
+    return json.dumps(record, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+class _Digest:
+    """Running record count and order-dependent checksum."""
+
+    def __init__(self):
+        self.count = 0
+        self._hash = hashlib.sha256()
+
+    def add(self, record):
+        self.count += 1
+        self._hash.update(_canonical(record))
+        self._hash.update(b'\n')
+
+    def matches(self, other):
+        return self.count == other.count and self._hash.digest() == other._hash.digest()
+
+def _ndjson_digest(path, limit=None):
+    """Digest of the first `limit` (default: all) complete lines of an NDJSON file."""
+    digest = _Digest()
+    with open(path, 'rb') as f:
+        for raw in f:
+            if limit is not None and digest.count >= limit:
+                break
+            if not raw.endswith(b'\n'):
+                break
+            digest.add(json.loads(raw))
+    return digest
 
-def migrate_json_to_ndjson(json_file):
-    """Convert a JSON array file to NDJSON format."""
-    ndjson_file = json_file.replace('.json', '.ndjson')
-    
-    # Skip if already migrated
-    if os.path.exists(ndjson_file):
-        print(f"Skipping {json_file} - NDJSON file already exists")
-        return False
-    
+def _source_digest(path, salvage):
+    digest = _Digest()
     try:
-        # Read the JSON array
-        with open(json_file, 'r') as f:
-            data = json.load(f)
-        
-        # Write as NDJSON
-        with open(ndjson_file, 'w') as f:
-            for entry in data:
-                json.dump(entry, f, separators=(',', ':'))
-                f.write('\n')
-        
-        print(f"Migrated {json_file} -> {ndjson_file} ({len(data)} entries)")
-        
-        # Optionally rename old file
+        for record in iter_json_array(path):
+            digest.add(record)
+    except TruncatedFile:
+        if not salvage:
+            raise
+    return digest
+
+def _fsync_replace(tmp_path, path):
+    with open(tmp_path, 'rb+') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _retire(json_file, delete_source):
+    if delete_source:
+        os.remove(json_file)
+    else:
         os.rename(json_file, json_file + '.backup')
-        print(f"Renamed original to {json_file}.backup")
-        
-        return True
+
+def _to_ndjson(json_file, ndjson_file, index, salvage):
+    """Stream a JSON array into NDJSON (and its index); returns (records, note)."""
+    tmp_file = ndjson_file + '.tmp'
+    index_file = index_path_for(ndjson_file)
+    tmp_index = index_file + '.tmp'
+    for leftover in (tmp_file, tmp_index):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+
+    written = _Digest()
+    builder = IndexBuilder(tmp_index) if index else None
+    note = ''
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        try:
+            for entry in iter_json_array(json_file):
+                line = json.dumps(entry, separators=(',', ':')) + '\n'
+                f.write(line)
+                written.add(entry)
+                if builder is not None:
+                    record = entry if isinstance(entry, dict) else {}
+                    builder.add(timestamp_minute(record.get('timestamp')), record.get('device_address'),
+                                len(line.encode('utf-8')))
+                    if written.count % 10000 == 0:
+                        builder.flush()
+        except TruncatedFile as e:
+            if not salvage:
+                os.remove(tmp_file)
+                raise
+            note = f"; salvaged: {e}"
+        if builder is not None:
+            builder.flush(close_open_bucket=True)
+
+    # Verify what is on disk against what was read from the source
+    if not written.matches(_ndjson_digest(tmp_file)):
+        os.remove(tmp_file)
+        raise ValueError("verification failed: NDJSON does not match the source")
+    _fsync_replace(tmp_file, ndjson_file)
+    if builder is not None and os.path.exists(tmp_index):
+        os.replace(tmp_index, index_file)
+    return written.count, note
+
+def _to_archive(json_file, data_dir, date_str, salvage):
+    """Encode a JSON array straight into the columnar archive; returns (records, note)."""
+    target = archive_path_for(data_dir, date_str)
+    note = ''
+    # The archive is columnar, so (as in archive.py) a day is encoded from memory
+    records = []
+    try:
+        for entry in iter_json_array(json_file):
+            records.append(entry)
+    except TruncatedFile as e:
+        if not salvage:
+            raise
+        note = f"; salvaged: {e}"
+    kept = [r for r in records if isinstance(r, dict) and 'timestamp' in r]
+    if len(kept) != len(records):
+        note += f"; {len(records) - len(kept)} record(s) without a timestamp dropped"
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_target = target + '.tmp'
+    with open(tmp_target, 'wb') as f:
+        f.write(encode_day(kept, date_str))
+    restored = ArchiveReader(tmp_target).records()
+    if len(restored) != len(kept) or canonical_checksum(restored) != canonical_checksum(kept):
+        os.remove(tmp_target)
+        raise ValueError("verification failed: archive does not match the source")
+    _fsync_replace(tmp_target, target)
+    return len(kept), note
+
+def migrate_file(json_file, archive_before=None, index=True, delete_source=False, salvage=False):
+    """Convert one JSON array file; returns (status, message).
+
+    status is 'migrated', 'resumed' (output already there and verified),
+    'conflict' (output exists with other data) or 'error'.
+    """
+    started = time.monotonic()
+    data_dir = os.path.dirname(json_file)
+    date_str = os.path.basename(json_file)[len('data_'):-len('.json')]
+    ndjson_file = json_file[:-len('.json')] + '.ndjson'
+    archive_file = archive_path_for(data_dir, date_str)
+    to_archive = archive_before is not None and date_str < archive_before
+    try:
+        # Output from an earlier, interrupted run (or an NDJSON file the collector started)
+        if os.path.exists(ndjson_file):
+            source = _source_digest(json_file, salvage)
+            if not source.matches(_ndjson_digest(ndjson_file, limit=source.count)):
+                return 'conflict', f"{ndjson_file} already exists with other data, left both in place"
+            _retire(json_file, delete_source)
+            return 'resumed', f"{json_file}: {ndjson_file} already matches the source ({source.count} entries)"
+        if os.path.exists(archive_file):
+            records = []
+            try:
+                records.extend(iter_json_array(json_file))
+            except TruncatedFile:
+                if not salvage:
+                    raise
+            kept = [r for r in records if isinstance(r, dict) and 'timestamp' in r]
+            if canonical_checksum(ArchiveReader(archive_file).records()) != canonical_checksum(kept):
+                return 'conflict', f"{archive_file} already exists with other data, left both in place"
+            _retire(json_file, delete_source)
+            return 'resumed', f"{json_file}: {archive_file} already matches the source ({len(kept)} entries)"
+
+        if to_archive:
+            count, note = _to_archive(json_file, data_dir, date_str, salvage)
+            target = archive_file
+        else:
+            count, note = _to_ndjson(json_file, ndjson_file, index, salvage)
+            target = ndjson_file
+        _retire(json_file, delete_source)
+        retired = "deleted" if delete_source else f"renamed to {os.path.basename(json_file)}.backup"
+        return 'migrated', (f"Migrated {json_file} -> {target} ({count} entries{note}) "
+                            f"in {time.monotonic() - started:.1f}s, original {retired}")
+    except TruncatedFile as e:
+        return 'error', f"Error migrating {json_file}: {e} (use --salvage to keep its complete records)"
     except Exception as e:
-        print(f"Error migrating {json_file}: {e}")
-        return False
+        return 'error', f"Error migrating {json_file}: {e}"
 
 def main():
-    data_dir = os.environ.get('DATA_DIR', '/data/smartsolar-v1')
-    
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data-dir', default=os.environ.get('DATA_DIR', '/data/smartsolar-v1'))
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='files converted in parallel (default: number of CPUs)')
+    parser.add_argument('--archive-after', type=int, default=0,
+                        help='days older than this go straight to the columnar archive (0: NDJSON only)')
+    parser.add_argument('--no-index', action='store_true', help='do not write sidecar indexes')
+    parser.add_argument('--rollups', action='store_true', help='rebuild the rollups once files are migrated')
+    parser.add_argument('--delete-source', action='store_true', help='delete originals instead of keeping .backup')
+    parser.add_argument('--salvage', action='store_true',
+                        help='migrate the complete records of truncated files instead of skipping them')
+    args = parser.parse_args()
+
     # Find all JSON files
-    json_files = glob(os.path.join(data_dir, 'data_*.json'))
-    
+    json_files = sorted(glob(os.path.join(args.data_dir, 'data_*.json')))
+
     if not json_files:
-        print(f"No JSON files found in {data_dir}")
+        print(f"No JSON files found in {args.data_dir}")
         return
-    
-    print(f"Found {len(json_files)} JSON files to migrate")
-    
-    migrated = 0
-    for json_file in json_files:
-        if migrate_json_to_ndjson(json_file):
-            migrated += 1
-    
-    print(f"\nMigration complete: {migrated}/{len(json_files)} files migrated")
+
+    archive_before = None
+    if args.archive_after > 0:
+        archive_before = (datetime.now(timezone.utc) - timedelta(days=args.archive_after)).strftime('%Y-%m-%d')
+    workers = max(1, min(args.workers, len(json_files)))
+    print(f"Found {len(json_files)} JSON files to migrate ({workers} worker(s))")
+
+    started = time.monotonic()
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(migrate_file, json_file, archive_before, not args.no_index,
+                               args.delete_source, args.salvage) for json_file in json_files]
+        for future in as_completed(futures):
+            status, message = future.result()
+            results[status] = results.get(status, 0) + 1
+            print(message)
+
+    done = results.get('migrated', 0) + results.get('resumed', 0)
+    print(f"\nMigration complete: {done}/{len(json_files)} files migrated "
+          f"in {time.monotonic() - started:.1f}s")
+    if results.get('conflict') or results.get('error'):
+        print(f"{results.get('conflict', 0)} conflict(s), {results.get('error', 0)} error(s): "
+              "those files were left in place; re-run after fixing them")
+
+    if args.rollups and done:
+        from rollups import backfill
+        print("\nRebuilding rollups...")
+        records = backfill(args.data_dir, os.path.join(args.data_dir, 'rollups'))
+        print(f"Rolled up {records} records")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
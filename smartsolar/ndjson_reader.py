@@ -0,0 +1,152 @@
+"""
+Streaming readers for the daily NDJSON data files.
+
+The tail readers seek backwards from the end of a file and only parse the
+lines they return, so their cost does not grow with the size of the file.
+"""
+import glob
+import json
+import logging
+import os
+import re
+from archive import ArchiveReader, archive_path_for, list_archived_dates
+
+logger = logging.getLogger(__name__)
+
+DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+TAIL_BLOCK_SIZE = 8192
+
+def is_valid_date(date_str):
+    """Check a YYYY-MM-DD date string (also keeps paths inside the data dir)."""
+    return bool(DATE_PATTERN.match(date_str))
+
+def data_file_for_date(data_dir, date_str):
+    """Path of the NDJSON file for a date."""
+    return os.path.join(data_dir, f"data_{date_str}.ndjson")
+
+def list_data_files(data_dir):
+    """NDJSON data files, oldest first (file names sort by date)."""
+    return sorted(glob.glob(os.path.join(data_dir, "data_*.ndjson")))
+
+def list_dates(data_dir):
+    """Dates that have a data file, oldest first."""
+    dates = []
+    for path in list_data_files(data_dir):
+        date_str = os.path.basename(path)[len("data_"):-len(".ndjson")]
+        if is_valid_date(date_str):
+            dates.append(date_str)
+    return dates
+
+def _parse_line(line):
+    """Parse one NDJSON line, returning None for blank or corrupt lines."""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        return json.loads(line)
+    except ValueError:
+        logger.debug(f"Skipping unparseable line: {line[:80]!r}")
+        return None
+
+def _looks_complete(line):
+    """Cheap check that a stripped line is a whole JSON object.
+
+    The writer newline-terminates a line torn by a crash, so a torn line is a
+    prefix of a record: it either does not end with '}' or closes fewer braces
+    than it opens. Only lines this cannot vouch for are parsed.
+    """
+    if line[:1] != b'{' or line[-1:] != b'}':
+        return False
+    return line.count(b'{') == line.count(b'}') or _parse_line(line) is not None
+
+def iter_lines(path):
+    """Yield complete JSON object lines (without newline) from a data file.
+
+    The last line is skipped if it is still being written (no trailing newline).
+    Lines are checked without parsing them (see _looks_complete()).
+    """
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            line = line.strip()
+            if line and _looks_complete(line):
+                yield line.decode('utf-8')
+
+def iter_records(path):
+    """Yield parsed records from a data file, oldest first."""
+    with open(path, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            record = _parse_line(line)
+            if record is not None:
+                yield record
+
+def tail_records(path, n, block_size=TAIL_BLOCK_SIZE):
+    """Return the last n records of a data file, oldest first.
+
+    Reads backwards from the end of the file in blocks, parsing complete
+    lines as they are found, until n records have parsed (blank or corrupt
+    lines do not count) or the start of the file is reached.
+    """
+    if n <= 0:
+        return []
+
+    records = []   # newest first
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        head = b''          # start of the oldest line seen so far, before `pos`
+        found_end = False   # whether the last complete line has been found
+
+        while pos > 0 and len(records) < n:
+            read_size = min(block_size, pos)
+            pos -= read_size
+            f.seek(pos)
+            buffer = f.read(read_size) + head
+            if not found_end:
+                # Whatever follows the last newline is still being written
+                last = buffer.rfind(b'\n')
+                if last < 0:
+                    head = buffer
+                    continue
+                buffer = buffer[:last]
+                found_end = True
+            lines = buffer.split(b'\n')
+            # The first line may have started before `pos`
+            head = lines.pop(0) if pos > 0 else b''
+            for line in reversed(lines):
+                record = _parse_line(line)
+                if record is not None:
+                    records.append(record)
+                    if len(records) >= n:
+                        break
+
+    records.reverse()
+    return records
+
+def tail_across_files(data_dir, n):
+    """Return the last n records across all days, newest first.
+
+    Days that only exist in the columnar archive (archive.py) are read from there.
+    """
+    results = []
+    dates = sorted(set(list_dates(data_dir)) | set(list_archived_dates(data_dir)), reverse=True)
+    for date_str in dates:
+        if len(results) >= n:
+            break
+        wanted = n - len(results)
+        path = data_file_for_date(data_dir, date_str)
+        try:
+            if os.path.exists(path):
+                records = tail_records(path, wanted)
+            else:
+                path = archive_path_for(data_dir, date_str)
+                records = ArchiveReader(path).records()[-wanted:]
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read {path}: {e}")
+            continue
+        results.extend(reversed(records))
+    return results
@@ -0,0 +1,267 @@
+"""
+Compact typed readings for decoded advertisements.
+
+Each victron_ble device data class (SolarChargerData, BatteryMonitorData, ...)
+gets a Reading subclass with one __slots__ attribute per field, built the
+first time that model is seen. Per type, the code that fills a reading from
+the parser's data and the code that serializes it to an NDJSON line are
+generated once, with the field names and JSON keys baked in, instead of
+reflecting over the parsed object and going through nested dicts and
+json.dumps for every advertisement.
+
+Lines written from readings carry the schema version first, and put the
+timestamp and device address at fixed positions:
+
+    {"v":2,"timestamp":"...","device_address":"...","device_name":"...",
+     "parsed_data":{...},"raw_data":"...","record_policy":"change"}
+
+Otherwise they are the same records as before (schema 1, no "v"), so all
+readers keep working. decode_line() lets readers skip lines by time and
+device without parsing them.
+
+Readings answer get() for the record keys (timestamp, device_address,
+device_name, parsed_data, raw_data, record_policy), so the recording filter,
+rollups and writer handle them like record dicts.
+"""
+import json
+import logging
+import math
+from enum import Enum
+from json.encoder import encode_basestring_ascii
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 2
+
+_V2_PREFIX = b'{"v":%d,"timestamp":"' % SCHEMA_VERSION
+_ADDRESS_KEY = b',"device_address":"'
+
+_MISSING = object()
+
+# Values stored as they are; anything else is checked for being an enum
+# (isinstance against Enum is comparatively slow, so plain values skip it)
+_PLAIN_TYPES = frozenset((float, int, str, bool))
+
+def _json_float(value):
+    # Same output as json.dumps: repr, or NaN/Infinity for non-finite values
+    if math.isfinite(value):
+        return float.__repr__(value)
+    if value != value:
+        return 'NaN'
+    return 'Infinity' if value > 0 else '-Infinity'
+
+def json_value(value):
+    """JSON text for a field value, as json.dumps would write it."""
+    cls = value.__class__
+    if cls is float:
+        return _json_float(value)
+    if cls is int:
+        return int.__repr__(value)
+    if cls is str:
+        return encode_basestring_ascii(value)
+    if value is None:
+        return 'null'
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    return json.dumps(value, separators=(',', ':'))
+
+class Reading:
+    """One decoded advertisement; subclasses add a slot per model field."""
+
+    __slots__ = ('timestamp', 'device_address', 'device_name', 'raw', 'record_policy', '_parsed')
+    model = None
+    fields = ()
+
+    def get(self, key, default=None):
+        """Record-style access, for code that handles record dicts."""
+        if key == 'parsed_data':
+            return self.parsed_data
+        if key == 'raw_data':
+            return self.raw.hex() if self.raw is not None else default
+        if key in ('timestamp', 'device_address', 'device_name', 'record_policy'):
+            value = getattr(self, key)
+            return default if value is None else value
+        if key == 'v':
+            return SCHEMA_VERSION
+        return default
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key != 'record_policy':
+            raise KeyError(f"{type(self).__name__} only accepts record_policy")
+        self.record_policy = value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    @property
+    def parsed_data(self):
+        """Field values as a dict (built once, on first use)."""
+        if self._parsed is None:
+            self._parsed = {name: getattr(self, name) for name in self.fields}
+        return self._parsed
+
+    def to_dict(self):
+        """The record dict this reading is written as."""
+        record = {'v': SCHEMA_VERSION, 'timestamp': self.timestamp, 'device_address': self.device_address,
+                  'device_name': self.device_name, 'parsed_data': dict(self.parsed_data)}
+        if self.raw is not None:
+            record['raw_data'] = self.raw.hex()
+        if self.record_policy is not None:
+            record['record_policy'] = self.record_policy
+        return record
+
+    def encode(self):
+        """The NDJSON line (bytes, with newline) for this reading."""
+        return (self.to_json() + '\n').encode('ascii')
+
+    def __repr__(self):
+        values = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.fields)
+        return f"{type(self).__name__}({values})"
+
+def _compile(source, name, namespace):
+    code = compile(source, f"<readings:{name}>", 'exec')
+    exec(code, namespace)
+
+def make_reading_type(model, fields):
+    """Reading subclass for a model with the given field names (in order)."""
+    fields = tuple(fields) + ('model_id',)
+    for field in fields:
+        if not field.isidentifier() or field in Reading.__slots__ or field.startswith('_'):
+            raise ValueError(f"Field {field!r} of {model} cannot be a reading attribute")
+    name = f"{model}Reading"
+    cls = type(name, (Reading,), {'__slots__': fields, 'model': model, 'fields': fields})
+
+    namespace = {'Enum': Enum, 'new': object.__new__, 'enc': encode_basestring_ascii,
+                 'val': json_value, 'PLAIN': _PLAIN_TYPES}
+
+    # from_data: copy the parser's values, enums as their names (as parse_victron_data does)
+    lines = ["def from_data(cls, timestamp, device_address, device_name, data, model_id, raw):",
+             "    r = new(cls)",
+             "    r.timestamp = timestamp",
+             "    r.device_address = device_address",
+             "    r.device_name = device_name",
+             "    r.raw = raw",
+             "    r.record_policy = None",
+             "    r._parsed = None",
+             "    r.model_id = model_id"]
+    for field in fields[:-1]:
+        lines.append(f"    v = data[{field!r}]")
+        lines.append(f"    r.{field} = v if v is None or v.__class__ in PLAIN else "
+                     f"(v.name if isinstance(v, Enum) else v)")
+    lines.append("    return r")
+    _compile('\n'.join(lines), name, namespace)
+
+    # to_json: one concatenation with the keys as constants
+    parts = ["'{\"v\":%d,\"timestamp\":' + enc(self.timestamp)" % SCHEMA_VERSION,
+             "',\"device_address\":' + (enc(self.device_address) if self.device_address is not None else 'null')",
+             "',\"device_name\":' + (enc(self.device_name) if self.device_name is not None else 'null')"]
+    for i, field in enumerate(fields):
+        key = json.dumps(field)
+        prefix = ',"parsed_data":{' if i == 0 else ','
+        parts.append(f"{json.dumps(prefix + key + ':')} + val(self.{field})")
+    lines = ["def to_json(self):",
+             "    tail = '}'",
+             "    if self.raw is not None:",
+             "        tail += ',\"raw_data\":\"' + self.raw.hex() + '\"'",
+             "    if self.record_policy is not None:",
+             "        tail += ',\"record_policy\":' + enc(self.record_policy)",
+             "    return (" + '\n            + '.join(parts) + " + tail + '}')"]
+    _compile('\n'.join(lines), name, namespace)
+
+    cls.from_data = classmethod(namespace['from_data'])
+    cls.to_json = namespace['to_json']
+    cls.field_count = len(fields) - 1
+    return cls
+
+# Reading type per parser data class, and per (data class, fields) for models
+# whose fields vary (e.g. battery monitors with different aux inputs)
+_types = {}
+_types_by_fields = {}
+
+def _reading_type(data_class, data):
+    """Reading subclass for a data class with exactly the fields in `data`."""
+    key = (data_class, tuple(data))
+    cls = _types_by_fields.get(key)
+    if cls is None:
+        model = data_class.__name__
+        if model.endswith('Data'):
+            model = model[:-len('Data')]
+        try:
+            cls = make_reading_type(model, data)
+        except ValueError as e:
+            logger.warning(f"Cannot build a reading type: {e}")
+            return None
+        _types_by_fields[key] = cls
+    _types[data_class] = cls
+    return cls
+
+def reading_from_parsed(parsed_obj, timestamp, device_address, device_name, raw=None):
+    """Reading for a victron_ble parsed data object, or None if it has no usable fields."""
+    data = getattr(parsed_obj, '_data', None)
+    if not isinstance(data, dict):
+        return None
+    model_id = getattr(parsed_obj, '_model_id', None)
+    data_class = type(parsed_obj)
+
+    # Usually the data class's last type fits; a different field set shows up
+    # as a different count or a missing key
+    cls = _types.get(data_class)
+    if cls is not None and len(data) == cls.field_count:
+        try:
+            return cls.from_data(timestamp, device_address, device_name, data, model_id, raw)
+        except KeyError:
+            pass
+    cls = _reading_type(data_class, data)
+    if cls is None:
+        return None
+    return cls.from_data(timestamp, device_address, device_name, data, model_id, raw)
+
+def peek(raw):
+    """(timestamp, device_address) of a schema 2 line without parsing it, or None."""
+    if not raw.startswith(_V2_PREFIX):
+        return None
+    start = len(_V2_PREFIX)
+    end = raw.find(b'"', start)
+    if end < 0:
+        return None
+    timestamp = raw[start:end].decode('ascii')
+    address = None
+    if raw.startswith(_ADDRESS_KEY, end + 1):
+        address_start = end + 1 + len(_ADDRESS_KEY)
+        address_end = raw.find(b'"', address_start)
+        address = raw[address_start:address_end].decode('ascii')
+    return timestamp, address
+
+def decode_line(raw, device=None, from_ts=None, to_ts=None):
+    """Record dict for an NDJSON line (any schema version), or None if the
+    line is unparseable or outside the device / time range (inclusive,
+    compared on 'YYYY-MM-DDTHH:MM:SS').
+
+    Schema 2 lines are checked against the filters before being parsed.
+    """
+    head = peek(raw)
+    if head is not None:
+        if device and head[1] != device:
+            return None
+        if from_ts is not None and not from_ts <= head[0][:19] <= to_ts:
+            return None
+    try:
+        record = json.loads(raw)
+    except ValueError:
+        return None
+    if not isinstance(record, dict):
+        return None
+    if head is None:
+        if device and record.get('device_address') != device:
+            return None
+        if from_ts is not None and not from_ts <= (record.get('timestamp') or '')[:19] <= to_ts:
+            return None
+    return record
@@ -0,0 +1,114 @@
+"""
+Change-based recording: drop readings that say nothing new.
+
+A reading is stored when any numeric field has moved more than its deadband
+from the last stored value, when any other field (charge_state, errors,
+...) has changed, or when the device's heartbeat is due. Stored readings
+carry a `record_policy` of "change" or "heartbeat" (STEP_POLICIES); readers
+should treat such records as a step function, each value holding until the
+next record (rollups integrate energy that way).
+
+Configuration:
+    RECORD_POLICY       deadband (default) or all (store every reading)
+    DEADBAND_<FIELD>    deadband for one parsed_data field, e.g. DEADBAND_BATTERY_VOLTAGE=0.05
+    RECORD_HEARTBEAT    minutes after which a reading is stored regardless (default 10, max 60)
+"""
+import logging
+import os
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+RECORD_POLICIES = ('deadband', 'all')
+
+# record_policy values meaning "this value held until the next record"
+STEP_POLICIES = ('change', 'heartbeat')
+
+# Defaults sized to the sensors' noise; unlisted numeric fields record any change
+DEFAULT_DEADBANDS = {
+    'battery_voltage': 0.02,
+    'battery_charging_current': 0.1,
+    'solar_power': 2,
+    'external_device_load': 0.1,
+}
+
+# Rollups hold a stepped value for at most this long, so heartbeats must be shorter
+MAX_HEARTBEAT_MINUTES = 60
+
+def load_deadbands():
+    """Default deadbands overridden by DEADBAND_<FIELD> environment variables."""
+    deadbands = dict(DEFAULT_DEADBANDS)
+    for key, value in os.environ.items():
+        if not key.startswith('DEADBAND_'):
+            continue
+        field = key[len('DEADBAND_'):].lower()
+        try:
+            deadbands[field] = abs(float(value))
+        except ValueError:
+            logger.warning(f"Ignoring {key}={value!r}: not a number")
+    return deadbands
+
+def _epoch(timestamp):
+    try:
+        parsed = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+class DeadbandFilter:
+    """Decides per reading whether it is stored, and under which policy."""
+
+    def __init__(self, deadbands=None, heartbeat=600.0):
+        self.deadbands = deadbands if deadbands is not None else dict(DEFAULT_DEADBANDS)
+        self.heartbeat = heartbeat
+        self._last = {}   # device -> (epoch seconds, parsed_data) of the last stored reading
+        self.stored = 0
+        self.dropped = 0
+
+    def check(self, record):
+        """Policy to store the record under, or None to drop it.
+
+        Records without parsed_data (GATT readings) are not filtered: "all".
+        """
+        parsed_data = record.get('parsed_data')
+        device = record.get('device_address')
+        if not parsed_data or not device:
+            return 'all'
+        timestamp = _epoch(record.get('timestamp'))
+
+        last = self._last.get(device)
+        if last is None or timestamp is None or last[0] is None or self._changed(last[1], parsed_data):
+            policy = 'change'
+        elif timestamp - last[0] >= self.heartbeat or timestamp < last[0]:
+            policy = 'heartbeat'
+        else:
+            self.dropped += 1
+            return None
+
+        self._last[device] = (timestamp, parsed_data)
+        self.stored += 1
+        return policy
+
+    def _changed(self, previous, current):
+        if previous.keys() != current.keys():
+            return True
+        for key, value in current.items():
+            old = previous[key]
+            if _is_number(value) and _is_number(old):
+                if abs(value - old) > self.deadbands.get(key, 0):
+                    return True
+            elif value != old:
+                return True
+        return False
+
+    def stats_summary(self):
+        """Stored/dropped counts since the last call, for periodic logging."""
+        summary = f"{self.stored} stored, {self.dropped} within deadband"
+        self.stored = 0
+        self.dropped = 0
+        return summary
@@ -0,0 +1,79 @@
+"""
+HTTP caching helpers for the dashboard's historical data endpoints.
+
+Closed days never change, so their serialized (and gzipped) responses are
+kept in a small in-process LRU cache with a memory cap, and clients get
+validators (ETag/Last-Modified) plus long-lived cache headers.
+"""
+import gzip
+import threading
+import zlib
+from collections import OrderedDict
+
+# Responses smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+def etag_for_stat(st):
+    """Weak validator for a file version (the body is derived from the file)."""
+    return f'W/"{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+def accepts_gzip(request):
+    """Whether the client accepts gzip-encoded responses."""
+    return 'gzip' in request.headers.get('Accept-Encoding', '')
+
+def gzip_bytes(body):
+    """Compress a whole response body."""
+    return gzip.compress(body, compresslevel=6)
+
+def gzip_stream(chunks):
+    """Compress a streamed response body on the fly."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+class ResponseCache:
+    """Thread-safe LRU cache of serialized responses, bounded by total bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # key -> (body, gzipped body or None)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Cached (body, gzipped body) for key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, gzipped=None):
+        """Cache a response; entries larger than the whole cache are not kept."""
+        size = len(body) + (len(gzipped) if gzipped else 0)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[0]) + (len(old[1]) if old[1] else 0)
+            self._entries[key] = (body, gzipped)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (old_body, old_gz) = self._entries.popitem(last=False)
+                self._size -= len(old_body) + (len(old_gz) if old_gz else 0)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._size,
+                    'max_bytes': self.max_bytes, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+Incremental minute/hour/day rollups of the collected readings.
+
+For every device and every numeric field in parsed_data, each bucket keeps
+min/max/mean/last/count, plus the solar energy (Wh) integrated from
+solar_power (trapezoidal, or as a step function for records stored by the
+deadband filter) and split across the buckets each interval covers. The
+collector's writer feeds the engine as it writes, and closed buckets are
+appended to one compact NDJSON file per period:
+
+    rollups/minute/YYYY-MM-DD.ndjson
+    rollups/hour/YYYY-MM.ndjson
+    rollups/day/YYYY.ndjson
+
+Each line looks like:
+
+    {"t":"2025-05-26T10:00:00+00:00","device_address":"DF:C9:B0:6E:3F:EF",
+     "device_name":"SmartSolar HQ2231ABCDE","n":60,"energy_wh":12.5,
+     "f":{"battery_voltage":[12.8,13.1,12.95,13.0,60]}}
+
+where each field is [min, max, mean, last, count] or, for values recorded
+by the deadband filter, [min, max, mean, last, count, seconds held].
+
+Records stored by the deadband filter (record_policy "change"/"heartbeat")
+are a step function: each value holds until the device's next record, for
+at most MAX_HOLD_GAP. Their buckets get the held value's min/max, a mean
+weighted by how long each value held, and buckets without a record of their
+own (count 0) are still written while a value holds through them. Other
+records (RECORD_POLICY=all, older data) are averaged per record.
+
+A bucket can appear more than once (e.g. a partial bucket written at
+shutdown and the rest after the restart); readers merge such lines.
+
+To build rollups from existing history:
+
+    python3 rollups.py --backfill
+"""
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timezone, timedelta
+from glob import glob
+from archive import ArchiveReader, archive_path_for, list_archived_dates
+from recording_filter import STEP_POLICIES
+
+logger = logging.getLogger(__name__)
+
+RESOLUTIONS = {
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400,
+}
+
+# Longest gap between two solar_power samples that is still integrated
+MAX_ENERGY_GAP = 15 * 60
+
+# Longest a deadband-filtered value is held (the filter's heartbeat is shorter)
+MAX_HOLD_GAP = 60 * 60
+
+def period_for(resolution, bucket_start):
+    """Name of the rollup file a bucket belongs to."""
+    dt = datetime.fromtimestamp(bucket_start, timezone.utc)
+    if resolution == 'minute':
+        return dt.strftime('%Y-%m-%d')
+    if resolution == 'hour':
+        return dt.strftime('%Y-%m')
+    return dt.strftime('%Y')
+
+def parse_timestamp(timestamp):
+    """Epoch seconds from an ISO timestamp string, or None."""
+    try:
+        parsed = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+def numeric_fields(parsed_data):
+    """(name, value) pairs for the numeric fields of a reading."""
+    for key, value in parsed_data.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield key, value
+
+class _Bucket:
+    """Running aggregates for one device in one time bucket."""
+
+    __slots__ = ('start', 'device_name', 'count', 'fields', 'energy_wh')
+
+    def __init__(self, start, device_name):
+        self.start = start
+        self.device_name = device_name
+        self.count = 0
+        self.fields = {}        # name -> [min, max, sum, last, count, held sum, seconds held, stepped]
+        self.energy_wh = 0.0
+
+    def _stats(self, key, value):
+        stats = self.fields.get(key)
+        if stats is None:
+            stats = self.fields[key] = [value, value, 0.0, value, 0, 0.0, 0.0, False]
+        elif value < stats[0]:
+            stats[0] = value
+        elif value > stats[1]:
+            stats[1] = value
+        stats[3] = value
+        return stats
+
+    def add(self, values, step=False):
+        """A record's numeric values, at an instant inside the bucket."""
+        self.count += 1
+        for key, value in values.items():
+            stats = self._stats(key, value)
+            stats[2] += value
+            stats[4] += 1
+            stats[7] = stats[7] or step
+
+    def hold(self, values, seconds):
+        """Values that held for `seconds` of the bucket."""
+        for key, value in values.items():
+            stats = self._stats(key, value)
+            stats[5] += value * seconds
+            stats[6] += seconds
+            stats[7] = True
+
+    def to_line(self, device_address):
+        fields = {}
+        for key, s in self.fields.items():
+            if s[6] > 0:
+                fields[key] = [s[0], s[1], round(s[5] / s[6], 4), s[3], s[4], round(s[6], 3)]
+            elif s[7]:
+                # Recorded by the deadband filter, but not held yet
+                fields[key] = [s[0], s[1], round(s[2] / s[4], 4), s[3], s[4], 0]
+            else:
+                fields[key] = [s[0], s[1], round(s[2] / s[4], 4), s[3], s[4]]
+        entry = {
+            't': datetime.fromtimestamp(self.start, timezone.utc).isoformat(),
+            'device_address': device_address,
+            'device_name': self.device_name,
+            'n': self.count,
+            'energy_wh': round(self.energy_wh, 4),
+            'f': fields,
+        }
+        return json.dumps(entry, separators=(',', ':')) + '\n'
+
+class RollupEngine:
+    """Maintains open buckets per device and resolution and persists closed ones."""
+
+    def __init__(self, rollup_dir, resolutions=tuple(RESOLUTIONS)):
+        self.rollup_dir = rollup_dir
+        self.resolutions = resolutions
+        self._open = {}          # (resolution, device) -> {bucket start: _Bucket}
+        self._current = {}       # (resolution, device) -> start of the newest record's bucket
+        self._held = {}          # device -> (epoch seconds, numeric values) of its last stepped record
+        self._last_power = {}    # device -> (epoch seconds, solar_power, stepped)
+        self._closed = []        # (resolution, period, line) waiting to be written
+
+    def add(self, record):
+        """Fold one reading into the open buckets."""
+        parsed_data = record.get('parsed_data')
+        device = record.get('device_address')
+        if not parsed_data or not device:
+            return
+        timestamp = parse_timestamp(record.get('timestamp'))
+        if timestamp is None:
+            return
+        device_name = record.get('device_name')
+        values = dict(numeric_fields(parsed_data))
+        step = record.get('record_policy') in STEP_POLICIES
+
+        # The previous stepped value held until now
+        held = self._held.get(device)
+        in_order = held is None or timestamp >= held[0]
+        if held is not None and in_order:
+            end = min(timestamp, held[0] + MAX_HOLD_GAP)
+            self._spread(device, device_name, held[0], end,
+                         lambda bucket, start, stop: bucket.hold(held[1], stop - start))
+        if in_order:
+            if step:
+                self._held[device] = (timestamp, values)
+            else:
+                self._held.pop(device, None)
+
+        interval = self._power_interval(device, timestamp, parsed_data.get('solar_power'), step)
+        if interval is not None:
+            self._spread(device, device_name, interval[0], interval[2],
+                         lambda bucket, start, stop: self._add_energy(bucket, interval, start, stop))
+
+        for resolution in self.resolutions:
+            self._bucket(resolution, device, timestamp, device_name).add(values, step)
+            self._advance(resolution, device, timestamp)
+
+    def _bucket(self, resolution, device, timestamp, device_name):
+        """Open bucket for a time; late times are folded into the newest bucket."""
+        size = RESOLUTIONS[resolution]
+        key = (resolution, device)
+        start = int(timestamp // size) * size
+        current = self._current.get(key)
+        if current is not None and start < current:
+            start = current
+        buckets = self._open.setdefault(key, {})
+        bucket = buckets.get(start)
+        if bucket is None:
+            bucket = buckets[start] = _Bucket(start, device_name)
+        elif device_name:
+            bucket.device_name = device_name
+        return bucket
+
+    def _advance(self, resolution, device, timestamp):
+        """Close the buckets before the one a new record falls in."""
+        size = RESOLUTIONS[resolution]
+        key = (resolution, device)
+        start = int(timestamp // size) * size
+        current = self._current.get(key)
+        if current is not None and start <= current:
+            return
+        self._current[key] = start
+        buckets = self._open.get(key, {})
+        for bucket_start in sorted(b for b in buckets if b < start):
+            self._close(resolution, device, buckets.pop(bucket_start))
+
+    def _spread(self, device, device_name, start, end, add):
+        """Call add(bucket, from, to) for each bucket piece of [start, end)."""
+        for resolution in self.resolutions:
+            size = RESOLUTIONS[resolution]
+            position = start
+            while position < end:
+                stop = min(end, (int(position // size) + 1) * size)
+                add(self._bucket(resolution, device, position, device_name), position, stop)
+                position = stop
+
+    def _power_interval(self, device, timestamp, power, step):
+        """(start, power, end, power) since the device's previous solar_power sample, or None.
+        
+        Deadband-filtered samples hold their value until the next one (left
+        step); unfiltered samples are integrated with the trapezoidal rule.
+        """
+        if not isinstance(power, (int, float)) or isinstance(power, bool):
+            return None
+        previous = self._last_power.get(device)
+        self._last_power[device] = (timestamp, power, step)
+        if previous is None:
+            return None
+        dt = timestamp - previous[0]
+        if dt <= 0 or dt > (MAX_HOLD_GAP if previous[2] else MAX_ENERGY_GAP):
+            return None
+        return previous[0], previous[1], timestamp, previous[1] if previous[2] else power
+
+    @staticmethod
+    def _add_energy(bucket, interval, start, stop):
+        """Add the energy (Wh) of the [start, stop) piece of a power interval."""
+        t0, p0, t1, p1 = interval
+        slope = (p1 - p0) / (t1 - t0)
+        power_start = p0 + slope * (start - t0)
+        power_stop = p0 + slope * (stop - t0)
+        bucket.energy_wh += (power_start + power_stop) / 2.0 * (stop - start) / 3600.0
+
+    def _close(self, resolution, device, bucket):
+        self._closed.append((resolution, period_for(resolution, bucket.start),
+                             bucket.to_line(device)))
+
+    def flush(self, final=False):
+        """Write closed buckets to disk; with final=True also write the open ones."""
+        if final:
+            for (resolution, device), buckets in self._open.items():
+                for start in sorted(buckets):
+                    self._close(resolution, device, buckets[start])
+            self._open = {}
+            self._current = {}
+            self._held = {}
+        if not self._closed:
+            return
+
+        by_file = {}
+        for resolution, period, line in self._closed:
+            by_file.setdefault((resolution, period), []).append(line)
+        for (resolution, period), lines in by_file.items():
+            path = rollup_path(self.rollup_dir, resolution, period)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(''.join(lines))
+        self._closed = []
+
+def rollup_path(rollup_dir, resolution, period):
+    """Path of a rollup file."""
+    return os.path.join(rollup_dir, resolution, f"{period}.ndjson")
+
+def merge_entries(older, newer):
+    """Combine two lines for the same device and bucket."""
+    fields = dict(older['f'])
+    for key, b in newer['f'].items():
+        a = fields.get(key)
+        if a is None:
+            fields[key] = b
+            continue
+        count = a[4] + b[4]
+        held_a, held_b = (a[5] if len(a) > 5 else 0), (b[5] if len(b) > 5 else 0)
+        held = held_a + held_b
+        if held:
+            # Time-weighted: lines without held time carry no weight
+            mean = (a[2] * held_a + b[2] * held_b) / held
+        else:
+            mean = (a[2] * a[4] + b[2] * b[4]) / count
+        merged = [min(a[0], b[0]), max(a[1], b[1]), round(mean, 4), b[3], count]
+        if len(a) > 5 or len(b) > 5:
+            merged.append(round(held, 3))
+        fields[key] = merged
+    return {
+        't': older['t'],
+        'device_address': older['device_address'],
+        'device_name': newer.get('device_name') or older.get('device_name'),
+        'n': older['n'] + newer['n'],
+        'energy_wh': round(older['energy_wh'] + newer['energy_wh'], 4),
+        'f': fields,
+    }
+
+def _periods_between(resolution, from_ts, to_ts):
+    """Rollup file names that can hold buckets between two ISO timestamps."""
+    if resolution == 'minute':
+        start = datetime.fromisoformat(from_ts[:10])
+        end = datetime.fromisoformat(to_ts[:10])
+        periods = []
+        while start <= end:
+            periods.append(start.strftime('%Y-%m-%d'))
+            start += timedelta(days=1)
+        return periods
+    if resolution == 'hour':
+        periods = []
+        year, month = int(from_ts[:4]), int(from_ts[5:7])
+        end = (int(to_ts[:4]), int(to_ts[5:7]))
+        while (year, month) <= end:
+            periods.append(f"{year:04d}-{month:02d}")
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return periods
+    return [str(year) for year in range(int(from_ts[:4]), int(to_ts[:4]) + 1)]
+
+def load_rollups(rollup_dir, resolution, from_ts, to_ts, device=None):
+    """Load merged rollup buckets between two ISO timestamps, ordered by time.
+
+    Bucket start times are compared as ISO strings truncated to seconds
+    (YYYY-MM-DDTHH:MM:SS), so a bucket is included if it starts in the range.
+    """
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Unknown resolution: {resolution}")
+    merged = {}
+    for period in _periods_between(resolution, from_ts, to_ts):
+        path = rollup_path(rollup_dir, resolution, period)
+        if not os.path.exists(path):
+            continue
+        with open(path, 'rb') as f:
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    break
+                try:
+                    entry = json.loads(raw)
+                except ValueError:
+                    continue
+                if device and entry.get('device_address') != device:
+                    continue
+                if not (from_ts <= entry['t'][:19] <= to_ts):
+                    continue
+                key = (entry['device_address'], entry['t'])
+                existing = merged.get(key)
+                merged[key] = entry if existing is None else merge_entries(existing, entry)
+    return sorted(merged.values(), key=lambda e: (e['t'], e['device_address']))
+
+def backfill(data_dir, rollup_dir, include_today=False):
+    """Rebuild rollups from the NDJSON and archived history.
+
+    Closed days are recomputed; buckets from today that the running collector
+    has already written are kept unless include_today is set.
+    """
+    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    cutoff = '9999' if include_today else today
+    days = {}
+    for date_str in list_archived_dates(data_dir):
+        days[date_str] = archive_path_for(data_dir, date_str)
+    for path in glob(os.path.join(data_dir, 'data_*.ndjson')):
+        days[os.path.basename(path)[len('data_'):-len('.ndjson')]] = path
+    files = [days[date_str] for date_str in sorted(days) if date_str < cutoff]
+
+    tmp_dir = rollup_dir + '.backfill'
+    if os.path.exists(tmp_dir):
+        _remove_tree(tmp_dir)
+    engine = RollupEngine(tmp_dir)
+    records = 0
+    for path in files:
+        if path.endswith('.col'):
+            for record in ArchiveReader(path).records():
+                engine.add(record)
+                records += 1
+        else:
+            with open(path, 'rb') as f:
+                for raw in f:
+                    if not raw.endswith(b'\n'):
+                        break
+                    try:
+                        engine.add(json.loads(raw))
+                    except ValueError:
+                        continue
+                    records += 1
+        engine.flush()
+        print(f"Rolled up {path}")
+    engine.flush(final=True)
+
+    # Keep live buckets from days that were not recomputed
+    for existing in glob(os.path.join(rollup_dir, '*', '*.ndjson')):
+        resolution = os.path.basename(os.path.dirname(existing))
+        kept = []
+        with open(existing, 'rb') as f:
+            for raw in f:
+                if raw.endswith(b'\n') and raw[6:16].decode('ascii', 'replace') >= cutoff:
+                    kept.append(raw.decode('utf-8'))
+        if kept:
+            target = rollup_path(tmp_dir, resolution, os.path.basename(existing)[:-len('.ndjson')])
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'a', encoding='utf-8') as f:
+                f.write(''.join(kept))
+
+    # Swap the rebuilt rollups into place
+    for resolution in RESOLUTIONS:
+        new_dir = os.path.join(tmp_dir, resolution)
+        old_dir = os.path.join(rollup_dir, resolution)
+        os.makedirs(new_dir, exist_ok=True)
+        os.makedirs(rollup_dir, exist_ok=True)
+        if os.path.exists(old_dir):
+            for name in os.listdir(old_dir):
+                if not os.path.exists(os.path.join(new_dir, name)):
+                    os.remove(os.path.join(old_dir, name))
+        else:
+            os.makedirs(old_dir)
+        for name in os.listdir(new_dir):
+            os.replace(os.path.join(new_dir, name), os.path.join(old_dir, name))
+    _remove_tree(tmp_dir)
+    return records
+
+def _remove_tree(path):
+    """Remove a (shallow) directory tree created by backfill."""
+    for root, dirs, files in os.walk(path, topdown=False):
+        for name in files:
+            os.remove(os.path.join(root, name))
+        for name in dirs:
+            os.rmdir(os.path.join(root, name))
+    os.rmdir(path)
+
+def main():
+    data_dir = os.environ.get('DATA_DIR', '/data/smartsolar-v1')
+    rollup_dir = os.path.join(data_dir, 'rollups')
+
+    if '--backfill' not in sys.argv[1:]:
+        print("Usage: python3 rollups.py --backfill [--include-today]")
+        return
+
+    records = backfill(data_dir, rollup_dir, include_today='--include-today' in sys.argv[1:])
+    print(f"\nBackfill complete: {records} readings rolled up into {rollup_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Per-device sampling rates for recorded advertisements.
+
+Each device has a target interval (SAMPLE_INTERVAL_<MAC>, default the
+collection interval). An advertisement is let through when its device is
+due; the next due time then moves along a fixed grid on monotonic time
+(anchor + k * interval), so late arrivals do not make the rate drift.
+"""
+import logging
+import math
+import os
+import time
+from key_manager import normalize_address
+
+logger = logging.getLogger(__name__)
+
+# Shortest per-device interval accepted (Victron devices advertise about once a second)
+MIN_SAMPLE_INTERVAL = 0.5
+
+# An advertisement this fraction of an interval early still counts as on time,
+# so jitter in the advertising period does not skip whole samples
+EARLY_TOLERANCE = 0.1
+
+def load_sample_intervals():
+    """Per-device intervals from SAMPLE_INTERVAL_<MAC> environment variables.
+
+    Same naming as SMARTSOLAR_KEY_<MAC>: colons replaced with underscores.
+    """
+    intervals = {}
+    for key, value in os.environ.items():
+        if not key.startswith('SAMPLE_INTERVAL_'):
+            continue
+        address = normalize_address(key.replace('SAMPLE_INTERVAL_', '').replace('_', ':'))
+        try:
+            interval = float(value)
+        except ValueError:
+            logger.warning(f"Ignoring {key}={value!r}: not a number of seconds")
+            continue
+        if interval < MIN_SAMPLE_INTERVAL:
+            logger.warning(f"{key} too low ({interval}), setting to {MIN_SAMPLE_INTERVAL} seconds")
+            interval = MIN_SAMPLE_INTERVAL
+        intervals[address] = interval
+        logger.info(f"Sampling {address} every {interval:g}s")
+    return intervals
+
+class SampleScheduler:
+    """Decides which advertisements to record, per device, on a drift-free grid."""
+
+    def __init__(self, default_interval, intervals=None):
+        self.default_interval = default_interval
+        self.intervals = dict(intervals or {})
+        self._next_due = {}   # address -> monotonic time the next sample is due
+        self.accepted = 0
+        self.dropped = 0
+
+    def interval_for(self, address):
+        return self.intervals.get(address, self.default_interval)
+
+    def due(self, address, now=None):
+        """Whether a sample of `address` arriving now should be recorded (and claim the slot)."""
+        if now is None:
+            now = time.monotonic()
+        interval = self.interval_for(address)
+        next_due = self._next_due.get(address)
+        if next_due is None:
+            # First sample anchors the device's grid
+            self._next_due[address] = now + interval
+            self.accepted += 1
+            return True
+        if now < next_due - EARLY_TOLERANCE * interval:
+            self.dropped += 1
+            return False
+        # Advance to the first grid point after this sample, skipping missed slots
+        slots = max(1, math.floor((now - next_due) / interval) + 1)
+        self._next_due[address] = next_due + slots * interval
+        self.accepted += 1
+        return True
+
+    def stats_summary(self):
+        """Accepted/dropped counts since the last call, for periodic logging."""
+        summary = f"{self.accepted} recorded, {self.dropped} rate-limited"
+        self.accepted = 0
+        self.dropped = 0
+        return summary
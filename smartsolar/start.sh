@@ -4,9 +4,15 @@
 # Environment variable DBUS_SYSTEM_BUS_ADDRESS is set in docker-compose.yml
 
 # Start the dashboard in the background
-echo "Starting dashboard on port 80..."
-python3 dashboard.py &
+# DASHBOARD_SERVER=flask runs the development server instead of gunicorn
+echo "Starting dashboard on port ${DASHBOARD_PORT:-80}..."
+if [ "${DASHBOARD_SERVER:-gunicorn}" = "flask" ]; then
+    python3 dashboard.py &
+else
+    gunicorn -c gunicorn.conf.py wsgi:app &
+fi
 
 # Start the main data collection service
+# exec so the collector receives SIGTERM directly and can flush buffered data
 echo "Starting SmartSolar data collection..."
-python3 main.py 
\ No newline at end of file
+exec python3 main.py 
\ No newline at end of file
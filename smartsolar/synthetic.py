@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Synthetic encrypted Victron SolarCharger advertisements.
+
+Builds advertisements the way the devices do (AES-CTR with the device key,
+nonce in the header, key check byte) so the whole decode and storage path
+can be exercised without hardware. Output is a capture file for the replay
+source, plus a keys file so the collector can decrypt it:
+
+    python3 synthetic.py --devices 3 --duration 3600 --output /tmp/capture.ndjson \\
+        --keys-file /tmp/keys.json
+    DATA_DIR=/tmp/ss-data KEYS_FILE=/tmp/keys.json ADVERT_SOURCE=replay \\
+        REPLAY_FILE=/tmp/capture.ndjson REPLAY_SPEED=60 python3 main.py
+"""
+import argparse
+import json
+import math
+import os
+import random
+import struct
+from datetime import datetime, timedelta, timezone
+from Crypto.Cipher import AES
+from Crypto.Util import Counter
+from advert_source import capture_line, ReplayDevice, ReplayAdvertisement, VICTRON_MANUFACTURER_ID
+
+# Header: record prefix, model id (SmartSolar MPPT 75/15), readout type 0x01 (solar charger)
+PREFIX = 0x0010
+MODEL_ID = 0xA053
+READOUT_SOLAR_CHARGER = 0x01
+
+# victron_ble OperationMode values
+CHARGE_OFF, CHARGE_BULK, CHARGE_ABSORPTION, CHARGE_FLOAT = 0, 3, 4, 5
+
+def encrypt_advert(key_hex, nonce, plaintext, model_id=MODEL_ID, readout_type=READOUT_SOLAR_CHARGER):
+    """Manufacturer payload for `plaintext`, encrypted like a Victron device does."""
+    key = bytes.fromhex(key_hex)
+    counter = Counter.new(128, initial_value=nonce, little_endian=True)
+    encrypted = AES.new(key, AES.MODE_CTR, counter=counter).encrypt(plaintext)
+    header = struct.pack('<HHBH', PREFIX, model_id, readout_type, nonce & 0xFFFF)
+    return header + bytes([key[0]]) + encrypted
+
+def solar_charger_plaintext(charge_state, error, voltage, current, yield_wh, power, load):
+    """SolarCharger record: fields packed LSB first, scaled as the device sends them."""
+    return struct.pack('<BBhhHHH', charge_state, error,
+                       round(voltage * 100), round(current * 10),
+                       min(0xFFFE, round(yield_wh / 10)), min(0xFFFE, round(power)),
+                       min(0x1FE, round(load * 10)))
+
+class SyntheticCharger:
+    """A charger on a clear day: solar power follows the sun, the battery follows the charge."""
+
+    def __init__(self, index, rng, peak_power=300.0):
+        self.address = ':'.join(f"{b:02X}" for b in [0xC0, 0xDE, 0x00, 0x00, index >> 8, index & 0xFF])
+        self.name = f"SmartSolar HQ{2200000 + index:07d}"
+        self.key = rng.randbytes(16).hex()
+        self.peak_power = peak_power * rng.uniform(0.8, 1.2)
+        self.nonce = rng.randrange(0x10000)
+        self.rng = rng
+        self.voltage = 12.6
+        self.yield_wh = 0.0
+        self.day = None
+
+    def reading(self, t, dt):
+        """Plaintext for the state at datetime t, advancing dt seconds."""
+        if t.date() != self.day:
+            self.day = t.date()
+            self.yield_wh = 0.0
+        hour = t.hour + t.minute / 60 + t.second / 3600
+        sun = max(0.0, math.sin(math.pi * (hour - 6) / 12))
+        power = max(0.0, self.peak_power * sun * self.rng.uniform(0.9, 1.0))
+        self.yield_wh += power * dt / 3600
+        if power > 5:
+            target = 14.4 if self.voltage < 14.3 else 13.8
+            self.voltage += (target - self.voltage) * 0.001 * dt
+        else:
+            self.voltage = max(12.0, self.voltage - 0.00001 * dt)
+        if power <= 5:
+            state = CHARGE_OFF
+        elif self.voltage < 14.2:
+            state = CHARGE_BULK
+        elif self.voltage < 14.35:
+            state = CHARGE_ABSORPTION
+        else:
+            state = CHARGE_FLOAT
+        current = power / self.voltage
+        return solar_charger_plaintext(state, 0, self.voltage, current, self.yield_wh, power, 0.0)
+
+    def advert(self, t, dt):
+        """Encrypted manufacturer payload for a new reading (new nonce)."""
+        self.nonce = (self.nonce + 1) & 0xFFFF
+        return encrypt_advert(self.key, self.nonce, self.reading(t, dt))
+
+def generate_adverts(devices=1, duration=3600, update_interval=1.0, repeats=1, start=None, seed=None):
+    """Yield (datetime, ReplayDevice, ReplayAdvertisement) in time order.
+
+    Each device produces a new reading every `update_interval` seconds and
+    broadcasts it `repeats` times, as real devices repeat unchanged payloads.
+    """
+    rng = random.Random(seed)
+    chargers = [SyntheticCharger(i, rng) for i in range(devices)]
+    start = start or datetime.now(timezone.utc).replace(microsecond=0)
+    step = update_interval / repeats
+    ticks = int(duration / update_interval)
+    for tick in range(ticks):
+        t = start + timedelta(seconds=tick * update_interval)
+        for charger in chargers:
+            payload = charger.advert(t, update_interval)
+            device = ReplayDevice(charger.address, charger.name)
+            for repeat in range(repeats):
+                advert = ReplayAdvertisement({VICTRON_MANUFACTURER_ID: payload},
+                                             -60 - rng.randrange(25), charger.name)
+                yield t + timedelta(seconds=repeat * step), device, advert
+
+def synthetic_keys(devices=1, seed=None):
+    """{address: key} for the devices generate_adverts() creates with the same seed."""
+    rng = random.Random(seed)
+    chargers = [SyntheticCharger(i, rng) for i in range(devices)]
+    return {c.address: c.key for c in chargers}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=1)
+    parser.add_argument('--duration', type=float, default=3600, help='seconds of adverts to generate')
+    parser.add_argument('--update-interval', type=float, default=1.0, help='seconds between new readings')
+    parser.add_argument('--repeats', type=int, default=1, help='broadcasts per reading')
+    parser.add_argument('--start', help='ISO start time (default: now)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', required=True, help='capture file to write')
+    parser.add_argument('--keys-file', help='write the device keys here (keys file format)')
+    args = parser.parse_args()
+
+    start = None
+    if args.start:
+        start = datetime.fromisoformat(args.start)
+        if start.tzinfo is None:
+            start = start.replace(tzinfo=timezone.utc)
+
+    count = 0
+    with open(args.output, 'w', encoding='utf-8') as f:
+        for t, device, advert in generate_adverts(args.devices, args.duration, args.update_interval,
+                                                  args.repeats, start, args.seed):
+            line = json.loads(capture_line(device, advert, advert.manufacturer_data[VICTRON_MANUFACTURER_ID]))
+            line['t'] = t.isoformat()
+            f.write(json.dumps(line, separators=(',', ':')) + '\n')
+            count += 1
+    print(f"Wrote {count} advertisement(s) from {args.devices} device(s) to {args.output}")
+
+    if args.keys_file:
+        keys = synthetic_keys(args.devices, args.seed)
+        tmp_file = args.keys_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'devices': keys}, f, indent=2)
+        os.replace(tmp_file, args.keys_file)
+        print(f"Wrote {len(keys)} key(s) to {args.keys_file}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import asyncio
+import json
+from advert_source import ReplaySource, read_capture
+from scheduler import SampleScheduler
+
+ADDRESS = 'AA:BB:CC:DD:EE:FF'
+
+def write_capture(path, seconds):
+    with open(path, 'w') as f:
+        for s in seconds:
+            f.write(json.dumps({'t': f"2025-05-26T10:{s // 60:02d}:{s % 60:02d}+00:00", 'address': ADDRESS,
+                                'name': 'SmartSolar', 'rssi': -70, 'data': '1000'}) + '\n')
+
+def replay(path, count, loop=False):
+    """captured_at of the first `count` replayed adverts, replayed as fast as possible."""
+    seen = []
+
+    async def run():
+        done = asyncio.Event()
+
+        def callback(device, advert):
+            seen.append(advert.captured_at)
+            if len(seen) >= count:
+                done.set()
+
+        source = ReplaySource(callback, path, speed=0, loop=loop)
+        await source.start()
+        await asyncio.wait_for(done.wait(), 5)
+        await source.stop()
+
+    asyncio.run(run())
+    return seen[:count]
+
+def test_read_capture_keeps_capture_time(tmp_path):
+    path = tmp_path / 'capture.ndjson'
+    write_capture(path, [0, 5])
+    (t0, _, advert0), (t1, _, advert1) = read_capture(path)
+    assert t1 - t0 == 5
+    assert (advert0.captured_at, advert1.captured_at) == (t0, t1)
+
+def test_looping_replay_continues_the_capture_clock(tmp_path):
+    path = tmp_path / 'capture.ndjson'
+    write_capture(path, [0, 1, 2])
+    times = replay(path, 6, loop=True)
+    assert all(b > a for a, b in zip(times, times[1:]))
+    assert times[3] - times[0] == 3
+
+def test_full_speed_replay_is_sampled_at_the_captured_rate(tmp_path):
+    # Ten minutes of adverts a second apart, replayed in well under a second
+    path = tmp_path / 'capture.ndjson'
+    write_capture(path, range(600))
+    scheduler = SampleScheduler(10)
+    kept = [t for t in replay(path, 600) if scheduler.due(ADDRESS, t)]
+    assert 59 <= len(kept) <= 61
+    assert all(b - a >= 9 for a, b in zip(kept, kept[1:]))
@@ -0,0 +1,40 @@
+import json
+import os
+import pytest
+import analytics
+from analytics import Analytics
+
+def write_day(data_dir, date_str, readings):
+    """readings: (seconds after midnight, solar_power, yield_today, charge_state)."""
+    with open(os.path.join(data_dir, f"data_{date_str}.ndjson"), 'w') as f:
+        for second, power, yield_today, state in readings:
+            f.write(json.dumps({
+                'timestamp': f"{date_str}T{second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d}+00:00",
+                'device_address': 'AA:AA:AA:AA:AA:01', 'device_name': 'Charger',
+                'parsed_data': {'solar_power': power, 'yield_today': yield_today,
+                                'battery_voltage': 12.5, 'charge_state': state}}) + '\n')
+
+def test_summary_without_numpy_raises(tmp_path, monkeypatch):
+    monkeypatch.setattr(analytics, 'np', None)
+    assert not analytics.available()
+    with pytest.raises(RuntimeError):
+        Analytics(str(tmp_path)).summary('2025-05-26', '2025-05-26')
+
+def test_closed_day_summary_and_memo(tmp_path):
+    pytest.importorskip('numpy')
+    # 100 W for an hour in 10 s steps, the counter reset once
+    readings = [(36000 + i * 10, 100.0, 50.0 + i // 36, 'bulk') for i in range(361)]
+    readings += [(39610, 100.0, 0.0, 'absorption'), (39620, 100.0, 5.0, 'absorption')]
+    write_day(tmp_path, '2025-05-26', readings)
+
+    result = Analytics(str(tmp_path)).summary('2025-05-26', '2025-05-26')
+    total = result[0]['total']
+    assert result[0]['device_address'] == 'AA:AA:AA:AA:AA:01'
+    assert total['samples'] == 363
+    assert total['energy_wh'] == pytest.approx(100.0 * 3620 / 3600, abs=0.01)
+    assert total['yield_wh'] == 10.0 + 5.0
+    assert total['yield_resets'] == 1
+    assert total['charge_state_s'] == {'bulk': 3610.0, 'absorption': 10.0}
+    assert os.path.exists(os.path.join(tmp_path, 'analytics', '2025-05-26.json'))
+    # A fresh instance answers from the disk memo
+    assert Analytics(str(tmp_path)).summary('2025-05-26', '2025-05-26') == result
@@ -0,0 +1,138 @@
+import json
+import math
+import os
+import subprocess
+import sys
+import pytest
+import archive
+from archive import (ArchiveReader, CODEC_LZMA, CODEC_ZLIB, archive_day, archive_path_for,
+                     canonical_checksum, encode_day, rejected_path_for)
+
+CHARGER = 'AA:AA:AA:AA:AA:01'
+MONITOR = 'AA:AA:AA:AA:AA:02'
+
+def day_records():
+    """Records of every shape a data file can hold."""
+    records = []
+    for i in range(50):
+        records.append({'v': 2, 'timestamp': f"2025-05-26T10:{i // 60:02d}:{i % 60:02d}.{i * 1000:06d}+00:00",
+                        'device_address': CHARGER, 'device_name': 'Charger',
+                        'parsed_data': {'battery_voltage': 12.5 + i / 100, 'solar_power': i,
+                                        'charge_state': 'bulk' if i < 30 else 'absorption',
+                                        'load_on': i % 2 == 0, 'model_id': 41043},
+                        'raw_data': bytes([i, 255 - i, 0]).hex(), 'record_policy': 'change'})
+    records += [
+        # Schema 1 line, no "v", no record policy, a field missing and one of mixed type
+        {'timestamp': '2025-05-26T09:00:00+00:00', 'device_address': CHARGER, 'device_name': 'Charger',
+         'parsed_data': {'battery_voltage': 12, 'charge_state': None}},
+        # Older files wrote timestamps without an offset
+        {'timestamp': '2025-05-26T09:00:01', 'device_address': CHARGER,
+         'parsed_data': {'battery_voltage': 12.1, 'alarm': ['low_voltage', 3]}},
+        # GATT fallback records carry characteristic readings instead of parsed data
+        {'timestamp': '2025-05-26T10:30:00+00:00', 'device_address': MONITOR, 'device_name': 'Monitor',
+         'readings': {'306b0002': '00040001de4a00'}},
+        {'timestamp': '2025-05-26T10:30:05+00:00', 'device_address': MONITOR, 'device_name': None,
+         'parsed_data': {}},
+        {'timestamp': '2025-05-26T10:29:59+00:00', 'device_address': MONITOR,
+         'parsed_data': {'state_of_charge': 87.5, 'note': 'line\nbreak "quoted" ☀'}},
+    ]
+    return records
+
+def by_time(records):
+    return sorted(records, key=lambda r: (r['device_address'], r['timestamp']))
+
+@pytest.mark.parametrize('codec', [CODEC_LZMA, CODEC_ZLIB])
+def test_records_round_trip(tmp_path, codec):
+    records = day_records()
+    path = tmp_path / 'data_2025-05-26.col'
+    path.write_bytes(encode_day(records, '2025-05-26', codec))
+    reader = ArchiveReader(str(path))
+    restored = reader.records()
+    assert by_time(restored) == by_time(records)
+    assert canonical_checksum(restored) == canonical_checksum(records)
+    assert reader.date == '2025-05-26'
+    assert sorted(reader.devices()) == [CHARGER, MONITOR]
+
+def test_typed_columns(tmp_path):
+    path = tmp_path / 'data_2025-05-26.col'
+    path.write_bytes(encode_day(day_records(), '2025-05-26'))
+    reader = ArchiveReader(str(path))
+    assert reader.column_type(CHARGER, 'solar_power') == 'int'
+    assert reader.column_type(CHARGER, 'charge_state') == 'enum'
+    assert reader.column_type(CHARGER, 'battery_voltage') == 'json'   # 12 next to 12.5
+    assert reader.column_type(MONITOR, 'state_of_charge') == 'float'
+    volts = reader.column(MONITOR, 'state_of_charge')
+    assert [v for v in volts if not math.isnan(v)] == [87.5]
+    # Rows are ordered by time, so a range is a slice
+    start, end = reader.row_range(CHARGER, '2025-05-26T10:00:10', '2025-05-26T10:00:19')
+    assert end - start == 10
+    selected = reader.records(CHARGER, '2025-05-26T10:00:10', '2025-05-26T10:00:19')
+    assert [r['parsed_data']['solar_power'] for r in selected] == list(range(10, 20))
+
+def test_archive_day_replaces_the_source_only_after_verifying(tmp_path):
+    records = day_records()
+    source = tmp_path / 'data_2025-05-26.ndjson'
+    source.write_text(''.join(json.dumps(r) + '\n' for r in records) + '{"partial')
+    (tmp_path / 'data_2025-05-26.ndjson.idx').write_text('{}')
+    count, _, _ = archive_day(str(tmp_path), '2025-05-26')
+    assert count == len(records)
+    assert not source.exists()
+    assert not (tmp_path / 'data_2025-05-26.ndjson.idx').exists()
+    assert by_time(ArchiveReader(archive_path_for(str(tmp_path), '2025-05-26')).records()) == by_time(records)
+    assert open(rejected_path_for(str(tmp_path), '2025-05-26')).read() == '{"partial\n'
+
+def test_archive_day_keeps_lines_it_cannot_archive(tmp_path):
+    records = day_records()
+    rejected = ['{"torn\n', '[1, 2]\n', '{"device_address": "AA:AA:AA:AA:AA:01"}\n',
+                '{"timestamp": "yesterday"}\n']
+    source = tmp_path / 'data_2025-05-26.ndjson'
+    source.write_text(''.join(json.dumps(r) + '\n' for r in records[:10]) + ''.join(rejected) + '\n'
+                      + ''.join(json.dumps(r) + '\n' for r in records[10:]))
+    count, _, _ = archive_day(str(tmp_path), '2025-05-26')
+    assert count == len(records)
+    assert open(rejected_path_for(str(tmp_path), '2025-05-26')).read() == ''.join(rejected)
+
+def test_command_line_archives_the_days_given(tmp_path):
+    for date_str in ('2025-05-25', '2025-05-26'):
+        (tmp_path / f"data_{date_str}.ndjson").write_text(''.join(json.dumps(r) + '\n' for r in day_records()))
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'archive.py')
+    result = subprocess.run([sys.executable, script, '--nice', '1', '2025-05-26'], capture_output=True,
+                            text=True, env=dict(os.environ, DATA_DIR=str(tmp_path)))
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert os.listdir(tmp_path / 'archive') == ['data_2025-05-26.col']
+    assert (tmp_path / 'data_2025-05-25.ndjson').exists()
+
+def test_archive_day_keeps_the_source_if_verification_fails(tmp_path, monkeypatch):
+    source = tmp_path / 'data_2025-05-26.ndjson'
+    source.write_text(''.join(json.dumps(r) + '\n' for r in day_records()))
+    checksums = iter(['a', 'b'])
+    monkeypatch.setattr(archive, 'canonical_checksum', lambda records: next(checksums))
+    with pytest.raises(ValueError):
+        archive_day(str(tmp_path), '2025-05-26')
+    assert source.exists()
+    assert not os.listdir(tmp_path / 'archive')
+
+def test_float_nan_is_not_missing(tmp_path):
+    records = [{'timestamp': f"2025-05-26T10:00:0{i}+00:00", 'device_address': CHARGER,
+                'parsed_data': fields} for i, fields in enumerate(
+                    [{'solar_power': 1.5}, {'solar_power': math.nan}, {}, {'solar_power': -math.inf}])]
+    path = tmp_path / 'data_2025-05-26.col'
+    path.write_bytes(encode_day(records, '2025-05-26'))
+    reader = ArchiveReader(str(path))
+    assert reader.column_type(CHARGER, 'solar_power') == 'float'
+    restored = reader.records()
+    assert [list(r['parsed_data']) for r in restored] == [['solar_power'], ['solar_power'], [], ['solar_power']]
+    assert math.isnan(restored[1]['parsed_data']['solar_power'])
+    assert canonical_checksum(restored) == canonical_checksum(records)
+    assert len(reader.column(CHARGER, 'solar_power')) == 4
+
+def test_reads_version_1_files(tmp_path, monkeypatch):
+    # Version 1 float columns had no presence bitmap; NaN meant missing
+    monkeypatch.setattr(archive, 'FORMAT_VERSION', 1)
+    monkeypatch.setattr(archive, '_bitmap', lambda flags: b'')
+    path = tmp_path / 'data_2025-05-26.col'
+    path.write_bytes(encode_day(day_records(), '2025-05-26'))
+    monkeypatch.undo()
+    reader = ArchiveReader(str(path))
+    assert reader.version == 1
+    assert by_time(reader.records()) == by_time(day_records())
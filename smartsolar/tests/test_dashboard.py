@@ -0,0 +1,60 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+import pytest
+import dashboard
+from dashboard import CLOSED_DAY_GRACE, IMMUTABLE_CACHE_CONTROL, day_is_closed
+from response_cache import ResponseCache
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(dashboard, 'DATA_DIR', str(tmp_path))
+    monkeypatch.setattr(dashboard, 'response_cache', ResponseCache(1024 * 1024))
+    return dashboard.app.test_client()
+
+def write_day(data_dir, date_str, mtime=None):
+    path = os.path.join(data_dir, f"data_{date_str}.ndjson")
+    with open(path, 'w') as f:
+        f.write('{"timestamp":"%sT23:59:58+00:00","device_address":"AA"}\n' % date_str)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+def test_day_is_closed_only_after_the_grace_period():
+    midnight = datetime(2025, 5, 27, tzinfo=timezone.utc).timestamp()
+    written = midnight - 60
+    assert not day_is_closed('2025-05-26', written, now=midnight - 1)
+    assert not day_is_closed('2025-05-26', written, now=midnight + 1)
+    assert day_is_closed('2025-05-26', written, now=midnight + CLOSED_DAY_GRACE)
+    # Written after midnight (a late flush): wait for the grace after that write
+    late = midnight + CLOSED_DAY_GRACE - 10
+    assert not day_is_closed('2025-05-26', late, now=midnight + CLOSED_DAY_GRACE)
+    assert day_is_closed('2025-05-26', late, now=late + CLOSED_DAY_GRACE)
+
+def test_yesterday_just_written_is_revalidated(client, tmp_path):
+    yesterday = (datetime.now(timezone.utc) - timedelta(days=1)).strftime('%Y-%m-%d')
+    write_day(tmp_path, yesterday)
+    response = client.get(f'/api/data/{yesterday}')
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert dashboard.response_cache.stats()['entries'] == 0
+
+def test_old_day_is_immutable(client, tmp_path):
+    write_day(tmp_path, '2025-05-26', mtime=time.time() - 2 * CLOSED_DAY_GRACE - 1)
+    response = client.get('/api/data/2025-05-26')
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == IMMUTABLE_CACHE_CONTROL
+    assert response.get_json()[0]['device_address'] == 'AA'
+    assert dashboard.response_cache.stats()['entries'] == 1
+
+def test_latest_keeps_its_single_entry_shape(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(dashboard, 'latest_state', dashboard.LatestStateReader(str(tmp_path / 'missing.state')))
+    assert client.get('/api/latest').status_code == 404
+    with open(tmp_path / 'data_2025-05-26.ndjson', 'w') as f:
+        f.write('{"timestamp":"2025-05-26T10:00:00+00:00","device_address":"AA"}\n'
+                '{"timestamp":"2025-05-26T10:00:05+00:00","device_address":"BB"}\n'
+                '{"timestamp":"2025-05-26T10:00:01+00:00","device_address":"AA"}\n')
+    latest = client.get('/api/latest').get_json()
+    assert latest['device_address'] == 'BB' and latest['stale'] is True
+    devices = client.get('/api/latest/devices').get_json()
+    assert [(e['device_address'], e['timestamp'][11:19]) for e in devices] == [('BB', '10:00:05'),
+                                                                               ('AA', '10:00:01')]
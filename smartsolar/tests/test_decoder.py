@@ -0,0 +1,71 @@
+import pytest
+import decoder
+from decoder import DecodeEngine, UnusableReading
+from synthetic import CHARGE_BULK, encrypt_advert, solar_charger_plaintext
+
+ADDRESS = 'C0:DE:00:00:00:01'
+KEY = '00112233445566778899aabbccddeeff'
+
+def advert(nonce=1, power=120, key=KEY, **header):
+    return encrypt_advert(key, nonce, solar_charger_plaintext(CHARGE_BULK, 0, 13.4, 9.0, 340, power, 0.0),
+                          **header)
+
+def decode(engine, payload, key=KEY, address=ADDRESS):
+    return engine.decode_reading(address, key, payload, '2025-05-26T10:00:00+00:00', 'Charger')
+
+def test_decodes_a_reading_with_the_raw_payload():
+    reading = decode(DecodeEngine(), advert())
+    record = reading.to_dict()
+    assert record['parsed_data']['solar_power'] == 120
+    assert record['parsed_data']['battery_voltage'] == pytest.approx(13.4)
+    assert record['raw_data'] == advert().hex()
+
+def test_unknown_device_type():
+    engine = DecodeEngine()
+    assert decode(engine, advert(readout_type=0x7F)) is None
+    assert engine.stats['failed'] == 1
+
+def test_output_no_reading_can_hold(monkeypatch):
+    monkeypatch.setattr(decoder, 'reading_from_parsed', lambda *args: None)
+    with pytest.raises(UnusableReading) as error:
+        decode(DecodeEngine(), advert())
+    assert error.value.parsed_data['solar_power'] == 120
+
+def test_repeated_payload_skips_decryption(monkeypatch):
+    engine = DecodeEngine()
+    first = decode(engine, advert())
+    parses = []
+    parser = next(iter(engine._parsers.values()))
+    monkeypatch.setattr(parser, 'parse', lambda raw: parses.append(raw))
+    again = decode(engine, advert())
+    assert parses == []
+    assert again.to_dict() == first.to_dict()
+    assert engine.stats == {'decoded': 1, 'skipped': 1, 'failed': 0}
+    assert '50% duplicates' in engine.stats_summary()
+
+def test_parser_is_reused_until_the_key_changes():
+    engine = DecodeEngine()
+    decode(engine, advert(nonce=1))
+    parser = next(iter(engine._parsers.values()))
+    # A new reading (new nonce) is decrypted by the same parser
+    assert decode(engine, advert(nonce=2, power=90)).to_dict()['parsed_data']['solar_power'] == 90
+    assert list(engine._parsers.values()) == [parser]
+    assert engine.stats['decoded'] == 2
+    # A new key (same nonce) is decoded again, by a new parser
+    other = 'ffeeddccbbaa99887766554433221100'
+    decode(engine, advert(nonce=2, power=90, key=other), key=other)
+    assert engine.stats['decoded'] == 3
+    assert [cache_key[1] for cache_key in engine._parsers] == [other]
+
+def test_devices_are_cached_separately():
+    engine = DecodeEngine()
+    decode(engine, advert(), address='C0:DE:00:00:00:01')
+    decode(engine, advert(), address='C0:DE:00:00:00:02')
+    assert engine.stats['decoded'] == 2
+    assert len(engine._parsers) == 2
+
+def test_parse_errors_are_counted_and_raised():
+    engine = DecodeEngine()
+    with pytest.raises(Exception):
+        decode(engine, advert()[:8])
+    assert engine.stats['failed'] == 1
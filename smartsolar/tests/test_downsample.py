@@ -0,0 +1,91 @@
+import json
+import os
+from datetime import datetime, timezone
+import pytest
+import downsample
+from downsample import _uncovered, series
+from rollups import RollupEngine
+
+DAYS = ('2025-05-24', '2025-05-25', '2025-05-26')
+DEVICE = 'AA:AA:AA:AA:AA:01'
+
+def write_history(data_dir, rollup_dir, rolled_up_days):
+    """A reading every 5 minutes on each day; rollups only for some days."""
+    engine = RollupEngine(rollup_dir)
+    for day in DAYS:
+        with open(os.path.join(data_dir, f"data_{day}.ndjson"), 'w') as f:
+            for minute in range(0, 24 * 60, 5):
+                record = {'timestamp': f"{day}T{minute // 60:02d}:{minute % 60:02d}:00+00:00",
+                          'device_address': DEVICE, 'parsed_data': {'solar_power': minute}}
+                f.write(json.dumps(record) + '\n')
+                if day in rolled_up_days:
+                    engine.add(record)
+    engine.flush(final=True)
+
+def write_deadband_day(data_dir, rollup_dir, restart_at=None):
+    """A reading stored every 10 minutes by the deadband filter, rolled up as written."""
+    engine = RollupEngine(rollup_dir)
+    with open(os.path.join(data_dir, f"data_{DAYS[2]}.ndjson"), 'w') as f:
+        for minute in range(0, 24 * 60, 10):
+            if minute == restart_at:
+                engine.flush(final=True)
+                engine = RollupEngine(rollup_dir)
+            record = {'timestamp': f"{DAYS[2]}T{minute // 60:02d}:{minute % 60:02d}:00+00:00",
+                      'device_address': DEVICE, 'parsed_data': {'battery_voltage': 12 + minute / 1000},
+                      'record_policy': 'change' if minute % 30 else 'heartbeat'}
+            f.write(json.dumps(record) + '\n')
+            engine.add(record)
+    engine.flush(final=True)
+
+def epoch(timestamp):
+    return datetime.fromisoformat(timestamp).replace(tzinfo=timezone.utc).timestamp()
+
+def test_uncovered_spans():
+    assert _uncovered([0, 60, 120], 60, 0, 179) == []
+    assert _uncovered([0, 60, 120], 60, 0, 200) == [(180, 201)]
+    # Missing buckets before the rollups start and in the middle
+    assert _uncovered([180, 240, 420], 60, 0, 479) == [(0, 180), (300, 420)]
+    # A range starting inside a bucket does not count the partial bucket
+    assert _uncovered([60], 60, 30, 119) == []
+    # Buckets after a held value are covered for up to MAX_HOLD_GAP
+    assert _uncovered([0, 600], 60, 0, 659, held=[True, True]) == []
+    assert _uncovered([0, 600], 60, 0, 659, held=[False, True]) == [(60, 600)]
+    assert _uncovered([0, 7200], 60, 0, 7259, held=[True, True]) == [(60, 7200)]
+
+def test_rollups_fill_in_from_raw_before_they_start(tmp_path):
+    rollup_dir = str(tmp_path / 'rollups')
+    write_history(str(tmp_path), rollup_dir, rolled_up_days=DAYS[2:])
+    result = series(str(tmp_path), rollup_dir, DEVICE, 'solar_power',
+                    '2025-05-24T00:00:00', '2025-05-26T23:59:59', points=50)
+    assert result['source'] == 'hour'
+    # Two raw days (288 readings each) and 24 hourly buckets
+    assert result['total'] == 2 * 288 + 24
+    times = [t / 1000 for t, _ in result['data']]
+    assert times == sorted(times)
+    assert times[0] < epoch('2025-05-24T01:00:00')
+
+def test_rollups_fill_in_a_partial_backfill(tmp_path):
+    rollup_dir = str(tmp_path / 'rollups')
+    write_history(str(tmp_path), rollup_dir, rolled_up_days=(DAYS[0], DAYS[2]))
+    result = series(str(tmp_path), rollup_dir, DEVICE, 'solar_power',
+                    '2025-05-24T00:00:00', '2025-05-26T23:59:59', points=50, mode='minmax')
+    assert result['source'] == 'hour'
+    # minmax puts two points per bucket; the missing day comes from the raw readings
+    assert result['total'] == 2 * 2 * 24 + 288
+    assert any(epoch('2025-05-25T00:00:00') <= t / 1000 < epoch('2025-05-26T00:00:00')
+               for t, _ in result['data'])
+
+@pytest.mark.parametrize('restart_at', [None, 12 * 60])
+def test_deadband_days_are_served_from_rollups(tmp_path, monkeypatch, restart_at):
+    rollup_dir = str(tmp_path / 'rollups')
+    write_deadband_day(str(tmp_path), rollup_dir, restart_at)
+    read = []
+    gap_points = downsample._gap_points
+    monkeypatch.setattr(downsample, '_gap_points', lambda *args: read.extend(args[3]) or gap_points(*args))
+    result = series(str(tmp_path), rollup_dir, DEVICE, 'battery_voltage',
+                    '2025-05-26T00:00:00', '2025-05-26T23:59:59')
+    assert result['source'] == 'minute'
+    # Only the time after the last record's bucket comes from the raw readings
+    assert read == [(epoch('2025-05-26T23:51:00'), epoch('2025-05-26T23:59:59') + 1)]
+    # The hold is not carried across the restart, so those minutes have no bucket
+    assert result['total'] == 24 * 60 - 9 - (9 if restart_at else 0)
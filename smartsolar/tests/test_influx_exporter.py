@@ -0,0 +1,102 @@
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer
+import pytest
+from influx_exporter import InfluxExporter, to_line_protocol
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dev'))
+from influx_stub import Store, make_handler
+
+def record(i, version=True):
+    out = {'timestamp': f"2025-05-26T10:{i // 60:02d}:{i % 60:02d}+00:00",
+           'device_address': 'AA:AA:AA:AA:AA:01', 'device_name': 'Charger',
+           'parsed_data': {'solar_power': i, 'charge_state': 'bulk', 'load_on': True}}
+    return {'v': 2, **out} if version else out
+
+def test_line_protocol_matches_telegraf_series():
+    line = to_line_protocol(record(61), host='pi', path='/data/smartsolar-v1/data_2025-05-26.ndjson')
+    series, fields, ns = line.split(' ')
+    assert series == ('smartsolar,device_address=AA:AA:AA:AA:AA:01,device_name=Charger,host=pi,'
+                      'path=/data/smartsolar-v1/data_2025-05-26.ndjson')
+    assert fields.split(',') == ['parsed_data_solar_power=61.0', 'parsed_data_charge_state="bulk"',
+                                 'parsed_data_load_on=true']
+    assert ns == str(int(datetime(2025, 5, 26, 10, 1, 1, tzinfo=timezone.utc).timestamp()) * 10**9)
+    # The schema version is not data
+    assert to_line_protocol(record(61, version=False), host='pi',
+                            path='/data/smartsolar-v1/data_2025-05-26.ndjson') == line
+
+class StubInflux:
+    """The dev stub served in-process, with a switch for outages."""
+
+    def __init__(self):
+        self.store = Store()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(self.store, 'dev', 0.0, 0.0))
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def set_down(self, down):
+        self.server.RequestHandlerClass = make_handler(self.store, 'dev', 1.0 if down else 0.0, 0.0)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def influx():
+    stub = StubInflux()
+    yield stub
+    stub.close()
+
+def exporter(data_dir, url):
+    return InfluxExporter(str(data_dir), url, token='dev', org='dev', bucket='dev', batch_size=7,
+                          batch_interval=0.05, poll_interval=0.02, start_from='all', host='pi',
+                          backoff_max=0.05)
+
+def append(path, first, count):
+    with open(path, 'a') as f:
+        for i in range(first, first + count):
+            f.write(json.dumps(record(i), separators=(',', ':')) + '\n')
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+def test_exactly_once_across_an_outage_and_restarts(tmp_path, influx):
+    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    path = str(tmp_path / f"data_{today}.ndjson")
+    append(path, 0, 40)
+
+    # Uplink down: everything is spooled, nothing is sent
+    influx.set_down(True)
+    first = exporter(tmp_path, influx.url)
+    first.start()
+    wait_for(lambda: first._files.get(os.path.basename(path), {}).get('offset') == os.path.getsize(path))
+    wait_for(lambda: influx.store.stats()['failed_requests'] > 0)
+    append(path, 40, 5)
+    first.close()
+    assert influx.store.stats()['unique_points'] == 0
+
+    # Restart with the uplink back: the queue drains and new lines follow
+    influx.set_down(False)
+    second = exporter(tmp_path, influx.url)
+    second.start()
+    append(path, 45, 15)
+    wait_for(lambda: influx.store.stats()['unique_points'] == 60 and not second._spooled())
+    second.close()
+
+    # Another restart with nothing new sends nothing
+    third = exporter(tmp_path, influx.url)
+    third.start()
+    time.sleep(0.3)
+    third.close()
+
+    stats = influx.store.stats()
+    assert stats['points_received'] == 60
+    assert stats['duplicates'] == 0
+    assert not os.listdir(os.path.join(tmp_path, 'influx', 'spool'))
@@ -0,0 +1,51 @@
+import json
+import os
+import pytest
+import key_manager
+from key_manager import KeyStore, save_device_keys
+
+CHARGER = 'DF:C9:B0:6E:3F:EF'
+MONITOR = 'AA:BB:CC:DD:EE:FF'
+
+@pytest.fixture
+def keys_file(tmp_path, monkeypatch):
+    path = str(tmp_path / 'smartsolar-keys.json')
+    monkeypatch.setattr(key_manager, 'KEYS_FILE', path)
+    for name in [n for n in os.environ if n.startswith('SMARTSOLAR_KEY_')]:
+        monkeypatch.delenv(name)
+    return path
+
+def test_store_reloads_only_when_the_file_changes(keys_file, monkeypatch):
+    save_device_keys({CHARGER.lower(): 'aa' * 16})
+    store = KeyStore(keys_file)
+    assert store.get(CHARGER) == 'aa' * 16
+    loads = []
+    with monkeypatch.context() as patch:
+        patch.setattr(key_manager, 'load_file_keys', lambda path: loads.append(path) or {})
+        assert store.refresh() is False
+    assert loads == []
+
+    save_device_keys({CHARGER: 'aa' * 16, MONITOR: 'bb' * 16})
+    assert store.refresh() is True
+    assert store.addresses() == {CHARGER, MONITOR}
+    os.remove(keys_file)
+    assert store.refresh() is True
+    assert len(store) == 0
+
+def test_environment_keys_win(keys_file, monkeypatch):
+    save_device_keys({CHARGER: 'aa' * 16})
+    monkeypatch.setenv('SMARTSOLAR_KEY_df_c9_b0_6e_3f_ef', 'cc' * 16)
+    store = KeyStore(keys_file)
+    assert store.get(CHARGER) == 'cc' * 16
+    assert CHARGER in store
+
+def test_save_replaces_the_file_atomically(keys_file, monkeypatch):
+    save_device_keys({CHARGER: 'aa' * 16})
+    def fail(*args, **kwargs):
+        raise OSError('disk full')
+    monkeypatch.setattr(key_manager.json, 'dump', fail)
+    assert save_device_keys({CHARGER: 'bb' * 16}) is False
+    # The old file is untouched and no temporary file is left behind
+    with open(keys_file) as f:
+        assert json.load(f)['devices'] == {CHARGER: 'aa' * 16}
+    assert os.listdir(os.path.dirname(keys_file)) == ['smartsolar-keys.json']
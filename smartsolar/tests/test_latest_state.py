@@ -0,0 +1,32 @@
+import os
+from latest_state import LatestStatePublisher, LatestStateReader
+
+def test_reader_sees_published_records(tmp_path):
+    path = str(tmp_path / 'latest.state')
+    publisher = LatestStatePublisher(path)
+    reader = LatestStateReader(path)
+    assert reader.read() is None
+    publisher.publish({'device_address': 'AA', 'timestamp': 't1'})
+    publisher.publish({'device_address': 'BB', 'timestamp': 't1'})
+    assert reader.read() == {'AA': {'device_address': 'AA', 'timestamp': 't1'},
+                             'BB': {'device_address': 'BB', 'timestamp': 't1'}}
+    assert reader.sequence() == 4
+    publisher.close()
+
+def test_reader_remaps_a_recreated_file(tmp_path):
+    path = str(tmp_path / 'latest.state')
+    old = LatestStatePublisher(path)
+    for i in range(3):
+        old.publish({'device_address': 'AA', 'timestamp': f"t{i}"})
+    reader = LatestStateReader(path)
+    assert reader.read()['AA']['timestamp'] == 't2'
+    old.close()
+
+    # The collector restarts with a fresh file (e.g. /dev/shm was cleared)
+    os.unlink(path)
+    assert reader.read() is None
+    new = LatestStatePublisher(path)
+    new.publish({'device_address': 'CC', 'timestamp': 'n0'})
+    assert reader.sequence() == 2
+    assert reader.read() == {'CC': {'device_address': 'CC', 'timestamp': 'n0'}}
+    new.close()
@@ -0,0 +1,63 @@
+from itertools import islice
+import pytest
+import dashboard
+from live_stream import LiveBroadcaster, sse_events
+
+class StaticState:
+    """Latest state that never changes."""
+
+    def __init__(self, entries):
+        self.entries = entries
+
+    def sequence(self):
+        return 1
+
+    def read(self):
+        return self.entries
+
+def test_subscribe_refuses_beyond_max_clients():
+    broadcaster = LiveBroadcaster(StaticState({}), max_clients=2)
+    first, second = broadcaster.subscribe(), broadcaster.subscribe()
+    assert first is not None and second is not None
+    assert broadcaster.subscribe() is None
+    broadcaster.unsubscribe(first)
+    assert broadcaster.subscribe() is not None
+
+def test_events_release_the_slot_when_closed():
+    broadcaster = LiveBroadcaster(StaticState({}), max_clients=1)
+    client = broadcaster.subscribe()
+    events = sse_events(broadcaster, client, [{'device_address': 'AA'}])
+    assert next(events) == 'data: {"device_address":"AA"}\n\n'
+    events.close()
+    assert broadcaster.client_count() == 0
+
+def test_slow_client_is_told_to_close():
+    broadcaster = LiveBroadcaster(StaticState({}), client_queue_size=2)
+    client = broadcaster.subscribe()
+    for i in range(3):
+        broadcaster._broadcast({'i': i})
+    assert broadcaster.client_count() == 0
+    # The oldest reading makes room for the end of the stream
+    assert list(islice(sse_events(broadcaster, client, heartbeat=0.01), 5)) == ['data: {"i":1}\n\n']
+
+@pytest.fixture
+def app_client(monkeypatch):
+    state = StaticState({'AA': {'device_address': 'AA', 'timestamp': '2025-05-26T10:00:00+00:00'}})
+    monkeypatch.setattr(dashboard, 'latest_state', state)
+    monkeypatch.setattr(dashboard, 'live_broadcaster', LiveBroadcaster(state, max_clients=1))
+    return dashboard.app.test_client()
+
+def test_stream_answers_503_when_full(app_client):
+    first = app_client.get('/api/stream', buffered=False)
+    assert first.status_code == 200
+    assert next(first.response).startswith(b'data: {"device_address":"AA"')
+
+    refused = app_client.get('/api/stream')
+    assert refused.status_code == 503
+    assert refused.headers['Retry-After'] == '60'
+
+    first.close()
+    assert dashboard.live_broadcaster.client_count() == 0
+    second = app_client.get('/api/stream', buffered=False)
+    assert second.status_code == 200
+    second.close()
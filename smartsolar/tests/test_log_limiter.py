@@ -0,0 +1,66 @@
+import logging
+import queue
+
+import log_limiter
+import pytest
+from log_limiter import DeferredQueueHandler, RateLimitFilter, rate_limited
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(log_limiter.time, 'monotonic', clock)
+    return clock
+
+def make_record(msg, key=None):
+    record = logging.LogRecord('test', logging.INFO, __file__, 1, msg, None, None)
+    if key is not None:
+        record.__dict__.update(rate_limited(key))
+    return record
+
+def test_each_key_passes_once_per_interval(clock):
+    f = RateLimitFilter(60)
+    assert f.filter(make_record('Heard AA', 'advert:AA'))
+    assert f.filter(make_record('Heard BB', 'advert:BB'))
+    clock.now += 30
+    assert not f.filter(make_record('Heard AA', 'advert:AA'))
+    assert not f.filter(make_record('Heard AA', 'advert:AA'))
+    # Messages without a key are never limited
+    assert f.filter(make_record('Started'))
+    assert f.filter(make_record('Started'))
+
+    clock.now += 31
+    record = make_record('Heard AA', 'advert:AA')
+    assert f.filter(record)
+    assert record.getMessage() == 'Heard AA (2 similar suppressed in 61s)'
+    record = make_record('Heard BB', 'advert:BB')
+    assert f.filter(record)
+    assert record.getMessage() == 'Heard BB'
+
+def test_zero_interval_disables_limiting(clock):
+    f = RateLimitFilter(0)
+    assert all(f.filter(make_record('Heard AA', 'advert:AA')) for _ in range(3))
+
+def test_least_recently_passed_keys_are_forgotten(clock, monkeypatch):
+    monkeypatch.setattr(log_limiter, 'MAX_KEYS', 2)
+    f = RateLimitFilter(60)
+    for key in ('a', 'b', 'c'):
+        assert f.filter(make_record(key, key))
+    # 'a' was evicted, so it passes again; 'c' is still limited
+    assert f.filter(make_record('a', 'a'))
+    assert not f.filter(make_record('c', 'c'))
+
+def test_deferred_handler_queues_the_record_unformatted():
+    q = queue.Queue()
+    handler = DeferredQueueHandler(q)
+    record = logging.LogRecord('test', logging.INFO, __file__, 1, 'Heard %s', ('AA',), None)
+    handler.emit(record)
+    queued = q.get_nowait()
+    assert queued is record
+    assert queued.msg == 'Heard %s' and queued.args == ('AA',)
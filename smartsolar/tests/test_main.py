@@ -0,0 +1,77 @@
+import asyncio
+import os
+import tempfile
+from datetime import datetime, timezone
+from types import SimpleNamespace
+import pytest
+
+# main creates its data directory and log file on import
+os.environ.setdefault('DATA_DIR', tempfile.mkdtemp(prefix='smartsolar-test-'))
+
+import decoder
+import main
+from advert_source import ReplayAdvertisement, ReplayDevice
+from decoder import DecodeEngine
+from scheduler import SampleScheduler
+from synthetic import CHARGE_BULK, encrypt_advert, solar_charger_plaintext
+
+ADDRESS = 'C0:DE:00:00:00:01'
+KEY = '00112233445566778899aabbccddeeff'
+
+def advert(**header):
+    return encrypt_advert(KEY, 1, solar_charger_plaintext(CHARGE_BULK, 0, 13.4, 9.0, 340, 120, 0.0), **header)
+
+@pytest.fixture
+def collector(monkeypatch):
+    """main with its key store, GATT reads and storage replaced."""
+    saved, gatt = [], []
+    async def read_gatt(device):
+        gatt.append(device.address)
+        return {'readings': {'306b0002': '00'}}
+    monkeypatch.setattr(main, 'save_data', saved.append)
+    monkeypatch.setattr(main, 'read_gatt', read_gatt)
+    monkeypatch.setattr(main.key_store, 'get', lambda address: KEY)
+    monkeypatch.setattr(main, 'decode_engine', DecodeEngine())
+    return SimpleNamespace(saved=saved, gatt=gatt)
+
+def process(payload):
+    device_info = {'device': SimpleNamespace(name='Charger', address=ADDRESS), 'victron_data': payload,
+                   'timestamp': datetime(2025, 5, 26, 10, tzinfo=timezone.utc)}
+    asyncio.run(main.process_device(ADDRESS, device_info))
+
+def test_decoded_advert_is_saved(collector):
+    process(advert())
+    assert collector.gatt == []
+    assert collector.saved[0].to_dict()['parsed_data']['solar_power'] == 120
+
+def test_unknown_device_falls_back_to_gatt(collector):
+    process(advert(readout_type=0x7F))
+    assert collector.gatt == [ADDRESS]
+    assert collector.saved[0]['readings'] == {'306b0002': '00'}
+
+def test_unusable_reading_skips_gatt(collector, monkeypatch):
+    monkeypatch.setattr(decoder, 'reading_from_parsed', lambda *args: None)
+    process(advert())
+    assert collector.gatt == []
+    assert collector.saved[0]['parsed_data']['solar_power'] == 120
+
+def test_busy_device_does_not_use_up_its_sample_slot(monkeypatch):
+    monkeypatch.setattr(main, 'sample_scheduler', SampleScheduler(10))
+    monkeypatch.setattr(main, 'recording', set())
+    monkeypatch.setattr(main, 'discovered_devices', {})
+    monkeypatch.setattr(main, 'record_queue', asyncio.Queue(10))
+    device = ReplayDevice(ADDRESS, 'SmartSolar Charger')
+    def advert_at(captured_at):
+        main.detection_callback(device, ReplayAdvertisement({0x02E1: advert()}, -60, device.name, captured_at))
+    advert_at(1000.0)
+    # Due, but the previous sample is still being processed
+    advert_at(1010.0)
+    assert main.record_queue.qsize() == 1
+    main.recording.discard(ADDRESS)
+    # Recorded as soon as the device is free, not at the next slot (1020)
+    advert_at(1011.0)
+    assert main.record_queue.qsize() == 2
+    advert_at(1015.0)
+    main.recording.discard(ADDRESS)
+    advert_at(1016.0)
+    assert main.record_queue.qsize() == 2
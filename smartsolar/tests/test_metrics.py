@@ -0,0 +1,68 @@
+import asyncio
+from metrics import Registry, start_metrics_server
+
+async def scrape(server, path='/metrics'):
+    host, port = server.sockets[0].getsockname()[:2]
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: x\r\n\r\n".encode())
+    response = await reader.read()
+    writer.close()
+    return response.decode()
+
+def test_served_on_localhost_only_by_default():
+    async def run():
+        registry = Registry()
+        registry.counter('smartsolar_test_total', 'A test counter').inc()
+        server = await start_metrics_server(registry, 0)
+        try:
+            assert server.sockets[0].getsockname()[0] == '127.0.0.1'
+            response = await scrape(server)
+            assert response.startswith('HTTP/1.1 200 OK')
+            assert 'smartsolar_test_total 1\n' in response
+            assert (await scrape(server, '/other')).startswith('HTTP/1.1 404')
+        finally:
+            server.close()
+            await server.wait_closed()
+    asyncio.run(run())
+
+def test_counter_renders_one_series_per_label_value():
+    registry = Registry()
+    registry.counter('smartsolar_idle_total', 'Never incremented')
+    counter = registry.counter('smartsolar_reads_total', 'Reads per device', labels=('device',))
+    counter.inc('AA')
+    counter.inc('AA', amount=2)
+    counter.inc('say "hi"\n')
+    assert registry.render() == (
+        '# HELP smartsolar_idle_total Never incremented\n'
+        '# TYPE smartsolar_idle_total counter\n'
+        'smartsolar_idle_total 0\n'
+        '# HELP smartsolar_reads_total Reads per device\n'
+        '# TYPE smartsolar_reads_total counter\n'
+        'smartsolar_reads_total{device="AA"} 3\n'
+        'smartsolar_reads_total{device="say \\"hi\\"\\n"} 1\n')
+
+def test_gauge_reads_its_function_at_scrape_time():
+    registry = Registry()
+    level = [1.5]
+    registry.gauge('smartsolar_queue', 'Queued', function=lambda: level[0])
+    broken = registry.gauge('smartsolar_broken', 'Broken', function=lambda: 1 / 0)
+    broken.set(7)
+    assert 'smartsolar_queue 1.5\n' in registry.render()
+    level[0] = 4.0
+    output = registry.render()
+    assert 'smartsolar_queue 4\n' in output
+    # A failing function keeps the last set value
+    assert 'smartsolar_broken 7\n' in output
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = registry.histogram('smartsolar_decode_seconds', 'Decode time', labels=('kind',),
+                                   buckets=(0.01, 0.1))
+    for value in (0.005, 0.01, 0.05, 2.0):
+        histogram.observe(value, 'advert')
+    assert registry.render().splitlines()[2:] == [
+        'smartsolar_decode_seconds_bucket{kind="advert",le="0.01"} 2',
+        'smartsolar_decode_seconds_bucket{kind="advert",le="0.1"} 3',
+        'smartsolar_decode_seconds_bucket{kind="advert",le="+Inf"} 4',
+        'smartsolar_decode_seconds_sum{kind="advert"} 2.065000',
+        'smartsolar_decode_seconds_count{kind="advert"} 4']
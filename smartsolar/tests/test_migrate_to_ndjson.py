@@ -0,0 +1,48 @@
+import json
+import pytest
+from migrate_to_ndjson import TruncatedFile, iter_json_array
+
+RECORDS = [
+    {'timestamp': '2025-05-26T10:00:00+00:00', 'parsed_data': {'solar_power': 12, 'yield_today': 340}},
+    12345678901234567890,
+    -0.000125,
+    'brackets ], commas , and "quotes" \\ inside',
+    [1, [2, [3, {}]], []],
+    {'unicode': 'Zürich ☀', 'empty': {}, 'null': None, 'flag': True},
+    3e-7,
+]
+
+def write(path, text):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return path
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 17, 1024 * 1024])
+@pytest.mark.parametrize('indent', [None, 2])
+def test_elements_match_json_load(tmp_path, chunk_size, indent):
+    path = write(tmp_path / 'data.json', json.dumps(RECORDS, indent=indent, ensure_ascii=False))
+    assert list(iter_json_array(path, chunk_size)) == RECORDS
+
+@pytest.mark.parametrize('text', ['', '  \n', '[]', ' [ \n ] '])
+def test_empty(tmp_path, text):
+    assert list(iter_json_array(write(tmp_path / 'data.json', text), 2)) == []
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 1024 * 1024])
+def test_truncated_file_yields_complete_records_first(tmp_path, chunk_size):
+    text = json.dumps(RECORDS)
+    # Cut inside the last record, after a comma, and before the closing bracket
+    for cut, complete in ((len(text) - 3, 6), (text.rindex(',') + 1, 6), (len(text) - 1, 6)):
+        path = write(tmp_path / 'data.json', text[:cut])
+        seen = []
+        with pytest.raises(TruncatedFile):
+            for value in iter_json_array(path, chunk_size):
+                seen.append(value)
+        assert seen == RECORDS[:complete]
+
+def test_rejects_other_json(tmp_path):
+    with pytest.raises(ValueError):
+        list(iter_json_array(write(tmp_path / 'data.json', '{"a": 1}')))
+    for text in ('[1 2]', '[1x, 2]', '[1x]'):
+        with pytest.raises(ValueError) as error:
+            list(iter_json_array(write(tmp_path / 'data.json', text)))
+        assert error.type is ValueError
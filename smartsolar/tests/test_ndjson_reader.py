@@ -0,0 +1,58 @@
+import json
+import pytest
+from archive import archive_path_for, encode_day
+from ndjson_reader import iter_lines, iter_records, tail_across_files, tail_records
+
+def write_lines(path, lines):
+    with open(path, 'w') as f:
+        f.write(''.join(lines))
+
+def record_line(i):
+    return json.dumps({'timestamp': f"2025-05-26T10:00:{i:02d}+00:00", 'i': i}) + '\n'
+
+@pytest.mark.parametrize('block_size', [1, 7, 64, 8192])
+def test_tail_matches_reading_the_whole_file(tmp_path, block_size):
+    path = tmp_path / 'data_2025-05-26.ndjson'
+    write_lines(path, [record_line(i) for i in range(30)] + ['{"timestamp": "partial'])
+    everything = list(iter_records(path))
+    for n in (1, 5, 29, 30, 31, 100):
+        assert tail_records(path, n, block_size) == everything[-n:]
+
+@pytest.mark.parametrize('block_size', [16, 8192])
+def test_tail_keeps_reading_past_corrupt_lines(tmp_path, block_size):
+    path = tmp_path / 'data_2025-05-26.ndjson'
+    # A crash can leave a torn line; blank and corrupt lines don't count towards n
+    write_lines(path, [record_line(i) for i in range(10)] + ['{"torn\n', '\n'] * 20 + [record_line(10)])
+    assert [r['i'] for r in tail_records(path, 3, block_size)] == [8, 9, 10]
+
+def test_tail_of_files_without_complete_lines(tmp_path):
+    path = tmp_path / 'data_2025-05-26.ndjson'
+    write_lines(path, [])
+    assert tail_records(path, 5) == []
+    write_lines(path, ['{"timestamp": "partial'])
+    assert tail_records(path, 5, block_size=4) == []
+
+def test_iter_lines_skips_torn_lines(tmp_path):
+    path = tmp_path / 'data_2025-05-26.ndjson'
+    braces = json.dumps({'timestamp': '2025-05-26T10:00:05+00:00', 'device_name': 'Roof }{ }'}) + '\n'
+    nested = json.dumps({'timestamp': '2025-05-26T10:00:06+00:00', 'parsed_data': {'a': 1}})
+    # Torn lines are newline-terminated by the writer when it reopens the file
+    write_lines(path, [record_line(1), '{"timestamp": "par\n', '\n', nested[:-1] + '\n', braces,
+                       record_line(2), record_line(3)[:-1]])
+    lines = list(iter_lines(path))
+    assert [json.loads(line) for line in lines] == [json.loads(record_line(1)), json.loads(braces),
+                                                    json.loads(record_line(2))]
+
+def test_tail_across_files_reads_archived_days(tmp_path):
+    def day(date_str, count):
+        return [{'timestamp': f"{date_str}T10:00:{i:02d}+00:00", 'device_address': 'AA:AA:AA:AA:AA:01',
+                 'parsed_data': {'i': i}} for i in range(count)]
+    (tmp_path / 'archive').mkdir()
+    for date_str in ('2025-05-24', '2025-05-25'):
+        with open(archive_path_for(str(tmp_path), date_str), 'wb') as f:
+            f.write(encode_day(day(date_str, 4), date_str))
+    write_lines(tmp_path / 'data_2025-05-26.ndjson', [json.dumps(r) + '\n' for r in day('2025-05-26', 3)])
+    records = tail_across_files(str(tmp_path), 9)
+    assert [r['timestamp'][:19] for r in records] == (
+        [f"2025-05-26T10:00:0{i}" for i in (2, 1, 0)] + [f"2025-05-25T10:00:0{i}" for i in (3, 2, 1, 0)]
+        + [f"2025-05-24T10:00:0{i}" for i in (3, 2)])
@@ -0,0 +1,72 @@
+import json
+import pytest
+from victron_ble.devices.battery_monitor import BatteryMonitorData
+from victron_ble.devices.solar_charger import OperationMode, SolarChargerData
+from key_manager import parse_victron_data
+from readings import SCHEMA_VERSION, decode_line, json_value, peek, reading_from_parsed
+
+ADDRESS = 'DF:C9:B0:6E:3F:EF'
+
+def charger(**overrides):
+    # Fields in the order victron_ble's parser produces them
+    data = {'charge_state': OperationMode.BULK, 'charger_error': 'NO_ERROR', 'battery_voltage': 13.42,
+            'battery_charging_current': -0.0, 'yield_today': 340, 'solar_power': 0, 'external_device_load': None}
+    data.update(overrides)
+    return SolarChargerData(0xA053, data)
+
+def expected_line(record):
+    return json.dumps(record, separators=(',', ':')) + '\n'
+
+@pytest.mark.parametrize('value', [0, -1, 2 ** 70, 0.1, -0.0, 1e-300, 1.7976931348623157e308, 13.420000000000002,
+                                   float('nan'), float('inf'), float('-inf'), True, False, None, '',
+                                   'Zürich ☀ "quoted" \\ \n\t\x00\x1f', [1, 'a'], {'nested': [None]}])
+def test_json_value_matches_json_dumps(value):
+    assert json_value(value) == json.dumps(value, separators=(',', ':'))
+
+@pytest.mark.parametrize('device_name', ['SmartSolar HQ2231 "Roof" ☀', None])
+@pytest.mark.parametrize('policy', ['change', None])
+def test_encoded_line_matches_json_dumps_of_the_record(device_name, policy):
+    parsed = charger()
+    reading = reading_from_parsed(parsed, '2025-05-26T10:00:00.123456+00:00', ADDRESS, device_name,
+                                  raw=bytes.fromhex('100253a001064dcb'))
+    if policy:
+        reading['record_policy'] = policy
+    record = {'v': SCHEMA_VERSION, 'timestamp': '2025-05-26T10:00:00.123456+00:00',
+              'device_address': ADDRESS, 'device_name': device_name,
+              'parsed_data': parse_victron_data(parsed), 'raw_data': '100253a001064dcb'}
+    if policy:
+        record['record_policy'] = policy
+    assert reading.to_dict() == record
+    assert reading.encode() == expected_line(record).encode('ascii')
+
+def test_same_model_with_other_values_and_fields():
+    first = reading_from_parsed(charger(), 't0', ADDRESS, 'a')
+    second = reading_from_parsed(charger(solar_power=float('nan'), charge_state=OperationMode.FLOAT),
+                                 't1', ADDRESS, 'a')
+    assert type(first) is type(second)
+    assert second.to_json() == json.dumps(second.to_dict(), separators=(',', ':'))
+    # A different field set (e.g. another aux input) gets its own type
+    third = reading_from_parsed(charger(extra_field=1.5), 't2', ADDRESS, 'a')
+    assert type(third) is not type(first)
+    assert json.loads(third.to_json())['parsed_data']['extra_field'] == 1.5
+    assert reading_from_parsed(charger(), 't3', ADDRESS, 'a').to_json().startswith('{"v":2,"timestamp":"t3"')
+
+def test_other_models_encode_like_json_dumps():
+    parsed = BatteryMonitorData(0xA389, {'remaining_mins': 65535, 'aux_mode': None, 'current': -1.25,
+                                         'voltage': 12.81, 'soc': 87.5, 'consumed_ah': -12.3, 'alarm': None})
+    reading = reading_from_parsed(parsed, '2025-05-26T10:00:00+00:00', ADDRESS, 'Monitor')
+    assert reading.to_json() == json.dumps(reading.to_dict(), separators=(',', ':'))
+    assert reading.to_dict()['parsed_data'] == parse_victron_data(parsed)
+
+def test_decode_line_filters_before_parsing():
+    line = reading_from_parsed(charger(), '2025-05-26T10:00:00+00:00', ADDRESS, 'a').encode()
+    assert peek(line) == ('2025-05-26T10:00:00+00:00', ADDRESS)
+    assert decode_line(line)['parsed_data']['charge_state'] == 'BULK'
+    assert decode_line(line, device='AA:AA:AA:AA:AA:AA') is None
+    assert decode_line(line, from_ts='2025-05-26T10:00:01', to_ts='2025-05-26T11:00:00') is None
+    # Schema 1 lines are filtered after parsing
+    old = expected_line({'timestamp': '2025-05-26T10:00:00+00:00', 'device_address': ADDRESS}).encode()
+    assert peek(old) is None
+    assert decode_line(old, device=ADDRESS, from_ts='2025-05-26T10:00:00', to_ts='2025-05-26T10:00:00')
+    assert decode_line(old, device='AA:AA:AA:AA:AA:AA') is None
+    assert decode_line(b'{"torn') is None
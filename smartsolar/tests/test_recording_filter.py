@@ -0,0 +1,57 @@
+from recording_filter import DEFAULT_DEADBANDS, DeadbandFilter, load_deadbands
+
+DEVICE = 'AA:AA:AA:AA:AA:01'
+
+def record(seconds, device=DEVICE, **fields):
+    return {'timestamp': f"2025-05-26T10:{seconds // 60:02d}:{seconds % 60:02d}+00:00",
+            'device_address': device, 'parsed_data': fields}
+
+def test_readings_within_the_deadband_are_dropped():
+    f = DeadbandFilter({'battery_voltage': 0.05})
+    assert f.check(record(0, battery_voltage=12.50, charge_state='bulk')) == 'change'
+    assert f.check(record(1, battery_voltage=12.54, charge_state='bulk')) is None
+    assert f.check(record(2, battery_voltage=12.46, charge_state='bulk')) is None
+    # Compared with the last stored value, so slow drift is still recorded
+    assert f.check(record(3, battery_voltage=12.56, charge_state='bulk')) == 'change'
+    assert f.check(record(4, battery_voltage=12.56, charge_state='absorption')) == 'change'
+    # Fields without a deadband record any change
+    assert f.check(record(5, battery_voltage=12.56, charge_state='absorption', yield_today=1)) == 'change'
+    assert f.check(record(6, battery_voltage=12.56, charge_state='absorption', yield_today=2)) == 'change'
+
+def test_heartbeat_stores_an_unchanged_reading():
+    f = DeadbandFilter({}, heartbeat=60)
+    assert f.check(record(0, solar_power=100)) == 'change'
+    assert f.check(record(59, solar_power=100)) is None
+    assert f.check(record(60, solar_power=100)) == 'heartbeat'
+    assert f.check(record(100, solar_power=100)) is None
+    # A clock step backwards also stores the reading
+    assert f.check(record(10, solar_power=100)) == 'heartbeat'
+
+def test_devices_are_filtered_separately():
+    f = DeadbandFilter()
+    other = 'BB:BB:BB:BB:BB:02'
+    assert f.check(record(0, solar_power=100)) == 'change'
+    assert f.check(record(1, other, solar_power=100)) == 'change'
+    assert f.check(record(2, solar_power=101)) is None
+    assert f.check(record(3, other, solar_power=101)) is None
+
+def test_records_without_parsed_data_are_not_filtered():
+    f = DeadbandFilter()
+    gatt = {'timestamp': '2025-05-26T10:00:00+00:00', 'device_address': DEVICE, 'gatt': {}}
+    assert f.check(gatt) == 'all'
+    assert f.check(gatt) == 'all'
+    assert f.stats_summary() == '0 stored, 0 within deadband'
+
+def test_stats_summary_resets_the_counts():
+    f = DeadbandFilter()
+    for s in range(3):
+        f.check(record(s, solar_power=100))
+    assert f.stats_summary() == '1 stored, 2 within deadband'
+    assert f.stats_summary() == '0 stored, 0 within deadband'
+
+def test_load_deadbands(monkeypatch):
+    monkeypatch.setenv('DEADBAND_BATTERY_VOLTAGE', '-0.1')
+    monkeypatch.setenv('DEADBAND_SOLAR_POWER', 'lots')
+    deadbands = load_deadbands()
+    assert deadbands['battery_voltage'] == 0.1
+    assert deadbands['solar_power'] == DEFAULT_DEADBANDS['solar_power']
@@ -0,0 +1,167 @@
+import json
+import os
+
+import pytest
+from archive import archive_day
+from rollups import (MAX_HOLD_GAP, RollupEngine, backfill, load_rollups, merge_entries, period_for,
+                     rollup_path)
+
+DEVICE = 'AA:AA:AA:AA:AA:01'
+
+def record(time, policy=None, **fields):
+    out = {'timestamp': f"2025-05-26T{time}+00:00", 'device_address': DEVICE, 'device_name': 'Charger',
+           'parsed_data': fields}
+    if policy:
+        out['record_policy'] = policy
+    return out
+
+def roll_up(tmp_path, records, resolution='minute'):
+    engine = RollupEngine(str(tmp_path))
+    for r in records:
+        engine.add(r)
+    engine.flush(final=True)
+    buckets = load_rollups(str(tmp_path), resolution, '2025-05-26T00:00:00', '2025-05-26T23:59:59')
+    return {b['t'][11:19]: b for b in buckets}
+
+def test_stepped_values_hold_until_the_next_record(tmp_path):
+    records = [record('10:00:00', 'change', battery_voltage=12.0),
+               record('10:00:30', 'change', battery_voltage=13.0),
+               record('10:05:00', 'heartbeat', battery_voltage=13.0)]
+    minutes = roll_up(tmp_path, records)
+    assert sorted(minutes) == ['10:00:00', '10:01:00', '10:02:00', '10:03:00', '10:04:00', '10:05:00']
+    # Both values held half the minute
+    assert minutes['10:00:00']['f']['battery_voltage'] == [12.0, 13.0, 12.5, 13.0, 2, 60.0]
+    # Minutes without a record of their own carry the held value
+    for minute in ('10:01:00', '10:02:00', '10:03:00', '10:04:00'):
+        assert minutes[minute]['n'] == 0
+        assert minutes[minute]['f']['battery_voltage'] == [13.0, 13.0, 13.0, 13.0, 0, 60.0]
+    # The last record has not held for any time yet
+    assert minutes['10:05:00']['f']['battery_voltage'] == [13.0, 13.0, 13.0, 13.0, 1, 0]
+
+    hours = roll_up(tmp_path / 'hours', records, 'hour')
+    assert hours['10:00:00']['f']['battery_voltage'] == [12.0, 13.0, 12.9, 13.0, 3, 300.0]
+
+def test_mean_does_not_depend_on_how_often_the_filter_wrote(tmp_path):
+    # The same signal, stored once or with a heartbeat every 10 s
+    sparse = [record('10:00:00', 'change', solar_power=100), record('10:00:45', 'change', solar_power=200),
+              record('10:01:00', 'change', solar_power=200)]
+    dense = [record(f"10:00:{s:02d}", 'heartbeat' if s else 'change', solar_power=100) for s in range(0, 45, 10)]
+    dense += [record('10:00:45', 'change', solar_power=200), record('10:00:55', 'heartbeat', solar_power=200),
+              record('10:01:00', 'heartbeat', solar_power=200)]
+    a = roll_up(tmp_path / 'sparse', sparse)['10:00:00']['f']['solar_power']
+    b = roll_up(tmp_path / 'dense', dense)['10:00:00']['f']['solar_power']
+    assert a[2] == b[2] == 125.0
+    assert a[5] == b[5] == 60.0
+
+def test_holds_stop_after_max_hold_gap(tmp_path):
+    minutes = roll_up(tmp_path, [record('10:00:00', 'change', battery_voltage=12.0),
+                                 record('12:30:00', 'change', battery_voltage=12.5)])
+    assert len([m for m in minutes if m < '12:30:00']) == MAX_HOLD_GAP // 60
+    assert '11:00:00' not in minutes
+    assert minutes['12:30:00']['n'] == 1
+
+def test_unfiltered_records_are_averaged_per_record(tmp_path):
+    minutes = roll_up(tmp_path, [record('10:00:00', 'all', battery_voltage=10.0),
+                                 record('10:00:50', 'all', battery_voltage=20.0),
+                                 record('10:03:00', None, battery_voltage=12.0)])
+    assert minutes['10:00:00']['f']['battery_voltage'] == [10.0, 20.0, 15.0, 20.0, 2]
+    assert sorted(minutes) == ['10:00:00', '10:03:00']
+
+def test_late_records_fold_into_the_current_bucket(tmp_path):
+    minutes = roll_up(tmp_path, [record('10:01:10', 'all', battery_voltage=12.0),
+                                 record('10:00:50', 'all', battery_voltage=14.0)])
+    assert sorted(minutes) == ['10:01:00']
+    assert minutes['10:01:00']['n'] == 2
+
+def test_merge_weights_held_lines_by_time():
+    base = {'t': '2025-05-26T10:00:00+00:00', 'device_address': DEVICE, 'device_name': 'Charger'}
+    older = dict(base, n=1, energy_wh=1.0, f={'v': [12.0, 12.0, 12.0, 12.0, 1, 15.0]})
+    newer = dict(base, n=0, energy_wh=2.0, f={'v': [13.0, 13.0, 13.0, 13.0, 0, 45.0]})
+    merged = merge_entries(older, newer)
+    assert merged['f']['v'] == [12.0, 13.0, 12.75, 13.0, 1, 60.0]
+    assert merged['n'] == 1
+    assert merged['energy_wh'] == pytest.approx(3.0)
+    plain = merge_entries(dict(base, n=1, energy_wh=0, f={'v': [1, 1, 1, 1, 1]}),
+                          dict(base, n=3, energy_wh=0, f={'v': [2, 3, 2.5, 3, 3]}))
+    assert plain['f']['v'] == [1, 3, 2.125, 3, 4]
+
+def test_energy_is_split_across_the_buckets_an_interval_covers(tmp_path):
+    # 600 W held from 10:59:30 to 11:00:30 across the hour boundary
+    records = [record('10:59:30', 'change', solar_power=600), record('11:00:30', 'change', solar_power=600)]
+    minutes = roll_up(tmp_path / 'step', records)
+    assert minutes['10:59:00']['energy_wh'] == pytest.approx(5.0)
+    assert minutes['11:00:00']['energy_wh'] == pytest.approx(5.0)
+    hours = roll_up(tmp_path / 'step-hours', records, 'hour')
+    assert hours['10:00:00']['energy_wh'] == pytest.approx(5.0)
+    assert hours['11:00:00']['energy_wh'] == pytest.approx(5.0)
+
+    # 0 W rising to 1200 W over two minutes: a quarter of the energy falls in the first minute
+    minutes = roll_up(tmp_path / 'ramp', [record('10:00:00', 'all', solar_power=0),
+                                          record('10:02:00', 'all', solar_power=1200)])
+    assert minutes['10:00:00']['energy_wh'] == pytest.approx(5.0)
+    assert minutes['10:01:00']['energy_wh'] == pytest.approx(15.0)
+    assert minutes['10:02:00']['energy_wh'] == 0
+
+def test_energy_is_not_integrated_over_long_gaps(tmp_path):
+    minutes = roll_up(tmp_path, [record('10:00:00', 'all', solar_power=500),
+                                 record('10:20:00', 'all', solar_power=500)])
+    assert sum(m['energy_wh'] for m in minutes.values()) == 0
+
+def test_buckets_go_to_one_file_per_period(tmp_path):
+    start = 1748253600  # 2025-05-26T10:00:00Z
+    assert period_for('minute', start) == '2025-05-26'
+    assert period_for('hour', start) == '2025-05'
+    assert period_for('day', start) == '2025'
+    roll_up(tmp_path, [record('10:00:00', 'all', battery_voltage=12.0)])
+    for resolution, period in (('minute', '2025-05-26'), ('hour', '2025-05'), ('day', '2025')):
+        assert os.path.exists(rollup_path(str(tmp_path), resolution, period))
+
+def test_load_filters_by_range_and_device(tmp_path):
+    other = dict(record('10:01:00', 'all', battery_voltage=13.0), device_address='BB:BB:BB:BB:BB:02')
+    engine = RollupEngine(str(tmp_path))
+    for r in (record('10:00:00', 'all', battery_voltage=12.0), other, record('10:02:00', 'all', battery_voltage=14.0)):
+        engine.add(r)
+    engine.flush(final=True)
+    buckets = load_rollups(str(tmp_path), 'minute', '2025-05-26T10:01:00', '2025-05-26T10:02:00')
+    assert [(b['t'][11:19], b['device_address']) for b in buckets] == [('10:01:00', 'BB:BB:BB:BB:BB:02'),
+                                                                      ('10:02:00', DEVICE)]
+    buckets = load_rollups(str(tmp_path), 'minute', '2025-05-26T00:00:00', '2025-05-26T23:59:59', device=DEVICE)
+    assert [b['t'][11:19] for b in buckets] == ['10:00:00', '10:02:00']
+    with pytest.raises(ValueError):
+        load_rollups(str(tmp_path), 'week', '2025-05-26T00:00:00', '2025-05-26T23:59:59')
+
+def test_a_bucket_written_twice_is_merged_on_load(tmp_path):
+    # A restart writes the open bucket at shutdown and again once the minute closes
+    for r in (record('10:00:10', 'all', battery_voltage=12.0), record('10:00:20', 'all', battery_voltage=14.0)):
+        engine = RollupEngine(str(tmp_path))
+        engine.add(r)
+        engine.flush(final=True)
+    with open(rollup_path(str(tmp_path), 'minute', '2025-05-26'), 'ab') as f:
+        f.write(b'{"t": "2025-05-26T10:0')  # torn write
+    with open(rollup_path(str(tmp_path), 'minute', '2025-05-26')) as f:
+        assert len(f.readlines()) == 3
+    buckets = load_rollups(str(tmp_path), 'minute', '2025-05-26T00:00:00', '2025-05-26T23:59:59')
+    assert len(buckets) == 1
+    assert buckets[0]['n'] == 2
+    assert buckets[0]['f']['battery_voltage'] == [12.0, 14.0, 13.0, 14.0, 2]
+
+def test_backfill_rebuilds_from_ndjson_and_archives(tmp_path):
+    data_dir, rollup_dir = tmp_path / 'data', tmp_path / 'rollups'
+    data_dir.mkdir()
+    days = {'2025-05-25': 10.0, '2025-05-26': 20.0}
+    for date_str, value in days.items():
+        r = dict(record('10:00:00', 'all', battery_voltage=value), timestamp=f"{date_str}T10:00:00+00:00")
+        (data_dir / f"data_{date_str}.ndjson").write_text(json.dumps(r) + '\n')
+    assert archive_day(str(data_dir), '2025-05-25')
+    # A stale bucket from an earlier run is replaced
+    stale = rollup_path(str(rollup_dir), 'minute', '2025-05-24')
+    os.makedirs(os.path.dirname(stale))
+    with open(stale, 'w') as f:
+        f.write(json.dumps({'t': '2025-05-24T10:00:00+00:00', 'device_address': DEVICE, 'n': 1, 'f': {}}) + '\n')
+
+    assert backfill(str(data_dir), str(rollup_dir)) == 2
+    assert not os.path.exists(stale)
+    assert not os.path.exists(str(rollup_dir) + '.backfill')
+    buckets = load_rollups(str(rollup_dir), 'day', '2025-05-24T00:00:00', '2025-05-26T23:59:59')
+    assert [(b['t'][:10], b['f']['battery_voltage'][2]) for b in buckets] == [('2025-05-25', 10.0),
+                                                                              ('2025-05-26', 20.0)]
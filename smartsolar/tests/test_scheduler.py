@@ -0,0 +1,46 @@
+import pytest
+from scheduler import MIN_SAMPLE_INTERVAL, SampleScheduler, load_sample_intervals
+
+A = 'AA:AA:AA:AA:AA:01'
+B = 'BB:BB:BB:BB:BB:02'
+
+def test_samples_follow_a_grid_anchored_at_the_first_advert():
+    scheduler = SampleScheduler(10)
+    assert scheduler.due(A, now=100.0)
+    assert not scheduler.due(A, now=105.0)
+    # Within a tenth of an interval of the slot counts as on time
+    assert scheduler.due(A, now=109.5)
+    # Late arrivals do not move the grid: the next slot is still 120
+    assert not scheduler.due(A, now=118.0)
+    assert scheduler.due(A, now=123.0)
+    assert scheduler.due(A, now=129.0)
+
+def test_missed_slots_are_skipped():
+    scheduler = SampleScheduler(10)
+    assert scheduler.due(A, now=0.0)
+    # Silent for several intervals: one sample, then back on the grid
+    assert scheduler.due(A, now=45.0)
+    assert not scheduler.due(A, now=46.0)
+    assert scheduler.due(A, now=50.0)
+
+def test_devices_have_their_own_interval_and_grid():
+    scheduler = SampleScheduler(10, {B: 2})
+    assert scheduler.interval_for(A) == 10
+    assert scheduler.interval_for(B) == 2
+    assert scheduler.due(A, now=0.0)
+    assert scheduler.due(B, now=1.0)
+    assert [scheduler.due(B, now=t) for t in (2.0, 3.0, 4.0, 5.0)] == [False, True, False, True]
+    assert not scheduler.due(A, now=5.0)
+
+def test_stats_summary_resets_the_counts():
+    scheduler = SampleScheduler(10)
+    for t in (0.0, 1.0, 2.0, 10.0):
+        scheduler.due(A, now=t)
+    assert scheduler.stats_summary() == '2 recorded, 2 rate-limited'
+    assert scheduler.stats_summary() == '0 recorded, 0 rate-limited'
+
+def test_load_sample_intervals(monkeypatch):
+    monkeypatch.setenv('SAMPLE_INTERVAL_aa_aa_aa_aa_aa_01', '30')
+    monkeypatch.setenv('SAMPLE_INTERVAL_BB_BB_BB_BB_BB_02', '0.1')
+    monkeypatch.setenv('SAMPLE_INTERVAL_CC_CC_CC_CC_CC_03', 'often')
+    assert load_sample_intervals() == {A: 30.0, B: pytest.approx(MIN_SAMPLE_INTERVAL)}
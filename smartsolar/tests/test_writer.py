@@ -0,0 +1,97 @@
+import json
+import os
+import shutil
+from data_index import (IndexBuilder, index_is_complete, index_path_for, load_index,
+                        query_file, rebuild_index)
+from writer import NDJSONWriter
+
+def record(day, second, device='AA:AA:AA:AA:AA:01'):
+    return {'timestamp': f"2025-05-{day:02d}T10:{second // 60:02d}:{second % 60:02d}+00:00",
+            'device_address': device, 'parsed_data': {'solar_power': second}}
+
+def lines(path):
+    with open(path) as f:
+        return f.read().splitlines()
+
+def write_all(data_dir, records, **kwargs):
+    os.makedirs(data_dir, exist_ok=True)
+    writer = NDJSONWriter(str(data_dir), **kwargs)
+    writer.start()
+    for r in records:
+        writer.write(r)
+    writer.close()
+    return writer
+
+def assert_index_matches_rebuild(path):
+    assert index_is_complete(path)
+    written = load_index(path)
+    rebuild_index(path)
+    assert written == load_index(path)
+
+def test_records_go_to_their_days_file_with_an_index(tmp_path):
+    records = [record(26, s) for s in range(0, 300, 7)] + [record(27, s) for s in range(0, 120, 5)]
+    writer = write_all(tmp_path, records)
+    for day, count in ((26, 43), (27, 24)):
+        path = writer.path_for_date(f"2025-05-{day}")
+        assert [json.loads(line) for line in lines(path)] == [r for r in records if r['timestamp'][8:10] == str(day)]
+        assert len(lines(path)) == count
+        assert_index_matches_rebuild(path)
+
+def test_resume_after_a_crash_terminates_the_partial_line_and_reindexes(tmp_path):
+    writer = write_all(tmp_path, [record(26, s) for s in range(0, 180, 10)])
+    path = writer.path_for_date('2025-05-26')
+    # Killed mid-line, and the index lost its last bucket
+    with open(path, 'a') as f:
+        f.write('{"timestamp":"2025-05-26T10:03')
+    with open(index_path_for(path)) as f:
+        buckets = f.readlines()
+    with open(index_path_for(path), 'w') as f:
+        f.writelines(buckets[:-1])
+
+    write_all(tmp_path, [record(26, s) for s in range(180, 300, 10)])
+    content = lines(path)
+    assert content[18] == '{"timestamp":"2025-05-26T10:03'
+    assert [json.loads(line)['parsed_data']['solar_power'] for line in content[:18] + content[19:]] == \
+        list(range(0, 300, 10))
+    assert_index_matches_rebuild(path)
+
+def test_index_resumed_across_restarts_answers_queries(tmp_path):
+    records = [record(26, s, f"AA:AA:AA:AA:AA:0{s % 3}") for s in range(0, 600, 4)]
+    for start in range(0, len(records), 40):
+        write_all(tmp_path, records[start:start + 40])
+    path = os.path.join(tmp_path, 'data_2025-05-26.ndjson')
+    assert len(lines(path)) == len(records)
+    assert index_is_complete(path)
+    for device in ('AA:AA:AA:AA:AA:00', 'AA:AA:AA:AA:AA:02'):
+        found = list(query_file(path, '2025-05-26T10:02:30', '2025-05-26T10:07:10', device))
+        assert found == [r for r in records if r['device_address'] == device
+                         and '2025-05-26T10:02:30' <= r['timestamp'][:19] <= '2025-05-26T10:07:10']
+
+def test_no_index_does_not_duplicate_lines(tmp_path, monkeypatch):
+    def broken_resume(cls, data_path):
+        raise OSError("index unreadable")
+    monkeypatch.setattr(IndexBuilder, 'resume', classmethod(broken_resume))
+    writer = NDJSONWriter(str(tmp_path))
+    for s in range(3):
+        writer._add(record(26, s))
+    writer._write_pending()
+    writer._write_pending()
+    writer._close_file()
+    assert len(lines(writer.path_for_date('2025-05-26'))) == 3
+    assert writer._pending == []
+
+def test_failed_day_is_retried_without_rewriting_the_days_before_it(tmp_path):
+    writer = NDJSONWriter(str(tmp_path))
+    blocked = writer.path_for_date('2025-05-27')
+    os.mkdir(blocked)   # opening the second day's file fails
+    for r in [record(26, 0), record(26, 1), record(27, 0)]:
+        writer._add(r)
+    writer._write_pending()
+    assert [item[0] for item in writer._pending] == ['2025-05-27']
+
+    shutil.rmtree(blocked)
+    writer._write_pending()
+    writer._close_file()
+    assert len(lines(writer.path_for_date('2025-05-26'))) == 2
+    assert len(lines(writer.path_for_date('2025-05-27'))) == 1
+    assert writer._pending == []
@@ -0,0 +1,283 @@
+"""
+Buffered background writer for the daily NDJSON data files.
+
+Records are handed over through a queue, so the collector's event loop never
+waits on the SD card. A background thread keeps the current day's file open,
+batches records into a single write, and flushes/fsyncs according to the
+configured durability policy. It also maintains each file's sidecar time
+index (see data_index.py) from the offsets it writes at, and passes every
+record to its listeners (e.g. the rollup engine) on the same thread.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from data_index import IndexBuilder, timestamp_minute
+
+logger = logging.getLogger(__name__)
+
+DURABILITY_POLICIES = ('none', 'flush', 'fsync')
+
+_STOP = object()
+
+def record_date(record):
+    """UTC date (YYYY-MM-DD) a record belongs to, taken from its timestamp."""
+    timestamp = record.get('timestamp')
+    if isinstance(timestamp, str) and len(timestamp) >= 10:
+        return timestamp[:10]
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+class NDJSONWriter:
+    """Append records to daily data_YYYY-MM-DD.ndjson files from a background thread.
+
+    Durability policies:
+    - none:  leave data in the process buffer until a batch fills it, rollover or close
+    - flush: flush every batch to the OS (survives a process crash)
+    - fsync: flush every batch and fsync every `fsync_records` records or
+             `fsync_interval` seconds (survives power loss)
+    """
+
+    def __init__(self, data_dir, durability='flush', flush_records=50, flush_interval=5.0,
+                 fsync_records=500, fsync_interval=60.0, max_pending=10000, listeners=(),
+                 on_batch=None):
+        if durability not in DURABILITY_POLICIES:
+            raise ValueError(f"Unknown durability policy: {durability}")
+        self.data_dir = data_dir
+        self.durability = durability
+        self.flush_records = max(1, flush_records)
+        self.flush_interval = flush_interval
+        self.fsync_records = max(1, fsync_records)
+        self.fsync_interval = fsync_interval
+        self.max_pending = max_pending
+        # Objects with add(record) and flush(final=False), called from the writer thread
+        self.listeners = list(listeners)
+        # Called from the writer thread with (records, seconds) after each batch is written
+        self.on_batch = on_batch
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._file = None
+        self._file_date = None
+        self._index = None
+        self._pending = []            # (date, encoded line, minute, device) not yet written
+        self._pending_since = None
+        self._unsynced_records = 0
+        self._last_sync = time.monotonic()
+
+    def start(self):
+        """Start the background writer thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='ndjson-writer', daemon=True)
+            self._thread.start()
+
+    def write(self, record):
+        """Queue a record for writing. Never blocks on disk I/O."""
+        self._queue.put(record)
+
+    def queue_depth(self):
+        """Number of records waiting in the queue (not yet batched)."""
+        return self._queue.qsize()
+
+    def close(self, timeout=10.0):
+        """Write everything still queued, sync and close the file."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error(f"NDJSON writer did not finish within {timeout}s")
+        self._thread = None
+
+    def path_for_date(self, date_str):
+        """Data file path for a UTC date."""
+        return os.path.join(self.data_dir, f"data_{date_str}.ndjson")
+
+    def _run(self):
+        """Writer thread: batch queued records and write them out."""
+        running = True
+        while running:
+            timeout = self._next_timeout()
+
+            try:
+                record = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                record = None
+
+            # Drain everything already queued in one go
+            while record is not None:
+                if record is _STOP:
+                    running = False
+                    break
+                self._add(record)
+                try:
+                    record = self._queue.get_nowait()
+                except queue.Empty:
+                    record = None
+
+            due = (self._pending_since is not None and
+                   time.monotonic() - self._pending_since >= self.flush_interval)
+            if not running or due or len(self._pending) >= self.flush_records:
+                self._write_pending()
+            self._maybe_sync(force=False)
+
+        self._write_pending()
+        self._close_file()
+        self._notify_flush(final=True)
+
+    def _next_timeout(self):
+        """Seconds until the next time-based flush or fsync is due (None if nothing is)."""
+        deadlines = []
+        if self._pending_since is not None:
+            deadlines.append(self._pending_since + self.flush_interval)
+        if self.durability == 'fsync' and self._unsynced_records:
+            deadlines.append(self._last_sync + self.fsync_interval)
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - time.monotonic())
+
+    def _add(self, record):
+        """Encode a record and add it to the pending batch."""
+        try:
+            # Readings have a generated encoder; dicts go through json (compact)
+            to_json = getattr(record, 'to_json', None)
+            if to_json is not None:
+                line = to_json() + '\n'
+            else:
+                line = json.dumps(record, separators=(',', ':')) + '\n'
+        except Exception as e:
+            logger.error(f"Error encoding record: {e}")
+            return
+        self._pending.append((record_date(record), line,
+                              timestamp_minute(record.get('timestamp')),
+                              record.get('device_address')))
+        for listener in self.listeners:
+            try:
+                listener.add(record)
+            except Exception as e:
+                logger.error(f"Error in writer listener {type(listener).__name__}: {e}")
+        if self._pending_since is None:
+            self._pending_since = time.monotonic()
+
+    def _write_pending(self):
+        """Write the pending batch, rolling over to a new file at UTC midnight."""
+        if not self._pending:
+            return
+        started = time.monotonic()
+        written = 0   # pending records handed to a file
+        try:
+            while written < len(self._pending):
+                date_str = self._pending[written][0]
+                end = written
+                while end < len(self._pending) and self._pending[end][0] == date_str:
+                    end += 1
+                self._open_for_date(date_str)
+                batch = self._pending[written:end]
+                self._file.write(''.join(item[1] for item in batch))
+                self._unsynced_records += end - written
+                written = end
+                # No index if resuming it failed; rebuilt when the file is next opened
+                if self._index is not None:
+                    # JSON is ASCII-encoded, so string length is the byte length
+                    for _, line, minute, device in batch:
+                        self._index.add(minute, device, len(line))
+            if self.durability != 'none':
+                self._file.flush()
+            self._flush_index()
+            if self.on_batch is not None:
+                self.on_batch(len(self._pending), time.monotonic() - started)
+            self._pending = []
+            self._pending_since = None
+            self._notify_flush()
+        except Exception as e:
+            logger.error(f"Error saving data: {str(e)}")
+            # Records already written are not retried, which would duplicate them
+            del self._pending[:written]
+            self._close_file(sync=False)
+            if len(self._pending) > self.max_pending:
+                dropped = len(self._pending) - self.max_pending
+                self._pending = self._pending[dropped:]
+                logger.error(f"Dropped {dropped} unwritten record(s)")
+            # Retry the rest on the next flush interval
+            self._pending_since = time.monotonic() if self._pending else None
+
+    def _notify_flush(self, final=False):
+        """Let listeners persist their state after a batch was written."""
+        for listener in self.listeners:
+            try:
+                listener.flush(final=final)
+            except Exception as e:
+                logger.error(f"Error flushing writer listener {type(listener).__name__}: {e}")
+
+    def _maybe_sync(self, force):
+        """fsync the open file when the policy says it is due."""
+        if self._file is None or self._unsynced_records == 0:
+            return
+        if self.durability != 'fsync' and not force:
+            return
+        now = time.monotonic()
+        if (force or self._unsynced_records >= self.fsync_records or
+                now - self._last_sync >= self.fsync_interval):
+            try:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except Exception as e:
+                logger.error(f"Error syncing data file: {e}")
+            self._unsynced_records = 0
+            self._last_sync = now
+
+    def _open_for_date(self, date_str):
+        """Make sure the file for `date_str` is the open one."""
+        if self._file is not None and self._file_date == date_str:
+            return
+        self._close_file()
+        path = self.path_for_date(date_str)
+        self._terminate_partial_line(path)
+        self._file = open(path, 'a', encoding='utf-8')
+        self._file_date = date_str
+        try:
+            self._index = IndexBuilder.resume(path)
+        except Exception as e:
+            logger.error(f"Error resuming index for {path}: {e}")
+            self._index = None
+        logger.info(f"Writing data to {path}")
+
+    def _terminate_partial_line(self, path):
+        """End a line cut short by a crash so new records start on their own line."""
+        try:
+            with open(path, 'rb+') as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() == 0:
+                    return
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+                    logger.warning(f"Terminated a partially written line in {path}")
+        except FileNotFoundError:
+            pass
+
+    def _close_file(self, sync=True):
+        """Flush, sync and close the current file."""
+        if self._file is None:
+            return
+        try:
+            if sync:
+                self._maybe_sync(force=True)
+            self._file.close()
+        except Exception as e:
+            logger.error(f"Error closing data file: {e}")
+        self._flush_index(close_open_bucket=sync)
+        self._file = None
+        self._file_date = None
+        self._index = None
+
+    def _flush_index(self, close_open_bucket=False):
+        """Append finished minute buckets to the sidecar index."""
+        if self._index is None:
+            return
+        try:
+            self._index.flush(close_open_bucket)
+        except Exception as e:
+            logger.error(f"Error writing index for {self._file_date}: {e}")
@@ -0,0 +1,8 @@
+"""
+WSGI entry point for running the dashboard under a production server.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+from dashboard import app
+
+application = app